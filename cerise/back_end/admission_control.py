@@ -0,0 +1,111 @@
+import logging
+from typing import List, Optional, Tuple
+
+from cerise.config import Config
+from cerise.job_store.job_state import JobState
+from cerise.job_store.sqlite_job_store import SQLiteJobStore
+
+_STAGING_STATES = [JobState.STAGING_IN, JobState.STAGING_IN_CR]
+"""States of jobs that are being staged in."""
+
+_NOT_RUNNING_STATES = _STAGING_STATES + [JobState.WAITING,
+                                         JobState.WAITING_CR]
+"""States of jobs that have (some) input staged, but are not running."""
+
+
+class AdmissionControl:
+    """Decides whether submitted jobs may be started.
+
+    Starting a job means staging its inputs and submitting it to the
+    compute resource. To avoid flooding the remote scheduler and file
+    system when many jobs are submitted at once, limits can be
+    configured on the number of jobs being staged, the number of jobs
+    on the compute resource, and the amount of input data staged for
+    jobs that are not yet running. Jobs that would exceed a limit are
+    left in SUBMITTED, and started later.
+
+    The counts are obtained from the job store by refresh(), which
+    should be called at the start of each pass through the jobs, and
+    updated by admitted() and started() during the pass, so that the
+    store is not queried again for every job.
+
+    Args:
+        job_store: The job store to get counts from.
+        config: The configuration to get the limits from.
+    """
+    def __init__(self, job_store: SQLiteJobStore, config: Config) -> None:
+        self._logger = logging.getLogger(__name__)
+        """Logger: The logger for this class."""
+        self._job_store = job_store
+        """The job store to get counts from."""
+        self._max_staging_jobs = config.get_max_staging_jobs()
+        """Maximum number of jobs being staged in."""
+        self._max_remote_jobs = config.get_max_remote_jobs()
+        """Maximum number of jobs on the compute resource."""
+        self._max_staged_bytes = config.get_max_staged_bytes()
+        """Maximum number of bytes staged for jobs not yet running."""
+
+        self._staging_jobs = 0
+        """Number of jobs currently being staged in."""
+        self._remote_jobs = 0
+        """Number of jobs currently on the compute resource."""
+        self._staged_bytes = 0
+        """Bytes staged for jobs that are not running yet."""
+        self._holding = False
+        """Whether we held back a job during this pass."""
+
+    def refresh(self) -> None:
+        """Get up-to-date counts from the job store.
+
+        The store must be locked by the caller.
+        """
+        counts = self._job_store.count_jobs_by_state()
+        self._staging_jobs = sum(counts.get(state, 0)
+                                 for state in _STAGING_STATES)
+        self._remote_jobs = sum(count for state, count in counts.items()
+                                if JobState.is_remote(state))
+        if self._max_staged_bytes is not None:
+            self._staged_bytes = self._job_store.get_staged_bytes(
+                _NOT_RUNNING_STATES)
+        self._holding = False
+
+    def may_admit(self) -> bool:
+        """Returns whether another job may be started now."""
+        reason = self._exceeded_limit()
+        if reason is not None and not self._holding:
+            self._logger.debug('Holding submitted jobs: {}'.format(reason))
+        self._holding = reason is not None
+        return reason is None
+
+    def admitted(self) -> None:
+        """Records that a job has started staging in."""
+        self._staging_jobs += 1
+
+    def started(self, staged_bytes: int) -> None:
+        """Records that a job has been submitted to the resource.
+
+        Args:
+            staged_bytes: The size of the job's staged inputs.
+        """
+        self._staging_jobs -= 1
+        self._remote_jobs += 1
+        self._staged_bytes += staged_bytes
+
+    def failed(self) -> None:
+        """Records that a job failed or was cancelled while staging."""
+        self._staging_jobs -= 1
+
+    def _exceeded_limit(self) -> Optional[str]:
+        """Returns a description of the exceeded limit, if any."""
+        limits = [
+                ('jobs staging in', self._staging_jobs,
+                 self._max_staging_jobs),
+                ('jobs on the compute resource',
+                 self._staging_jobs + self._remote_jobs,
+                 self._max_remote_jobs),
+                ('bytes staged', self._staged_bytes, self._max_staged_bytes)
+                ]  # type: List[Tuple[str, int, Optional[int]]]
+        for what, count, limit in limits:
+            if limit is not None and count >= limit:
+                return '{} {} of at most {}'.format(count, what, limit)
+        return None
@@ -0,0 +1,383 @@
+import hashlib
+import logging
+import shlex
+from itertools import chain
+from time import perf_counter
+from typing import Generator, Iterable, List, Optional, Set, Tuple
+
+import cerulean
+from cerulean import Path
+
+from cerise import metrics
+from cerise.back_end.transfer import StreamHash, TokenBucket
+from cerise.config import Config
+
+_MANIFEST = 'SHA256SUMS'
+"""Name of the file listing the parts and their hashes."""
+
+_MAX_ATTEMPTS = 3
+"""Number of times to try to get a part across intact."""
+
+
+class ChunkedTransfer:
+    """Copies large files in chunks, so that a copy can be resumed.
+
+    A large file is copied as a sequence of parts of a fixed size,
+    which are kept in a directory next to the target named
+    .<name>.parts. If the connection drops, the next attempt skips
+    the parts that were copied completely, and copies the missing
+    and partial ones. Each part's SHA-256 hash is checked against
+    that of the corresponding chunk of the source, and parts that do
+    not match are copied again. Once all parts are there, they are
+    joined into the target, and the parts are removed.
+
+    Cerulean cannot read or write part of a remote file, so splitting
+    files for download, and checking and joining them after upload,
+    is done on the compute resource's head node with the standard
+    split, sha256sum and cat commands. This uses the head node
+    scheduler, as for installing the API, and therefore requires
+    that the jobs and files are on the same machine, as they are
+    everywhere else. Joining, on the head node for uploads and
+    locally for downloads, is done into a temporary file, which is
+    then renamed to the target, so that the target never exists in a
+    partial state.
+
+    Args:
+        config: The configuration to get the chunk settings and \
+                the head node scheduler from.
+    """
+    def __init__(self, config: Config) -> None:
+        self._logger = logging.getLogger(__name__)
+        """Logger: The logger for this class."""
+        self._threshold = config.get_chunk_threshold()
+        """Files at least this large are copied in chunks, if set."""
+        self._chunk_size = config.get_chunk_size()
+        """The size of a chunk, in bytes."""
+        self._sched = None  # type: Optional[cerulean.Scheduler]
+        """Scheduler for running commands on the head node."""
+        if self._threshold is not None:
+            self._sched = config.get_scheduler(run_on_head_node=True)
+
+    def applies_to(self, source: Path) -> bool:
+        """Returns whether the given file should be copied in chunks.
+
+        Args:
+            source: The file to be copied.
+        """
+        return (self._threshold is not None and source.is_file()
+                and source.size() >= self._threshold)
+
+    def upload(self, source: Path, target: Path, direction: str = 'in',
+               bucket: Optional[TokenBucket] = None) -> Tuple[int, str, str]:
+        """Copies a local file to the compute resource in chunks.
+
+        Args:
+            source: The local file to copy.
+            target: The remote path to copy it to.
+            direction: The direction to record in the staging metrics.
+            bucket: A bucket to take tokens from as data is copied.
+
+        Returns:
+            The size of the file, its SHA-256 hash as hex, and its
+            CWL checksum.
+        """
+        start = perf_counter()
+        parts_dir = _parts_dir(target)
+        parts_dir.mkdir(0o700, parents=True, exists_ok=True)
+
+        manifest, hasher, sent = self._upload_parts(
+                source, parts_dir, None, bucket)
+        (parts_dir / _MANIFEST).write_text(_format_manifest(manifest))
+
+        failed = self._join_parts(parts_dir, target)
+        attempts = 1
+        while failed:
+            if attempts == _MAX_ATTEMPTS:
+                raise IOError('Could not copy {} to {} intact'.format(
+                    source, target))
+            self._logger.warning('Parts {} of {} were corrupted, copying'
+                                 ' them again'.format(sorted(failed), source))
+            _, _, resent = self._upload_parts(
+                    source, parts_dir, failed, bucket)
+            sent += resent
+            failed = self._join_parts(parts_dir, target)
+            attempts += 1
+
+        _record_metrics(direction, sent, start)
+        return hasher.size, hasher.digest, hasher.checksum
+
+    def download(self, source: Path, target: Path, direction: str = 'out',
+                 bucket: Optional[TokenBucket] = None
+                 ) -> Tuple[int, str, str]:
+        """Copies a file from the compute resource in chunks.
+
+        The parts are hashed as they are joined, so the hashes of the
+        whole file come without reading it again.
+
+        Args:
+            source: The remote file to copy.
+            target: The local path to copy it to.
+            direction: The direction to record in the staging metrics.
+            bucket: A bucket to take tokens from as data is copied.
+
+        Returns:
+            The size of the file, its SHA-256 hash as hex, and its
+            CWL checksum.
+        """
+        start = perf_counter()
+        remote_parts = _parts_dir(source)
+        if not (remote_parts / _MANIFEST).exists():
+            self._split_file(source, remote_parts)
+        manifest = _parse_manifest((remote_parts / _MANIFEST).read_text())
+
+        local_parts = _parts_dir(target)
+        local_parts.mkdir(0o700, parents=True, exists_ok=True)
+        received = 0
+        for name, digest in manifest:
+            part = local_parts / name
+            if part.exists() and _hash_file(part) == digest:
+                continue
+            received += _download_part(remote_parts / name, local_parts,
+                                       name, digest, bucket)
+
+        hasher = StreamHash()
+
+        def joined_data() -> Generator[bytes, None, None]:
+            for block in chain.from_iterable(
+                    (local_parts / name).streaming_read()
+                    for name, _ in manifest):
+                hasher.update(block)
+                yield block
+
+        partial = target.parent / '.{}.partial'.format(target.name)
+        partial.streaming_write(joined_data())
+        _rename(partial, target)
+
+        local_parts.rmdir(recursive=True)
+        remote_parts.rmdir(recursive=True)
+        _record_metrics(direction, received, start)
+        return hasher.size, hasher.digest, hasher.checksum
+
+    def _upload_parts(self, source: Path, parts_dir: Path,
+                      only: Optional[Set[str]],
+                      bucket: Optional[TokenBucket]
+                      ) -> Tuple[List[Tuple[str, str]], StreamHash, int]:
+        """Copies the missing parts of a file to the compute resource.
+
+        Args:
+            source: The local file to copy.
+            parts_dir: The remote directory to put the parts in.
+            only: Copy these parts even if they exist, and no others.
+            bucket: A bucket to take tokens from as data is copied.
+
+        Returns:
+            A list of part names and hashes, the size and hashes of
+            the whole file, and the number of bytes sent.
+        """
+        manifest = []  # type: List[Tuple[str, str]]
+        hasher = StreamHash()
+        sent = 0
+        for i, chunk in enumerate(_chunks(source.streaming_read(),
+                                          self._chunk_size)):
+            name = 'part.{:06d}'.format(i)
+            manifest.append((name, hashlib.sha256(chunk).hexdigest()))
+            hasher.update(chunk)
+
+            part = parts_dir / name
+            if only is None:
+                if part.exists() and part.size() == len(chunk):
+                    continue
+            elif name not in only:
+                continue
+
+            if bucket is not None:
+                bucket.take(len(chunk))
+            part.write_bytes(chunk)
+            sent += len(chunk)
+
+        return manifest, hasher, sent
+
+    def _join_parts(self, parts_dir: Path, target: Path) -> Set[str]:
+        """Checks the parts on the head node, and joins them if intact.
+
+        Only the parts in the manifest are joined, in its order, so
+        that parts left behind by an earlier attempt to copy a larger
+        version of the file, or with a different chunk size, are
+        ignored.
+
+        Args:
+            parts_dir: The remote directory with the parts.
+            target: The remote file to create.
+
+        Returns:
+            The names of any parts that did not match their hash.
+        """
+        partial = target.parent / '.{}.partial'.format(target.name)
+        script = (
+                'cd {parts} || exit 1\n'
+                'sha256sum -c --quiet {manifest} || exit 3\n'
+                'awk \'{{print $2}}\' {manifest} | xargs cat >{partial}'
+                ' || exit 1\n'
+                'mv {partial} {target} || exit 1\n'
+                'cd .. && rm -rf {parts}\n').format(
+                        parts=shlex.quote(str(parts_dir)),
+                        manifest=_MANIFEST,
+                        partial=shlex.quote(str(partial)),
+                        target=shlex.quote(str(target)))
+        exit_code, output = self._run_script(parts_dir, 'join.sh', script)
+        if exit_code == 3:
+            # e.g. "part.000001: FAILED" or "part.000002: FAILED open or
+            # read" for a missing part
+            failed = {line.split(':')[0] for line in output.splitlines()
+                      if ': FAILED' in line}
+            if not failed:
+                raise IOError('Could not check parts of {}: {}'.format(
+                    target, output))
+            return failed
+        if exit_code != 0:
+            raise IOError('Could not join parts into {}: exit code {}'
+                          .format(target, exit_code))
+        return set()
+
+    def _split_file(self, source: Path, parts_dir: Path) -> None:
+        """Splits a file into parts on the head node.
+
+        Args:
+            source: The remote file to split.
+            parts_dir: The remote directory to put the parts in.
+        """
+        parts_dir.mkdir(0o700, parents=True, exists_ok=True)
+        script = (
+                'cd {parts} || exit 1\n'
+                'split -b {size} -d -a 6 {source} part. || exit 1\n'
+                'sha256sum part.* >{manifest}.tmp || exit 1\n'
+                'mv {manifest}.tmp {manifest}\n').format(
+                        parts=shlex.quote(str(parts_dir)),
+                        size=self._chunk_size,
+                        source=shlex.quote(str(source)),
+                        manifest=_MANIFEST)
+        exit_code, _ = self._run_script(parts_dir, 'split.sh', script)
+        if exit_code != 0:
+            raise IOError('Could not split {}: exit code {}'.format(
+                source, exit_code))
+
+    def _run_script(self, parts_dir: Path, name: str,
+                    script: str) -> Tuple[int, str]:
+        """Runs a shell script on the head node and waits for it.
+
+        Args:
+            parts_dir: The remote directory to put the script in.
+            name: The file name for the script.
+            script: The script to run.
+
+        Returns:
+            The exit code and standard output of the script.
+        """
+        script_path = parts_dir.parent / '{}.{}'.format(parts_dir.name, name)
+        stdout = parts_dir.parent / '{}.out'.format(parts_dir.name)
+        script_path.write_text(script)
+
+        jobdesc = cerulean.JobDescription()
+        jobdesc.command = 'bash'
+        jobdesc.arguments = [str(script_path)]
+        jobdesc.stdout_file = str(stdout)
+
+        sched = self._sched
+        if sched is None:
+            raise RuntimeError('Chunked transfers are not enabled')
+        exit_code = sched.wait(sched.submit(jobdesc))
+        output = stdout.read_text() if stdout.exists() else ''
+        self._logger.debug('Output of {}: {}'.format(name, output))
+        script_path.unlink()
+        if stdout.exists():
+            stdout.unlink()
+        return (exit_code if exit_code is not None else -1), output
+
+
+def _parts_dir(path: Path) -> Path:
+    """Returns the directory that holds the parts of the given file."""
+    return path.parent / '.{}.parts'.format(path.name)
+
+
+def _rename(path: Path, target: Path) -> None:
+    """Renames a file, replacing any existing file at the target.
+
+    Path.rename() in Cerulean 0.3.7 compares the target's file system
+    to the path itself, and so always fails. This calls the file
+    system directly instead.
+    """
+    path.filesystem._rename(path._Path__path,    # type: ignore
+                            target._Path__path)  # type: ignore
+
+
+def _chunks(data: Iterable[bytes],
+            chunk_size: int) -> Generator[bytes, None, None]:
+    """Regroups a stream of data into chunks of the given size.
+
+    The last chunk may be shorter.
+    """
+    buf = bytearray()
+    for block in data:
+        buf.extend(block)
+        while len(buf) >= chunk_size:
+            yield bytes(buf[:chunk_size])
+            del buf[:chunk_size]
+    if buf:
+        yield bytes(buf)
+
+
+def _hash_file(path: Path) -> str:
+    """Returns the SHA-256 hash of a file as hex."""
+    hasher = hashlib.sha256()
+    for block in path.streaming_read():
+        hasher.update(block)
+    return hasher.hexdigest()
+
+
+def _download_part(source: Path, parts_dir: Path, name: str, digest: str,
+                   bucket: Optional[TokenBucket]) -> int:
+    """Copies a part from the compute resource, checking its hash.
+
+    Args:
+        source: The remote part.
+        parts_dir: The local directory to put it in.
+        name: The name of the part.
+        digest: The SHA-256 hash the part should have.
+        bucket: A bucket to take tokens from as data is copied.
+
+    Returns:
+        The number of bytes received.
+    """
+    received = 0
+    for _ in range(_MAX_ATTEMPTS):
+        data = source.read_bytes()
+        if bucket is not None:
+            bucket.take(len(data))
+        received += len(data)
+        if hashlib.sha256(data).hexdigest() == digest:
+            (parts_dir / name).write_bytes(data)
+            return received
+    raise IOError('Part {} of {} was corrupted {} times'.format(
+        name, source.parent, _MAX_ATTEMPTS))
+
+
+def _format_manifest(manifest: List[Tuple[str, str]]) -> str:
+    """Formats a list of names and hashes as sha256sum does."""
+    return ''.join('{}  {}\n'.format(digest, name)
+                   for name, digest in manifest)
+
+
+def _parse_manifest(text: str) -> List[Tuple[str, str]]:
+    """Parses the output of sha256sum into names and hashes."""
+    manifest = []  # type: List[Tuple[str, str]]
+    for line in text.splitlines():
+        digest, name = line.split(None, 1)
+        manifest.append((name.lstrip('*'), digest))
+    return manifest
+
+
+def _record_metrics(direction: str, nbytes: int, start: float) -> None:
+    """Records a chunked copy in the staging metrics."""
+    metrics.STAGING_DURATION.inc(perf_counter() - start, direction)
+    metrics.STAGED_BYTES.inc(nbytes, direction)
+    metrics.STAGED_FILES.inc(1, direction)
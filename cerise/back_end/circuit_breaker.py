@@ -0,0 +1,85 @@
+import logging
+import time
+from typing import Optional
+
+
+class CircuitBreaker:
+    """Stops all remote work while the compute resource is unreachable.
+
+    When connection problems keep occurring for different jobs, there
+    is no point in trying the next job, and the next, and so on. After
+    a given number of consecutive failures, the circuit breaker opens,
+    and allow() returns False until a timeout has passed. Then it lets
+    a single attempt through, the probe. If that succeeds, normal
+    operation resumes, if it fails, the breaker opens again, with a
+    timeout twice as long as before, up to a maximum. If the probe
+    reports neither, another one is let through after the same
+    timeout.
+
+    Callers should only call allow() right before they access the
+    compute resource, and report the result with record_success() or
+    record_failure().
+
+    Args:
+        threshold: The number of consecutive failures after which to
+                open.
+        initial_timeout: The time to stay open the first time, in
+                seconds.
+        max_timeout: The maximum time to stay open, in seconds.
+    """
+    def __init__(self, threshold: int, initial_timeout: float,
+                 max_timeout: float) -> None:
+        self._logger = logging.getLogger(__name__)
+        """Logger: The logger for this class."""
+        self._threshold = threshold
+        """Consecutive failures after which to open."""
+        self._initial_timeout = initial_timeout
+        """Time to stay open the first time."""
+        self._max_timeout = max_timeout
+        """Maximum time to stay open."""
+
+        self._failures = 0
+        """Number of consecutive failures."""
+        self._timeout = initial_timeout
+        """Time to stay open next time."""
+        self._open_until = None  # type: Optional[float]
+        """If open, the perf_counter() time of the next probe."""
+        self._open_for = initial_timeout
+        """The timeout the breaker was last opened with."""
+
+    def is_open(self) -> bool:
+        """Returns whether remote work is currently paused."""
+        return self._open_until is not None
+
+    def allow(self) -> bool:
+        """Returns whether remote work may be attempted now.
+
+        If the breaker is open and it is time for a probe, this
+        returns True once, and False to any further callers.
+        """
+        if self._open_until is None:
+            return True
+        now = time.perf_counter()
+        if now < self._open_until:
+            return False
+        self._open_until = now + self._open_for
+        return True
+
+    def record_success(self) -> None:
+        """Records a successful attempt, closing the breaker."""
+        if self._open_until is not None:
+            self._logger.info('Connection to compute resource restored')
+        self._failures = 0
+        self._timeout = self._initial_timeout
+        self._open_until = None
+
+    def record_failure(self) -> None:
+        """Records a failed attempt, opening the breaker if needed."""
+        self._failures += 1
+        if self._open_until is not None or self._failures >= self._threshold:
+            self._logger.warning(
+                'Connection to compute resource lost, pausing remote'
+                ' work for {:.0f} seconds'.format(self._timeout))
+            self._open_until = time.perf_counter() + self._timeout
+            self._open_for = self._timeout
+            self._timeout = min(self._timeout * 2.0, self._max_timeout)
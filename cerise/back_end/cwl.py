@@ -180,8 +180,11 @@ def get_files_from_binding(cwl_binding: Dict[str, Any]) -> List[File]:
                 if value.get('class') == 'File':
                     secondary_files = get_secondary_files(
                         value.get('secondaryFiles', []))
-                    result.append(
-                        File(name, None, value['location'], secondary_files))
+                    output_file = File(name, None, value['location'],
+                                       secondary_files)
+                    output_file.size = value.get('size')
+                    output_file.checksum = value.get('checksum')
+                    result.append(output_file)
                 elif value.get('class') == 'Directory':
                     raise RuntimeError(
                         'Directory inputs are not yet supported, sorry')
@@ -193,6 +196,8 @@ def get_files_from_binding(cwl_binding: Dict[str, Any]) -> List[File]:
                                 val.get('secondaryFiles', []))
                             input_file = File(name, i, val['location'],
                                               secondary_files)
+                            input_file.size = val.get('size')
+                            input_file.checksum = val.get('checksum')
                             result.append(input_file)
                         elif val.get('class') == 'Directory':
                             raise RuntimeError(
@@ -1,17 +1,28 @@
+import gzip
+import json
 import logging
+import os
 import time
 import traceback
-from typing import cast
+from http.server import HTTPServer
+from typing import List, Optional, cast
 
 import cerulean
 from paramiko.ssh_exception import SSHException  # type: ignore
 
+from cerise import metrics
+from cerise.back_end.admission_control import AdmissionControl
+from cerise.back_end.circuit_breaker import CircuitBreaker
 from cerise.back_end.cwl import get_cwltool_result, is_workflow
+from cerise.back_end.file import File
 from cerise.back_end.job_planner import InvalidJobError, JobPlanner
 from cerise.back_end.job_runner import JobRunner
 from cerise.back_end.local_files import ConnectionError, LocalFiles
+from cerise.back_end.profiler import Profiler
 from cerise.back_end.remote_api import RemoteApi
 from cerise.back_end.remote_job_files import RemoteJobFiles
+from cerise.back_end.transfer import CorruptedFileError
+from cerise.back_end.transfer_manager import TransferManager
 from cerise.config import Config
 from cerise.job_store.job_state import JobState
 from cerise.job_store.sqlite_job import SQLiteJob
@@ -42,18 +53,45 @@ class ExecutionManager:
         self._shutting_down = False
         """True iff we're shutting down."""
 
-        self._job_store = SQLiteJobStore(config.get_database_location())
+        self._job_store = SQLiteJobStore(config.get_database_location(),
+                                         trace_file=config.get_trace_file())
         """The job store to use."""
-        self._local_files = LocalFiles(self._job_store, config)
+        self._transfer_manager = TransferManager(config)
+        """Schedules all file transfers."""
+        self._local_files = LocalFiles(self._job_store, config,
+                                       self._transfer_manager)
         """The local files manager."""
         self._remote_api = RemoteApi(config, local_api_dir)
         """The remote API manager."""
         self._remote_refresh = config.get_remote_refresh()
 
+        self._retention_days = config.get_retention_days()
+        """Days to keep finished jobs, or None to keep them."""
+        self._retention_action = config.get_retention_action()
+        """What to do with expired jobs, 'delete' or 'archive'."""
+        self._archive_dir = None  # type: Optional[str]
+        """Local directory to archive expired jobs to."""
+        if self._retention_action == 'archive':
+            self._archive_dir = config.get_archive_dir()
+            os.makedirs(self._archive_dir, exist_ok=True)
+
+        self._metrics_server = None  # type: Optional[HTTPServer]
+        """Serves metrics over HTTP, if configured."""
+        metrics.add_job_state_collector(self._job_store)
+        metrics_port = config.get_metrics_port()
+        if metrics_port is not None:
+            self._metrics_server = metrics.start_http_server(
+                config.get_metrics_host(), metrics_port)
+
+        self._profiler = Profiler(config.get_profile_dir(),
+                                  config.get_profile_duration())
+        """Profiles the main loop on request."""
+
         self._job_planner = JobPlanner(self._job_store, local_api_dir)
         """Determines required hardware resources."""
 
-        self._remote_job_files = RemoteJobFiles(self._job_store, config)
+        self._remote_job_files = RemoteJobFiles(self._job_store, config,
+                                                self._transfer_manager)
         """The remote job files manager."""
 
         remote_cwlrunner = self._remote_api.translate_runner_location(
@@ -61,14 +99,32 @@ class ExecutionManager:
         self._job_runner = JobRunner(self._job_store, config, remote_cwlrunner)
         """The job runner submits jobs and checks on them."""
 
+        self._admission_control = AdmissionControl(self._job_store, config)
+        """Limits the number of jobs started at the same time."""
+
+        self._backoff_initial = config.get_backoff_initial()
+        """Delay before retrying a job after a connection problem."""
+        self._backoff_max = config.get_backoff_max()
+        """Maximum delay before retrying a job."""
+        self._circuit_breaker = CircuitBreaker(
+            config.get_circuit_breaker_threshold(), self._backoff_initial,
+            self._backoff_max)
+        """Pauses remote work while the connection is down."""
+
         # recover database from crash
         with self._job_store:
+            self._backed_off_jobs = {
+                job.id for job in self._job_store.list_backed_off_jobs()}
+            """Ids of jobs that had connection problems last time."""
+
             for job in self._job_store.list_jobs():
                 if job.state == JobState.STAGING_IN:
-                    self._remote_job_files.delete_job(job.id)
+                    # Keep the remote files, staging will skip the
+                    # ones that were completed before the restart.
                     job.state = JobState.SUBMITTED
                 if job.state == JobState.STAGING_OUT:
-                    self._local_files.delete_output_dir(job.id)
+                    # Keep the output directory, so that chunked
+                    # downloads can resume, the rest is overwritten.
                     job.state = JobState.FINISHED
                 if job.state == JobState.WAITING_CR:
                     self._job_runner.cancel_job(job.id)
@@ -87,6 +143,14 @@ class ExecutionManager:
         self._logger.debug('Shutdown requested')
         self._shutting_down = True
 
+    def toggle_profiling(self) -> None:
+        """Requests profiling of the main loop to start or stop.
+
+        This is safe to call from a signal handler. Jobs keep being
+        processed while profiling.
+        """
+        self._profiler.toggle()
+
     def _delete_job(self, job_id: str, job: SQLiteJob) -> None:
         """Delete a job.
 
@@ -104,6 +168,59 @@ class ExecutionManager:
         self._local_files.delete_output_dir(job_id)
         self._job_store.delete_job(job_id)
 
+    def _archive_job(self, job_id: str) -> None:
+        """Write all stored data on a job to the archive.
+
+        The job is written to a gzipped JSON file named after its id
+        in the archive directory. The file is written under a
+        temporary name first, so that there are never any partial
+        files in the archive.
+
+        Args:
+            job_id: The id of the job to archive.
+        """
+        archive_file = os.path.join(cast(str, self._archive_dir),
+                                    job_id + '.json.gz')
+        tmp_file = archive_file + '.tmp'
+        job_data = self._job_store.export_job(job_id)
+        with gzip.open(tmp_file, 'wt', encoding='utf-8') as f:
+            json.dump(job_data, f)
+        os.replace(tmp_file, archive_file)
+
+    def _apply_retention_policy(self) -> None:
+        """Remove jobs that have been finished for longer than the
+        configured retention time.
+
+        Expired jobs are archived first if so configured, and then
+        deleted just like when the client deletes them. State change
+        events older than the retention time are removed as well.
+        Afterwards, some of the freed space in the database is
+        released.
+        """
+        if self._retention_days is None:
+            return
+
+        cutoff = time.time() - self._retention_days * 24 * 3600
+        expired_jobs = self._job_store.list_expired_jobs(cutoff)
+        for job in expired_jobs:
+            if self._shutting_down:
+                break
+            self._logger.debug('Job {} expired'.format(job.id))
+            try:
+                if self._archive_dir is not None:
+                    self._archive_job(job.id)
+                self._delete_job(job.id, job)
+            except (ConnectionError, IOError, EOFError, OSError,
+                    SSHException) as e:
+                self._logger.info('Could not remove expired job {}: {},'
+                                  ' will try again later'.format(job.id, e))
+                break
+
+        self._job_store.delete_events(cutoff)
+
+        if expired_jobs != []:
+            self._job_store.vacuum()
+
     def _cancel_job(self, job_id: str, job: SQLiteJob) -> None:
         """Cancel a job.
 
@@ -139,7 +256,8 @@ class ExecutionManager:
         """
         try:
             job.info('Resolving inputs')
-            input_files = self._local_files.resolve_input(job_id)
+            with job.timing('resolve_input'):
+                input_files = self._local_files.resolve_input(job_id)
         except FileNotFoundError as e:
             job.error('Input not found, failing with PermanentFailure')
             job.state = JobState.PERMANENT_FAILURE
@@ -149,6 +267,20 @@ class ExecutionManager:
             job.state = JobState.PERMANENT_FAILURE
             return
 
+        try:
+            self._plan_and_start_job(job_id, job, input_files)
+        finally:
+            self._local_files.release_input(input_files)
+
+    def _plan_and_start_job(self, job_id: str, job: SQLiteJob,
+                            input_files: List[File]) -> None:
+        """Plans, stages and starts a job whose input has been resolved.
+
+        Args:
+            job_id: The id of the job
+            job: The job object
+            input_files: The job's resolved input files
+        """
         if not is_workflow(cast(bytes, job.workflow_content)):
             job.error('Input is not a CWL workflow')
             job.state = JobState.PERMANENT_FAILURE
@@ -160,7 +292,8 @@ class ExecutionManager:
 
         job.info('Resolved input, now planning')
         try:
-            self._job_planner.plan_job(job_id)
+            with job.timing('plan_job'):
+                self._job_planner.plan_job(job_id)
         except InvalidJobError:
             job.error('Job is invalid')
             job.state = JobState.PERMANENT_FAILURE
@@ -170,11 +303,13 @@ class ExecutionManager:
             return
 
         job.info('Planned job, now staging in inputs')
-        workflow_content = self._remote_api.translate_workflow(
-            cast(bytes, job.workflow_content))
+        with job.timing('translate_workflow'):
+            workflow_content = self._remote_api.translate_workflow(
+                cast(bytes, job.workflow_content))
         try:
-            self._remote_job_files.stage_job(job_id, input_files,
-                                             workflow_content)
+            with job.timing('stage_job'):
+                self._remote_job_files.stage_job(job_id, input_files,
+                                                 workflow_content)
         except FileNotFoundError as e:
             job.error('Input not found, failing with PermanentFailure')
             job.state = JobState.PERMANENT_FAILURE
@@ -184,7 +319,8 @@ class ExecutionManager:
         job.info('API versions:')
         for project_version in self._remote_api.get_projects():
             job.info('  {}'.format(project_version))
-        self._job_runner.start_job(job_id)
+        with job.timing('start_job'):
+            self._job_runner.start_job(job_id)
         job.info('Started job')
 
         if not (job.try_transition(JobState.STAGING_IN, JobState.WAITING)
@@ -210,17 +346,66 @@ class ExecutionManager:
 
         if job.try_transition(JobState.FINISHED, JobState.STAGING_OUT):
             job.info('Starting destaging of results')
-            output_files = self._remote_job_files.destage_job_output(
-                job_id)
-            self._local_files.publish_job_output(job_id, output_files)
+            with job.timing('destage_job_output'):
+                output_files = self._remote_job_files.destage_job_output(
+                    job_id)
+            with job.timing('publish_job_output'):
+                self._local_files.publish_job_output(job_id, output_files)
 
             job.info('Results downloaded and available')
+            lazy_outputs = job.get_lazy_outputs()
+            if lazy_outputs:
+                job.info('{} output files will be downloaded when they are'
+                         ' first requested'.format(len(lazy_outputs)))
 
             if not (job.try_transition(JobState.STAGING_OUT, result)
                     or job.try_transition(JobState.STAGING_OUT_CR,
                                           JobState.CANCELLED)):
                 job.state = JobState.SYSTEM_ERROR
 
+    def _fetch_requested_outputs(self) -> None:
+        """Destage lazy output files that clients have asked for.
+
+        These are output files of jobs submitted with lazy output,
+        which were left on the compute resource when the job finished.
+        """
+        requested = self._job_store.list_requested_outputs()
+        for job_id, locations in requested.items():
+            if self._shutting_down or not self._circuit_breaker.allow():
+                break
+
+            job = self._job_store.get_job(job_id)
+            output_files = self._remote_job_files.locate_outputs(
+                job_id, locations)
+            try:
+                with job.timing('publish_lazy_output', accumulate=True):
+                    self._local_files.publish_lazy_outputs(
+                        job_id, output_files)
+                self._circuit_breaker.record_success()
+            except FileNotFoundError as e:
+                job.error('Requested output is no longer available on the'
+                          ' compute resource: {}'.format(e))
+                for location in locations:
+                    job.remove_lazy_output(location)
+            except CorruptedFileError as e:
+                job.error('Requested output could not be fetched intact:'
+                          ' {}'.format(e))
+                for location in locations:
+                    job.remove_lazy_output(location)
+            except (ConnectionError, IOError, EOFError, OSError, SSHException
+                    ) as e:
+                if not _is_temporary(e):
+                    job.error('An IO error occurred while fetching requested'
+                              ' output: {}'.format(e))
+                    self._logger.critical(traceback.format_exc())
+                    for location in locations:
+                        job.remove_lazy_output(location)
+                    continue
+                metrics.REMOTE_ERRORS.inc()
+                self._circuit_breaker.record_failure()
+                job.debug('Connection problem while fetching output: {}, will'
+                          ' try again'.format(e.args[0] if e.args else e))
+
     def _process_jobs(self, check_remote: bool) -> bool:
         """
         Go through the jobs and do what needs to be done.
@@ -236,21 +421,45 @@ class ExecutionManager:
         # so that we don't install updates while jobs are running.
         have_running_jobs = not check_remote
 
-        jobs = self._job_store.list_jobs()
-        for job_id in [job.id for job in jobs]:
+        self._admission_control.refresh()
+
+        # Jobs in progress go first, so that they free up slots for the
+        # submitted jobs, which then get them in order of priority.
+        # Jobs that are backing off after a connection problem are
+        # left out until their time has come.
+        now = time.time()
+        pending_ids = [
+                job.id for job in self._job_store.list_pending_jobs(now)]
+        pending = set(pending_ids)
+        job_ids = [job.id for job in self._job_store.list_jobs(now)
+                   if job.id not in pending]
+        job_ids.extend(pending_ids)
+
+        for job_id in job_ids:
             if self._shutting_down:
                 break
 
             try:
                 job = self._job_store.get_job(job_id)
                 previous_state = job.state
+                if not self._needs_remote(job, check_remote):
+                    continue
+
+                # Only jobs that access the compute resource count as
+                # attempts, so that jobs with nothing to do do not
+                # close the circuit breaker, or use up its probe.
+                if not self._circuit_breaker.allow():
+                    have_running_jobs = True
+                    break
+
                 self._logger.debug('Processing job ' + job_id +
                                    ' with current state ' + job.state.value)
 
                 if check_remote and JobState.is_remote(job.state):
                     self._logger.debug('Checking remote state')
-                    self._job_runner.update_job(job_id)
-                    self._remote_job_files.update_job(job_id)
+                    with job.timing('poll_status', accumulate=True):
+                        self._job_runner.update_job(job_id)
+                        self._remote_job_files.update_job(job_id)
                     job = self._job_store.get_job(job_id)
                     have_running_jobs = (
                             have_running_jobs
@@ -260,10 +469,23 @@ class ExecutionManager:
                 if job.state == JobState.FINISHED:
                     self._destage_job(job_id, job)
 
-                if not self._update_available:
+                if (not self._update_available
+                        and previous_state == JobState.SUBMITTED
+                        and self._admission_control.may_admit()):
                     if job.try_transition(JobState.SUBMITTED,
                                           JobState.STAGING_IN):
-                        self._stage_and_start_job(job_id, job)
+                        self._admission_control.admitted()
+                        try:
+                            self._stage_and_start_job(job_id, job)
+                        except BaseException:
+                            self._admission_control.failed()
+                            raise
+                        if JobState.is_remote(job.state):
+                            self._admission_control.started(sum(
+                                staged.size for staged
+                                in job.get_staged_files().values()))
+                        else:
+                            self._admission_control.failed()
                         self._logger.debug('Staged and started job')
 
                 if JobState.cancellation_active(job.state):
@@ -274,29 +496,35 @@ class ExecutionManager:
                 if job.please_delete and JobState.is_final(job.state):
                     self._delete_job(job_id, job)
 
+                self._circuit_breaker.record_success()
+                if job_id in self._backed_off_jobs:
+                    self._backed_off_jobs.remove(job_id)
+                    job.reset_backoff()
+
             except (ConnectionError, IOError, EOFError, OSError, SSHException
                     ) as e:
                 self._logger.debug('System exception while processing job:'
                                    ' {}'.format(e))
-                if isinstance(e, IOError) or isinstance(e, OSError):
-                    if ('Socket' not in str(e) and
-                        'Network' not in str(e) and
-                        'Temporary' not in str(e) and
-                        'Timeout opening channel' not in str(e)):
-                        job.error('An IO error occurred while processing the'
-                            ' job: {}. Please check that your network'
-                            ' connection works, and that you have enough'
-                            ' disk space or quota on the remote machine.'
-                            ''.format(e))
-                        job.state = JobState.SYSTEM_ERROR
-                        self._logger.critical('An internal error occurred when'
-                                              ' processing job ' + job.id)
-                        self._logger.critical(traceback.format_exc())
-                        return False
+                if not _is_temporary(e):
+                    job.error('An IO error occurred while processing the'
+                        ' job: {}. Please check that your network'
+                        ' connection works, and that you have enough'
+                        ' disk space or quota on the remote machine.'
+                        ''.format(e))
+                    job.state = JobState.SYSTEM_ERROR
+                    self._logger.critical('An internal error occurred when'
+                                          ' processing job ' + job.id)
+                    self._logger.critical(traceback.format_exc())
+                    return False
+                metrics.REMOTE_ERRORS.inc()
+                self._circuit_breaker.record_failure()
                 job = self._job_store.get_job(job_id)
-                job.debug('Connection problem with remote resource: {}, will'
-                          ' try again later'.format(e.args[0]))
                 job.state = previous_state
+                delay = job.back_off(self._backoff_initial, self._backoff_max)
+                self._backed_off_jobs.add(job_id)
+                job.debug('Connection problem with remote resource: {}, will'
+                          ' try again in {:.0f} seconds'.format(
+                              e.args[0] if e.args else e, delay))
                 have_running_jobs = True
 
             except:
@@ -305,8 +533,25 @@ class ExecutionManager:
                     'An internal error occurred when processing job ' + job.id)
                 self._logger.critical(traceback.format_exc())
 
+        metrics.CIRCUIT_OPEN.set(float(self._circuit_breaker.is_open()))
         return have_running_jobs
 
+    def _needs_remote(self, job: SQLiteJob, check_remote: bool) -> bool:
+        """Returns whether processing a job will access the compute resource.
+
+        Args:
+            job: The job to be processed.
+            check_remote: Whether remote jobs are to be polled.
+        """
+        state = job.state
+        return ((check_remote and JobState.is_remote(state))
+                or state == JobState.FINISHED
+                or (state == JobState.SUBMITTED
+                    and not self._update_available
+                    and self._admission_control.may_admit())
+                or JobState.cancellation_active(state)
+                or (job.please_delete and JobState.is_final(state)))
+
     def execute_jobs(self) -> None:
         """Run the main backend execution loop.
 
@@ -320,19 +565,57 @@ class ExecutionManager:
             # break the sleep call; catch it to exit gracefully
             try:
                 while not self._shutting_down:
+                    self._profiler.poll()
                     now = time.perf_counter()
                     check_remote = now - last_active > self._remote_refresh
+                    if check_remote:
+                        metrics.BACKEND_REMOTE_LAG.set(max(
+                            now - last_active - self._remote_refresh, 0.0))
 
                     have_running_jobs = self._process_jobs(check_remote)
+                    self._fetch_requested_outputs()
+                    self._job_store.flush_log()
                     if not have_running_jobs and self._update_available:
                         self._remote_api.install()
                         self._update_available = False
 
                     if check_remote:
+                        if not self._circuit_breaker.is_open():
+                            self._apply_retention_policy()
                         last_active = time.perf_counter()
 
+                    metrics.BACKEND_LOOP_DURATION.observe(
+                        time.perf_counter() - now, str(check_remote).lower())
                     time.sleep(0.1)
 
             except KeyboardInterrupt:
                 pass
+
+        self._profiler.stop()
+        self._local_files.close()
+
+        if self._metrics_server is not None:
+            self._metrics_server.shutdown()
+            self._metrics_server.server_close()
+        metrics.REGISTRY.remove_collector(metrics.JOB_STATE_COLLECTOR)
+        self._job_store.close()
         self._logger.debug('Shutting down')
+
+
+def _is_temporary(error: Exception) -> bool:
+    """Returns whether an error is a connection problem that may go away.
+
+    Other IO errors, e.g. a full disk or a corrupted file, will not
+    be solved by trying again.
+
+    Args:
+        error: An exception raised while accessing the compute resource.
+    """
+    if isinstance(error, CorruptedFileError):
+        return False
+    if isinstance(error, IOError) or isinstance(error, OSError):
+        return ('Socket' in str(error) or
+                'Network' in str(error) or
+                'Temporary' in str(error) or
+                'Timeout opening channel' in str(error))
+    return True
@@ -30,3 +30,7 @@ class File:
         """The source of the file."""
         self.secondary_files = secondary_files
         """CWL secondary files."""
+        self.size = None  # type: Optional[int]
+        """The size of the file in bytes, if known."""
+        self.checksum = None  # type: Optional[str]
+        """The CWL checksum of the file, e.g. sha1$<hex>, if known."""
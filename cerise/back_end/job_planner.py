@@ -1,10 +1,11 @@
 import logging
-from typing import Dict, cast
+from typing import Dict, Tuple, cast
 
 import cerulean
 
 from cerise.back_end.cwl import (get_required_num_cores, get_time_limit,
                                  get_workflow_step_names)
+from cerise.job_store.sqlite_job import SQLiteJob
 from cerise.job_store.sqlite_job_store import SQLiteJobStore
 
 
@@ -36,6 +37,11 @@ class JobPlanner:
         """Requirements per step, keyed by step name and requirement
                 name.
         """
+        self._plans = dict()  # type: Dict[str, Tuple[int, int]]
+        """Number of cores and time limit, keyed by workflow hash. Many
+                jobs run the same workflow, so this saves parsing it
+                for every job.
+        """
         self._get_steps_resource_requirements(local_api_dir)
 
     def plan_job(self, job_id: str) -> None:
@@ -50,26 +56,41 @@ class JobPlanner:
         """
         with self._job_store:
             job = self._job_store.get_job(job_id)
+            workflow_hash = cast(str, job.workflow_hash)
+            if workflow_hash not in self._plans:
+                self._plans[workflow_hash] = self._plan_workflow(job)
+            job.required_num_cores, job.time_limit = self._plans[
+                workflow_hash]
+
+    def _plan_workflow(self, job: SQLiteJob) -> Tuple[int, int]:
+        """Figures out which resources a job's workflow needs.
 
-            steps = get_workflow_step_names(cast(bytes, job.workflow_content))
-            for step in steps:
-                if step not in self._steps_requirements:
-                    job.error('Found invalid step {} in workflow'.format(step))
-                    raise InvalidJobError('Invalid step in workflow')
-
-            job.required_num_cores = get_required_num_cores(
-                cast(bytes, job.workflow_content))
-            num_cores_steps = [
-                self._steps_requirements[step]['num_cores'] for step in steps
-            ]
-            if max(num_cores_steps) > 0:
-                job.required_num_cores = max(num_cores_steps)
-
-            job.time_limit = get_time_limit(cast(bytes, job.workflow_content))
-            time_limit_steps = [
-                self._steps_requirements[step]['time_limit'] for step in steps
-            ]
-            job.time_limit = max(job.time_limit, sum(time_limit_steps))
+        Args:
+            job: The job whose workflow to plan.
+
+        Returns:
+            The number of cores and the time limit in seconds.
+        """
+        workflow_content = cast(bytes, job.workflow_content)
+        steps = get_workflow_step_names(workflow_content)
+        for step in steps:
+            if step not in self._steps_requirements:
+                job.error('Found invalid step {} in workflow'.format(step))
+                raise InvalidJobError('Invalid step in workflow')
+
+        required_num_cores = get_required_num_cores(workflow_content)
+        num_cores_steps = [
+            self._steps_requirements[step]['num_cores'] for step in steps
+        ]
+        if max(num_cores_steps) > 0:
+            required_num_cores = max(num_cores_steps)
+
+        time_limit = get_time_limit(workflow_content)
+        time_limit_steps = [
+            self._steps_requirements[step]['time_limit'] for step in steps
+        ]
+        time_limit = max(time_limit, sum(time_limit_steps))
+        return required_num_cores, time_limit
 
     def _get_steps_resource_requirements(self,
                                          local_api_dir: cerulean.Path) -> None:
@@ -3,6 +3,7 @@ from math import ceil
 
 import cerulean
 
+from cerise import metrics
 from cerise.config import Config
 from cerise.job_store.job_state import JobState
 from cerise.job_store.sqlite_job_store import SQLiteJobStore
@@ -49,7 +50,8 @@ class JobRunner:
         self._logger.debug("Updating job " + job_id + " from remote job")
         with self._job_store:
             job = self._job_store.get_job(job_id)
-            status = self._sched.get_status(job.remote_job_id)
+            with metrics.SCHEDULER_CALL_DURATION.timer('get_status'):
+                status = self._sched.get_status(job.remote_job_id)
             if status == cerulean.JobStatus.RUNNING:
                 job.try_transition(JobState.WAITING, JobState.RUNNING)
                 job.try_transition(JobState.WAITING_CR, JobState.RUNNING_CR)
@@ -102,7 +104,8 @@ class JobRunner:
             if self._scheduler_options:
                 jobdesc.extra_scheduler_options = self._scheduler_options
 
-            job.remote_job_id = self._sched.submit(jobdesc)
+            with metrics.SCHEDULER_CALL_DURATION.timer('submit'):
+                job.remote_job_id = self._sched.submit(jobdesc)
             self._logger.debug('Job submitted')
 
     def cancel_job(self, job_id: str) -> bool:
@@ -127,8 +130,10 @@ class JobRunner:
         with self._job_store:
             job = self._job_store.get_job(job_id)
             if JobState.is_remote(job.state):
-                status = self._sched.get_status(job.remote_job_id)
+                with metrics.SCHEDULER_CALL_DURATION.timer('get_status'):
+                    status = self._sched.get_status(job.remote_job_id)
                 if status == cerulean.JobStatus.RUNNING:
-                    new_state = self._sched.cancel(job.remote_job_id)
+                    with metrics.SCHEDULER_CALL_DURATION.timer('cancel'):
+                        new_state = self._sched.cancel(job.remote_job_id)
                     return new_state == cerulean.JobStatus.RUNNING
         return False
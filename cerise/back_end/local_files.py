@@ -1,28 +1,41 @@
 import json
 import logging
+import os
 import urllib
-from typing import List, cast
+from time import perf_counter, time
+from typing import Any, Dict, List, Optional, cast
 
-import cerulean
 import requests
-from cerulean import LocalFileSystem, Path, WebdavFileSystem
+from cerulean import LocalFileSystem, Path
 
+from cerise.back_end.chunked_transfer import ChunkedTransfer
 from cerise.back_end.cwl import get_files_from_binding
 from cerise.back_end.file import File
+from cerise.back_end.transfer import (CorruptedFileError, can_link,
+                                      copy_and_hash_file, hash_file,
+                                      link_file)
+from cerise.back_end.transfer_manager import TransferManager
+from cerise.back_end.web_cache import WebCache
+from cerise.back_end.web_sources import WebSources
 from cerise.config import Config
+from cerise.job_store.sqlite_job import SQLiteJob, StagedFile
 from cerise.job_store.sqlite_job_store import SQLiteJobStore
 
 ConnectionError = requests.exceptions.ConnectionError
 
 
 class LocalFiles:
-    def __init__(self, job_store: SQLiteJobStore, config: Config) -> None:
+    def __init__(self, job_store: SQLiteJobStore, config: Config,
+                 transfer_manager: Optional[TransferManager] = None
+                 ) -> None:
         """Create a LocalFiles object.
         Sets up local directory structure as well.
 
         Args:
             job_store: The job store to use
             config: The configuration.
+            transfer_manager: The transfer manager to copy files \
+                    through, by default a new one.
         """
         self._logger = logging.getLogger(__name__)
         """The logger for this class."""
@@ -35,10 +48,35 @@ class LocalFiles:
         self._baseurl = config.get_store_location_client()
         """The externally accessible base URL corresponding to the _basedir."""
 
+        self._chunked_transfer = ChunkedTransfer(config)
+        """Copies large output files resumably."""
+        self._link_files = config.get_link_files()
+        """Whether to link output files rather than copy them."""
+        if transfer_manager is None:
+            transfer_manager = TransferManager(config)
+        self._transfer_manager = transfer_manager
+        """Schedules output file copies."""
+        self._web_sources = WebSources(config.get_web_connections(),
+                                       config.get_web_timeout())
+        """Connections to web servers that input files come from."""
+        self._web_cache = None  # type: Optional[WebCache]
+        """Local copies of files from web servers, if enabled."""
+        cache_dir = config.get_web_cache_dir()
+        if cache_dir is not None:
+            self._web_cache = WebCache(cache_dir, config.get_web_cache_size(),
+                                       self._web_sources)
+
         self._basedir.mkdir(exists_ok=True)
         (self._basedir / 'input').mkdir(exists_ok=True)
         (self._basedir / 'output').mkdir(exists_ok=True)
 
+    def close(self) -> None:
+        """Closes any open connections to web servers.
+
+        To be called on shutdown.
+        """
+        self._web_sources.close()
+
     def resolve_secondary_files(self, secondary_files: List[File]) -> None:
         """Makes a File object for each secondary file.
 
@@ -67,7 +105,10 @@ class LocalFiles:
 
 
         This function will accept local file:// URLs as well as
-        remote http:// URLs.
+        remote http:// and https:// URLs. Remote files are served
+        from the web cache if it is enabled, the sizes of any others
+        are requested from their servers concurrently. Cached files
+        are kept until release_input() is called for them.
 
         Args:
             job_id: The id of the job whose input to resolve.
@@ -79,30 +120,113 @@ class LocalFiles:
         with self._job_store:
             job = self._job_store.get_job(job_id)
 
-            self._logger.debug('Resolving workflow input from {}'.format(
-                job.workflow))
-            job.workflow_content = self._get_source_from_url(
-                job.workflow).read_bytes()
+            self._resolve_workflow(job)
 
             inputs = json.loads(job.local_input)
             input_files = get_files_from_binding(inputs)
-            for input_file in input_files:
-                self._logger.debug(
-                    "Resolving file for input {} from {}".format(
-                        input_file.name, input_file.location))
-                input_file.source = self._get_source_from_url(
-                    input_file.location)
-                self.resolve_secondary_files(input_file.secondary_files)
+            try:
+                for input_file in input_files:
+                    self._logger.debug(
+                        "Resolving file for input {} from {}".format(
+                            input_file.name, input_file.location))
+                    input_file.source = self._get_source_from_url(
+                        input_file.location)
+                    self.resolve_secondary_files(input_file.secondary_files)
+            except BaseException:
+                self.release_input(input_files)
+                raise
+
+            web_files = [
+                    input_file for input_file in input_files
+                    if input_file.size is None
+                    and self._is_web_url(input_file.location)
+                    and not isinstance(cast(Path, input_file.source)
+                                       .filesystem, LocalFileSystem)]
+            sizes = self._web_sources.sizes(
+                    [web_file.location for web_file in web_files])
+            for web_file, size in zip(web_files, sizes):
+                web_file.size = size
 
             return input_files
 
+    def release_input(self, input_files: List[File]) -> None:
+        """Lets go of input files once they have been staged.
+
+        This allows files from the web cache to be removed again.
+
+        Args:
+            input_files: Files returned by resolve_input().
+        """
+        if self._web_cache is None:
+            return
+        for input_file in input_files:
+            if input_file.source is not None:
+                self._web_cache.release(input_file.source)
+            self.release_input(input_file.secondary_files)
+
+    def _resolve_workflow(self, job: SQLiteJob) -> None:
+        """Resolves the workflow for a job.
+
+        Workflows are stored once by the job store, and shared between
+        jobs. If the workflow was resolved from the same URL before and
+        has not changed since, it is not downloaded again.
+
+        Args:
+            job: The job whose workflow to resolve.
+        """
+        self._logger.debug('Resolving workflow input from {}'.format(
+            job.workflow))
+        source = self._get_source_from_url(job.workflow)
+        try:
+            validator = self._get_validator(job.workflow, source)
+            if validator is not None:
+                content_hash = self._job_store.get_workflow_source(
+                    job.workflow, validator)
+                if content_hash is not None:
+                    self._logger.debug('Using previously resolved workflow')
+                    job.workflow_hash = content_hash
+                    return
+
+            job.workflow_content = source.read_bytes()
+            if validator is not None:
+                self._job_store.set_workflow_source(
+                    job.workflow, validator, cast(str, job.workflow_hash))
+        finally:
+            if self._web_cache is not None:
+                self._web_cache.release(source)
+
+    def _get_validator(self, url: str, source: Path) -> Optional[str]:
+        """Returns a string that changes when the source file changes.
+
+        For local files, this is based on the modification time and
+        size, for files on a web server on the ETag or Last-Modified
+        header, even if they are served from the web cache.
+
+        Args:
+            url: The URL the source was obtained from.
+            source: The file to describe.
+
+        Returns:
+            A validator string, or None if the source cannot be
+            validated, in which case it should not be cached.
+        """
+        if (isinstance(source.filesystem, LocalFileSystem)
+                and not self._is_web_url(url)):
+            try:
+                stat = os.stat(str(source))
+            except FileNotFoundError:
+                return None
+            return 'mtime:{}:{}'.format(stat.st_mtime_ns, stat.st_size)
+
+        return self._web_sources.validator(url)
+
     def create_output_dir(self, job_id: str) -> None:
         """Create an output directory for a job.
 
         Args:
             job_id: The id of the job to make a work directory for.
         """
-        (self._basedir / 'output' / job_id).mkdir()
+        (self._basedir / 'output' / job_id).mkdir(exists_ok=True)
 
     def delete_output_dir(self, job_id: str) -> None:
         """Delete the output directory for a job.
@@ -123,6 +247,15 @@ class LocalFiles:
         updates its .output property with URLs pointing to the newly
         published files, then sets .output_files to None.
 
+        If the job has eager_outputs set, only the files of those
+        outputs are copied, and the others are recorded as lazy
+        outputs, to be copied by publish_lazy_outputs() when they are
+        requested. They get the same URLs either way.
+
+        The size and checksum of each copied file are calculated while
+        it is copied, and added to the output, so that clients can
+        check their downloads without reading the files twice.
+
         Args:
             job_id: The id of the job whose output to publish.
             output_files: List of output files to publish.
@@ -134,31 +267,148 @@ class LocalFiles:
             if output_files != []:
                 output = json.loads(job.remote_output)
                 self.create_output_dir(job_id)
+                eager_outputs = job.eager_outputs
+                to_publish = [
+                        outf for outf in output_files
+                        if eager_outputs is None
+                        or outf.name in eager_outputs]
+                self._transfer_manager.map(
+                    lambda outf: self._publish_file(job_id, outf),
+                    to_publish, [outf.size for outf in to_publish])
                 for outf in output_files:
-                    out_file = job_dir / outf.location
-                    cerulean.copy(cast(Path, outf.source), out_file)
-
-                    output[outf.name]['location'] = self._to_external_url(
+                    if outf not in to_publish:
+                        job.add_lazy_output(outf.location)
+                    output_desc = _output_desc(output, outf)
+                    output_desc['location'] = self._to_external_url(
                         'output/' + job_id + '/' + outf.location)
-                    output[outf.name]['path'] = str(out_file)
+                    output_desc['path'] = str(job_dir / outf.location)
+                    if outf.size is not None:
+                        output_desc['size'] = outf.size
+                    if outf.checksum is not None:
+                        output_desc['checksum'] = outf.checksum
 
                 job.local_output = json.dumps(output)
 
+    def publish_lazy_outputs(self, job_id: str,
+                             output_files: List[File]) -> None:
+        """Copy output files that were left on the compute resource.
+
+        Their sizes and checksums are added to the job's output.
+
+        Args:
+            job_id: The id of the job whose output to publish.
+            output_files: The lazy output files to publish, with their
+                    locations as recorded by publish_job_output().
+        """
+        self._logger.debug("Publishing lazy output for job " + job_id)
+        with self._job_store:
+            job = self._job_store.get_job(job_id)
+            self._transfer_manager.map(
+                lambda outf: self._publish_file(job_id, outf),
+                output_files, [outf.size for outf in output_files])
+
+            output = json.loads(job.local_output)
+            published = {
+                    self._to_external_url(
+                        'output/' + job_id + '/' + outf.location): outf
+                    for outf in output_files}
+            for output_file in get_files_from_binding(output):
+                outf = published.get(output_file.location)
+                if outf is not None and outf.checksum is not None:
+                    output_desc = _output_desc(output, output_file)
+                    output_desc['size'] = outf.size
+                    output_desc['checksum'] = outf.checksum
+            job.local_output = json.dumps(output)
+
+            for outf in output_files:
+                job.remove_lazy_output(outf.location)
+
+    def _publish_file(self, job_id: str, output_file: File) -> None:
+        """Copy an output file to the local output dir for its job.
+
+        This runs in a TransferManager worker thread.
+
+        The size of the file, and its checksum if it was copied rather
+        than linked, are stored in output_file. If the CWL runner gave
+        a checksum, the copy is checked against it, and removed if it
+        does not match, raising CorruptedFileError. Files that were
+        published completely before and whose copy has not changed
+        since are not copied again.
+
+        Args:
+            job_id: The id of the job whose output to publish.
+            output_file: The output file to publish.
+        """
+        out_file = self._basedir / 'output' / job_id / output_file.location
+        source = self._transfer_manager.remote(
+                cast(Path, output_file.source))
+        with self._job_store:
+            job = self._job_store.get_job(job_id)
+            published = job.get_published_files().get(output_file.location)
+            if published is not None and _is_published(source, out_file,
+                                                       published):
+                job.info('Output file {} was already published'.format(
+                    output_file.location))
+                nbytes, checksum = published.size, published.checksum
+            else:
+                start, start_counter = time(), perf_counter()
+                linked = None  # type: Optional[int]
+                if self._link_files and can_link(source, out_file):
+                    linked = link_file(source, out_file, 'out')
+                if linked is not None:
+                    nbytes, digest, checksum = linked, '', None
+                elif self._chunked_transfer.applies_to(source):
+                    nbytes, digest, checksum = (
+                            self._chunked_transfer.download(
+                                source, out_file, 'out',
+                                self._transfer_manager.bucket))
+                else:
+                    nbytes, digest, checksum = copy_and_hash_file(
+                            source, out_file, 'out',
+                            self._transfer_manager.bucket)
+                if (checksum and output_file.checksum is not None
+                        and checksum != output_file.checksum):
+                    out_file.unlink()
+                    raise CorruptedFileError(
+                            'Output file {} was corrupted while copying:'
+                            ' expected {}, got {}'.format(
+                                output_file.location, output_file.checksum,
+                                checksum))
+                checksum = checksum or None
+                job.add_published_file(output_file.location, nbytes, digest,
+                                       checksum)
+                job.add_timing('publish_file', start,
+                               perf_counter() - start_counter, nbytes,
+                               output_file.location)
+
+            output_file.size = nbytes
+            if checksum is not None:
+                output_file.checksum = checksum
+
+    def _is_web_url(self, url: str) -> bool:
+        """Returns whether a URL refers to a file on a web server.
+
+        Args:
+            url: The URL of an input file.
+        """
+        if self._baseurl and url.startswith(self._baseurl):
+            return False
+        return urllib.parse.urlparse(url).scheme in ('http', 'https')
+
     def _get_source_from_url(self, url: str) -> Path:
         """Return the source referenced by a URL.
 
         This function will accept local file:// URLs as well as
-        remote http:// URLs. If a URL starts with the client-side
-        location of the file exchange store, the service-side location
-        is substituted before trying to access the file.
+        remote http:// and https:// URLs. If a URL starts with the
+        client-side location of the file exchange store, the
+        service-side location is substituted before trying to access
+        the file.
 
         Args:
             url: The URL to get the content of
 
         Returns:
-            A Path for the file, so it can be copied, and a file
-            system if one was made specially and it needs to be
-            closed when we're done staging.
+            A Path for the file, so it can be copied.
         """
         if self._baseurl and url.startswith(self._baseurl):
             source = self._basedir / url[len(self._baseurl):]
@@ -173,14 +423,10 @@ class LocalFiles:
                     raise ValueError('Cerise is configured to only accept'
                                      ' local files from {}'.format(
                                          self._baseurl))
-            elif parsed_url.scheme == 'http':
-                base_url, _, name = parsed_url.path.rpartition('/')
-                fs = WebdavFileSystem('http://{}'.format(base_url))
-                # Note that the fs leaks here, it won't be closed, which
-                # is okay because the HTTP server will drop the connection
-                # quickly anyway, and the fs will be deleted when the path
-                # disappears after staging by refcount or gc.
-                return fs / name
+            elif parsed_url.scheme in ('http', 'https'):
+                if self._web_cache is not None:
+                    return self._web_cache.get(url)
+                return self._web_sources.get(url)
             else:
                 raise ValueError('Invalid scheme {} in input URL: {}'.format(
                     parsed_url.scheme, url))
@@ -202,3 +448,36 @@ class LocalFiles:
 
     def _to_external_url(self, rel_path: str) -> str:
         return self._baseurl + '/' + rel_path
+
+
+def _output_desc(output: Dict[str, Any], output_file: File
+                 ) -> Dict[str, Any]:
+    """Return the CWL File object for an output file.
+
+    Args:
+        output: The job's output object.
+        output_file: The output file.
+    """
+    if output_file.index is not None:
+        return output[cast(str, output_file.name)][output_file.index]
+    return output[cast(str, output_file.name)]
+
+
+def _is_published(source: Path, target: Path,
+                  published: StagedFile) -> bool:
+    """Return whether a previously published file is still up to date.
+
+    Both files must still have the recorded size, and the published
+    copy must still have the recorded hash. The output file on the
+    compute resource is not read, as that would take as long as
+    publishing it again. Linked files are always published again.
+
+    Args:
+        source: The output file on the compute resource.
+        target: The published copy.
+        published: What was recorded when the file was published.
+    """
+    return (published.hash != '' and source.is_file() and
+            target.is_file() and source.size() == published.size and
+            target.size() == published.size and
+            hash_file(target) == published.hash)
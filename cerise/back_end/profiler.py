@@ -0,0 +1,98 @@
+import cProfile
+import faulthandler
+import logging
+import os
+import pstats
+import time
+from typing import Optional
+
+
+class Profiler:
+    """Profiles the back-end main loop on request.
+
+    Profiling is switched on and off by calling toggle(), which is
+    safe to do from a signal handler, as it only sets a flag. The
+    main loop calls poll() on every iteration, which does the actual
+    work. Profiling stops by itself after the configured duration.
+
+    When profiling stops, three files are written to the output
+    directory, all named cerise-<timestamp>:
+
+    - .prof contains the raw statistics, for use with pstats or
+      snakeviz,
+    - .txt contains a summary sorted by cumulative time,
+    - .stacks.txt contains the current stack of every thread.
+
+    Args:
+        output_dir: The local directory to write results to.
+        duration: The maximum time to profile for, in seconds.
+    """
+    def __init__(self, output_dir: str, duration: float) -> None:
+        self._logger = logging.getLogger(__name__)
+        """Logger: The logger for this class."""
+        self._output_dir = output_dir
+        """The local directory to write results to."""
+        self._duration = duration
+        """The maximum time to profile for, in seconds."""
+        self._toggle_requested = False
+        """Whether toggle() was called since the last poll()."""
+        self._profile = None  # type: Optional[cProfile.Profile]
+        """The running profile, if any."""
+        self._start_time = 0.0
+        """When the running profile was started."""
+
+    def toggle(self) -> None:
+        """Request profiling to be started or stopped."""
+        self._toggle_requested = True
+
+    def is_running(self) -> bool:
+        """Return whether the profiler is currently running."""
+        return self._profile is not None
+
+    def poll(self) -> None:
+        """Start or stop profiling, if needed.
+
+        This must be called from the thread to be profiled.
+        """
+        toggle_requested = self._toggle_requested
+        self._toggle_requested = False
+
+        if self._profile is None:
+            if toggle_requested:
+                self._start()
+        elif (toggle_requested or
+              time.perf_counter() - self._start_time > self._duration):
+            self.stop()
+
+    def stop(self) -> None:
+        """Stop profiling, if running, and write the results."""
+        if self._profile is None:
+            return
+
+        self._profile.disable()
+        profile = self._profile
+        self._profile = None
+
+        try:
+            os.makedirs(self._output_dir, exist_ok=True)
+            base_name = os.path.join(
+                self._output_dir,
+                'cerise-{}'.format(time.strftime('%Y%m%d-%H%M%S')))
+
+            profile.dump_stats(base_name + '.prof')
+            with open(base_name + '.txt', 'w') as f:
+                stats = pstats.Stats(profile, stream=f)
+                stats.sort_stats('cumulative').print_stats(50)
+            with open(base_name + '.stacks.txt', 'w') as f:
+                faulthandler.dump_traceback(f, all_threads=True)
+
+            self._logger.info('Profile written to {}.*'.format(base_name))
+        except OSError as e:
+            self._logger.error('Could not write profile: {}'.format(e))
+
+    def _start(self) -> None:
+        self._logger.info('Profiling for at most {} seconds'.format(
+            self._duration))
+        self._profile = cProfile.Profile()
+        self._start_time = time.perf_counter()
+        self._profile.enable()
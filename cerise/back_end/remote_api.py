@@ -8,6 +8,7 @@ import yaml
 from paramiko.ssh_exception import SSHException  # type: ignore
 from retrying import retry
 
+from cerise import metrics
 from cerise.config import Config
 
 
@@ -68,14 +69,18 @@ class RemoteApi:
             self._local_api_dir, self._remote_api_dir))
 
         try:
-            for project_name in self._updatable_projects():
-                local_project_dir = self._local_api_dir / project_name
-                remote_project_dir = self._make_remote_project(project_name)
-                self._stage_api_files(local_project_dir, remote_project_dir)
-                self._stage_api_steps(local_project_dir, remote_project_dir)
-                self._stage_install_script(local_project_dir,
-                                           remote_project_dir)
-                self._run_install_script(remote_project_dir)
+            with metrics.API_INSTALL_DURATION.timer():
+                for project_name in self._updatable_projects():
+                    local_project_dir = self._local_api_dir / project_name
+                    remote_project_dir = self._make_remote_project(
+                        project_name)
+                    self._stage_api_files(local_project_dir,
+                                          remote_project_dir)
+                    self._stage_api_steps(local_project_dir,
+                                          remote_project_dir)
+                    self._stage_install_script(local_project_dir,
+                                               remote_project_dir)
+                    self._run_install_script(remote_project_dir)
         except IOError as e:
             self._logger.critical('An IO error occurred while uploading the'
                                   ' API: {}. Please check that your network'
@@ -1,14 +1,20 @@
 import json
 import logging
 import re
-from typing import Any, Dict, List, cast
+from time import perf_counter, time
+from typing import Any, Dict, List, Optional, Tuple, cast
 
 import cerulean
 from cerulean import Path
 
+from cerise.back_end.chunked_transfer import ChunkedTransfer
 from cerise.back_end.cwl import get_files_from_binding
 from cerise.back_end.file import File
+from cerise.back_end.transfer import (can_link, copy_and_hash_file,
+                                      copy_as_bundle, hash_file, link_file)
+from cerise.back_end.transfer_manager import TransferManager
 from cerise.config import Config
+from cerise.job_store.sqlite_job import StagedFile
 from cerise.job_store.sqlite_job_store import SQLiteJobStore
 
 
@@ -28,7 +34,9 @@ class RemoteJobFiles:
     - jobs/<job_id>/stderr.txt is the standard error of the CWL runner
     """
 
-    def __init__(self, job_store: SQLiteJobStore, config: Config) -> None:
+    def __init__(self, job_store: SQLiteJobStore, config: Config,
+                 transfer_manager: Optional[TransferManager] = None
+                 ) -> None:
         """Create a RemoteJobFiles object.
         Sets up remote directory structure as well, but refuses to
         create the top-level directory.
@@ -36,6 +44,8 @@ class RemoteJobFiles:
         Args:
             job_store: The job store to use.
             config: The configuration.
+            transfer_manager: The transfer manager to copy files \
+                    through, by default a new one.
         """
         self._logger = logging.getLogger(__name__)
         """Logger: The logger for this class."""
@@ -45,6 +55,24 @@ class RemoteJobFiles:
         """str: The remote user name to use, if any."""
         self._basedir = config.get_basedir()
         """Path: The remote path to the directory where the API files are."""
+        self._chunked_transfer = ChunkedTransfer(config)
+        """ChunkedTransfer: Copies large input files resumably."""
+        if transfer_manager is None:
+            transfer_manager = TransferManager(config)
+        self._transfer_manager = transfer_manager
+        """TransferManager: Schedules input file copies."""
+        self._bundle_threshold = config.get_bundle_threshold()
+        """int: Number of input files from which to stage an archive."""
+        self._bundle_compression = config.get_bundle_compression()
+        """int: Compression level for input archives."""
+        self._bundle_max_size = config.get_bundle_max_size()
+        """int: Size from which input files are not put in archives."""
+        self._link_files = config.get_link_files()
+        """bool: Whether to link input files rather than copy them."""
+        self._sched = None  # type: Optional[cerulean.Scheduler]
+        """cerulean.Scheduler: Scheduler for unpacking archives."""
+        if self._bundle_threshold is not None:
+            self._sched = config.get_scheduler(run_on_head_node=True)
 
         # Create directories if they don't exist
         self._logger.debug('basedir: {}'.format(self._basedir))
@@ -83,16 +111,32 @@ class RemoteJobFiles:
 
             # stage input files
             inputs = json.loads(job.local_input)
+            to_stage = []  # type: List[Tuple[str, File]]
             count = 1
             for input_file in input_files:
                 if input_file.index is not None:
                     input_desc = inputs[input_file.name][input_file.index]
                 else:
                     input_desc = inputs[input_file.name]
-                count = self._stage_input_file(count, job_id, input_file,
-                                               input_desc)
+                count = self._plan_input_file(count, job_id, input_file,
+                                              input_desc, to_stage)
+
+            if (self._bundle_threshold is not None and
+                    len(to_stage) >= self._bundle_threshold):
+                to_stage = self._stage_bundle(job_id, to_stage)
+            self._transfer_manager.map(
+                lambda item: self._stage_input_file(job_id, *item),
+                to_stage, [_input_size(input_file)
+                           for _, input_file in to_stage])
+
+            # stage input description, with what we learned on the way
+            for input_file in input_files:
+                if input_file.index is not None:
+                    input_desc = inputs[input_file.name][input_file.index]
+                else:
+                    input_desc = inputs[input_file.name]
+                _describe_input_file(input_file, input_desc)
 
-            # stage input description
             inputs_json = json.dumps(inputs).encode('utf-8')
             self._add_file_to_job(job_id, 'input.json', inputs_json)
             job.remote_input_path = str(self._abs_path(job_id, 'input.json'))
@@ -144,6 +188,26 @@ class RemoteJobFiles:
         # does not come from the store, so we're not leaking here
         return output_files
 
+    def locate_outputs(self, job_id: str, locations: List[str]) -> List[File]:
+        """Return Files for output files still on the compute resource.
+
+        Args:
+            job_id: The id of the job the files are outputs of.
+            locations: The locations of the files, relative to the
+                    job's work directory, as in the Files returned by
+                    destage_job_output().
+
+        Returns:
+            A File for each location, with its source set.
+        """
+        work_dir = self._basedir / 'jobs' / job_id / 'work'
+        output_files = []  # type: List[File]
+        for location in locations:
+            output_file = File(None, None, location, [])
+            output_file.source = work_dir / location
+            output_files.append(output_file)
+        return output_files
+
     def delete_job(self, job_id: str) -> None:
         """Remove the work directory for a job.
         This will remove the directory and everything in it, if it exists.
@@ -173,17 +237,18 @@ class RemoteJobFiles:
                 job.remote_output = output.decode()
 
             # get log
-            log = self._read_remote_file(job_id, 'stderr.txt')
-            if len(log) > 0:
-                lines = log.decode().splitlines()
-                last_lines = job.remote_error.splitlines()
-                first_new_line = len(last_lines)
+            log = self._read_remote_file(job_id, 'stderr.txt').decode()
+            last_log = job.remote_error
+            if len(log) > 0 and log != last_log:
+                lines = log.splitlines()
+                first_new_line = len(last_log.splitlines())
                 job.debug(lines[first_new_line:])
-                job.remote_error = log.decode()
+                job.remote_error = log
 
-    def _stage_input_file(self, count: int, job_id: str, input_file: File,
-                          input_desc: Dict[str, Any]) -> int:
-        """Stage an input file. Copies the file to the remote resource.
+    def _plan_input_file(self, count: int, job_id: str, input_file: File,
+                         input_desc: Dict[str, Any],
+                         to_stage: List[Tuple[str, File]]) -> int:
+        """Decide where to stage an input file and its secondary files.
 
         Uses count to create unique file names, returns the new count \
         (i.e. the next available number).
@@ -194,6 +259,8 @@ class RemoteJobFiles:
             input_file: The input file to stage
             input_desc: The input description whose location \
                     (and secondaryFiles) to update.
+            to_stage: List to append (remote path, file) pairs to, \
+                    with the path relative to the job directory.
 
         Returns:
             The updated count
@@ -202,23 +269,152 @@ class RemoteJobFiles:
             str(count).zfill(2), input_file.location)
         count += 1
 
-        with self._job_store:
-            job = self._job_store.get_job(job_id)
-            job.info('Staging input file {}'.format(input_file.location))
-
-        target_path = self._abs_path(job_id, 'work/{}'.format(staged_name))
-        cerulean.copy(cast(Path, input_file.source), target_path)
-
-        input_desc['location'] = str(
-            self._abs_path(job_id, 'work/' + staged_name))
+        rel_path = 'work/{}'.format(staged_name)
+        to_stage.append((rel_path, input_file))
+        input_desc['location'] = str(self._abs_path(job_id, rel_path))
 
         for i, secondary_file in enumerate(input_file.secondary_files):
             sec_input_desc = input_desc['secondaryFiles'][i]
-            count = self._stage_input_file(count, job_id, secondary_file,
-                                           sec_input_desc)
+            count = self._plan_input_file(count, job_id, secondary_file,
+                                          sec_input_desc, to_stage)
 
         return count
 
+    def _stage_input_file(self, job_id: str, rel_path: str,
+                          input_file: File) -> None:
+        """Stage an input file. Copies the file to the remote resource.
+
+        This runs in a TransferManager worker thread.
+
+        Args:
+            job_id: The job id to stage for
+            rel_path: The remote path relative to the job directory
+            input_file: The input file to stage
+        """
+        with self._job_store:
+            job = self._job_store.get_job(job_id)
+            source = cast(Path, input_file.source)
+            target_path = self._transfer_manager.remote(
+                    self._abs_path(job_id, rel_path))
+
+            staged = job.get_staged_files().get(rel_path)
+            if staged is not None and _is_staged(source, target_path,
+                                                 staged):
+                job.info('Input file {} was already staged'.format(
+                    input_file.location))
+                _set_checksum(input_file, staged.size, staged.checksum)
+            else:
+                job.info('Staging input file {}'.format(input_file.location))
+                start, start_counter = time(), perf_counter()
+                linked = None  # type: Optional[int]
+                if self._link_files and can_link(source, target_path):
+                    linked = link_file(source, target_path, 'in')
+                if linked is not None:
+                    nbytes, digest, checksum = linked, '', ''
+                elif self._chunked_transfer.applies_to(source):
+                    nbytes, digest, checksum = self._chunked_transfer.upload(
+                            source, target_path, 'in',
+                            self._transfer_manager.bucket)
+                else:
+                    nbytes, digest, checksum = copy_and_hash_file(
+                            source, target_path, 'in',
+                            self._transfer_manager.bucket)
+                if linked is None:
+                    # linked files take no space, and are linked
+                    # again rather than checked when staging resumes
+                    job.add_staged_file(rel_path, nbytes, digest,
+                                        checksum or None)
+                _set_checksum(input_file, nbytes, checksum or None)
+                job.add_timing('stage_file', start,
+                               perf_counter() - start_counter,
+                               nbytes, input_file.location)
+
+    def _stage_bundle(self, job_id: str, to_stage: List[Tuple[str, File]]
+                      ) -> List[Tuple[str, File]]:
+        """Stage input files as a single archive.
+
+        This sends the files over a single channel as a tar file,
+        which is unpacked on the head node, saving a round trip per
+        file. Files that were staged before are skipped, and
+        directories, files of at least the maximum bundle size and
+        files that can be linked are left to be staged separately.
+
+        Args:
+            job_id: The job id to stage for
+            to_stage: Pairs of remote path relative to the job \
+                    directory and input file.
+
+        Returns:
+            The pairs that still need to be staged.
+        """
+        with self._job_store:
+            job = self._job_store.get_job(job_id)
+            staged_files = job.get_staged_files()
+            bundled = []  # type: List[Tuple[str, File]]
+            remaining = []  # type: List[Tuple[str, File]]
+            for rel_path, input_file in to_stage:
+                source = cast(Path, input_file.source)
+                staged = staged_files.get(rel_path)
+                if staged is not None and _is_staged(
+                        source, self._abs_path(job_id, rel_path),
+                        staged):
+                    _set_checksum(input_file, staged.size, staged.checksum)
+                    continue
+                if self._link_files and can_link(
+                        source, self._abs_path(job_id, rel_path)):
+                    remaining.append((rel_path, input_file))
+                elif (source.is_file() and
+                        cast(int, _input_size(input_file))
+                        < self._bundle_max_size and
+                        not self._chunked_transfer.applies_to(source)):
+                    bundled.append((rel_path, input_file))
+                else:
+                    remaining.append((rel_path, input_file))
+
+            if bundled == []:
+                return remaining
+
+            job.info('Staging {} input files as an archive'.format(
+                len(bundled)))
+            suffix = '.tar.gz' if self._bundle_compression > 0 else '.tar'
+            bundle = self._abs_path(job_id, 'inputs' + suffix)
+            start, start_counter = time(), perf_counter()
+            _, hashes = copy_as_bundle(
+                    [(cast(Path, input_file.source), rel_path)
+                     for rel_path, input_file in bundled],
+                    bundle, 'in', self._bundle_compression,
+                    self._transfer_manager.bucket)
+            self._unpack_bundle(job_id, bundle)
+
+            for (rel_path, input_file), (size, digest, checksum) in zip(
+                    bundled, hashes):
+                job.add_staged_file(rel_path, size, digest, checksum)
+                _set_checksum(input_file, size, checksum)
+            job.add_timing('stage_file', start, perf_counter() - start_counter,
+                           sum(size for size, _, _ in hashes),
+                           '{} files in {}'.format(len(bundled), bundle.name))
+        return remaining
+
+    def _unpack_bundle(self, job_id: str, bundle: Path) -> None:
+        """Unpack an archive into the job directory on the head node.
+
+        Args:
+            job_id: The job whose directory to unpack into
+            bundle: The archive, which is removed afterwards
+        """
+        unpack = cerulean.JobDescription()
+        unpack.command = 'tar'
+        unpack.arguments = ['-x', '-f', str(bundle),
+                            '-C', str(self._abs_path(job_id, ''))]
+        if self._bundle_compression > 0:
+            unpack.arguments.insert(1, '-z')
+        sched = cast(cerulean.Scheduler, self._sched)
+        exit_code = sched.wait(sched.submit(unpack))
+        if exit_code != 0:
+            raise RuntimeError('Failed to unpack input archive: {}'.format(
+                exit_code))
+        bundle.unlink()
+
     def _add_file_to_job(self, job_id: str, rel_path: str,
                          data: bytes) -> None:
         """Write a file on the remote resource containing the given raw data.
@@ -281,3 +477,74 @@ def _create_input_filename(unique_prefix: str, orig_path: str) -> str:
         result = result[:18] + '___' + result[-18:]
 
     return unique_prefix + '_' + result
+
+
+def _is_staged(source: Path, target: Path, staged: StagedFile) -> bool:
+    """Return whether a previously staged file is still up to date.
+
+    Both files must still have the recorded size, and the source must
+    still have the recorded hash, so that a source that was changed
+    since is staged again. The remote copy is not read back, as that
+    would take as long as staging it again.
+
+    Only regular files that were copied are checked, directories and
+    linked files are always staged again.
+
+    Args:
+        source: The local file that was staged.
+        target: The remote copy.
+        staged: What was recorded when the file was staged.
+    """
+    return (staged.hash != '' and source.is_file() and target.is_file() and
+            source.size() == staged.size and
+            target.size() == staged.size and
+            hash_file(source) == staged.hash)
+
+
+def _set_checksum(input_file: File, size: int,
+                  checksum: Optional[str]) -> None:
+    """Record the size and checksum of a staged input file.
+
+    Directories and linked files have no checksum, in which case
+    any checksum given by the user is kept.
+
+    Args:
+        input_file: The file that was staged.
+        size: Its size in bytes.
+        checksum: Its CWL checksum, if known.
+    """
+    if checksum is not None:
+        input_file.size = size
+        input_file.checksum = checksum
+
+
+def _describe_input_file(input_file: File,
+                         input_desc: Dict[str, Any]) -> None:
+    """Add the size and checksum of a staged file to its description.
+
+    This saves the CWL runner from reading the file again to find
+    them. Secondary files are described as well.
+
+    Args:
+        input_file: The file that was staged.
+        input_desc: Its CWL File object in the input description.
+    """
+    if input_file.checksum is not None:
+        input_desc['size'] = input_file.size
+        input_desc['checksum'] = input_file.checksum
+    for i, secondary_file in enumerate(input_file.secondary_files):
+        _describe_input_file(secondary_file,
+                             input_desc['secondaryFiles'][i])
+
+
+def _input_size(input_file: File) -> Optional[int]:
+    """Return the size of an input file, if it is a regular file.
+
+    Args:
+        input_file: The file, with its source set.
+    """
+    if input_file.size is None:
+        source = cast(Path, input_file.source)
+        if source.is_file():
+            input_file.size = source.size()
+    return input_file.size
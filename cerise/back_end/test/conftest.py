@@ -1,6 +1,10 @@
 import copy
+import hashlib
 import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
 from pathlib import Path
+from socketserver import ThreadingMixIn
 
 import cerulean
 import pytest
@@ -40,6 +44,18 @@ class MockConfig:
         exchange_path = tmpdir / 'local_exchange'
         exchange_path.mkdir()
         self._exchange_path = str(exchange_path)
+        self.chunk_threshold = None
+        self.chunk_size = 16
+        self.bundle_threshold = None
+        self.bundle_compression = 0
+        self.bundle_max_size = 16 * 2**20
+        self.transfer_streams = 1
+        self.transfer_bandwidth = None
+        self.link_files = False
+        self.web_connections = 4
+        self.web_timeout = 30.0
+        self.web_cache_dir = None
+        self.web_cache_size = 1000
 
     def get_scheduler(self, run_on_head_node=False):
         term = cerulean.LocalTerminal()
@@ -60,15 +76,51 @@ class MockConfig:
     def get_remote_cwl_runner(self):
         return '$CERISE_API/cerise/files/cwltiny.py'
 
-    def get_file_system(self):
+    def get_file_system(self, stream=0):
         return self._file_system
 
+    def get_transfer_streams(self):
+        return self.transfer_streams
+
+    def get_transfer_bandwidth(self):
+        return self.transfer_bandwidth
+
+    def get_link_files(self):
+        return self.link_files
+
+    def get_web_connections(self):
+        return self.web_connections
+
+    def get_web_timeout(self):
+        return self.web_timeout
+
+    def get_web_cache_dir(self):
+        return self.web_cache_dir
+
+    def get_web_cache_size(self):
+        return self.web_cache_size
+
     def get_basedir(self):
         return self._base_dir
 
     def get_username(self, kind):
         return None
 
+    def get_chunk_threshold(self):
+        return self.chunk_threshold
+
+    def get_chunk_size(self):
+        return self.chunk_size
+
+    def get_bundle_threshold(self):
+        return self.bundle_threshold
+
+    def get_bundle_compression(self):
+        return self.bundle_compression
+
+    def get_bundle_max_size(self):
+        return self.bundle_max_size
+
     def get_store_location_service(self):
         return cerulean.LocalFileSystem() / str(self._exchange_path)
 
@@ -91,6 +143,7 @@ class MockStore:
         self._config = config
         self._jobs = []
         self.deleted_jobs = []
+        self._workflow_sources = {}
 
     def __enter__(self):
         pass
@@ -112,6 +165,15 @@ class MockStore:
         self.deleted_jobs.extend(
             [job for job in self._jobs if job.id == job_id])
 
+    def get_workflow_source(self, url, validator):
+        if url in self._workflow_sources:
+            if self._workflow_sources[url][0] == validator:
+                return self._workflow_sources[url][1]
+        return None
+
+    def set_workflow_source(self, url, validator, content_hash):
+        self._workflow_sources[url] = (validator, content_hash)
+
 
 @pytest.fixture(params=[
     PassJob, HostnameJob, WcJob, SlowJob, SecondaryFilesJob, FileArrayJob,
@@ -313,3 +375,58 @@ def mock_store_destaged(request, mock_config):
 
     for output_file in job_fixture.output_files:
         output_file.source = None
+        output_file.size = None
+        output_file.checksum = None
+
+
+class _WebServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _WebHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_HEAD(self):
+        self.server.requests.append(('HEAD', self.path))
+        files = self.server.files
+        if self.path in files:
+            self._respond(200, files[self.path])
+        elif any(name.startswith(self.path + '/') for name in files):
+            self._respond(200, b'')
+        else:
+            self._respond(404, b'')
+
+    def do_GET(self):
+        self.server.requests.append(('GET', self.path))
+        if self.path in self.server.files:
+            self._respond(200, self.server.files[self.path])
+            self.wfile.write(self.server.files[self.path])
+        else:
+            self._respond(404, b'')
+
+    def _respond(self, status, content):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(content)))
+        if status == 200 and content:
+            self.send_header('ETag', '"{}"'.format(
+                hashlib.md5(content).hexdigest()))
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def web_server():
+    server = _WebServer(('127.0.0.1', 0), _WebHandler)
+    server.files = {
+            '/data/a.txt': b'Contents of a',
+            '/data/b.txt': b'Contents of b, which is longer',
+            '/other/c.txt': b'Contents of c'}
+    server.requests = []
+    server.url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
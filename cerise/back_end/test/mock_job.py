@@ -1,7 +1,10 @@
+import hashlib
 import logging
-from time import time
+from contextlib import contextmanager
+from time import perf_counter, time
 
 from cerise.job_store.job_state import JobState
+from cerise.job_store.sqlite_job import StagedFile
 
 
 class MockJob:
@@ -32,6 +35,9 @@ class MockJob:
         """str: Workflow file URI, as specified by the submitter."""
         self.local_input = job_input
         """str: Input JSON string, as specified by the submitter."""
+        self.eager_outputs = None
+        """Union[List[str], NoneType]: Outputs to destage when the job
+        finishes, or None for all of them."""
 
         # Current status
         self.state = JobState.SUBMITTED
@@ -48,6 +54,10 @@ class MockJob:
         """str: cwl-runner stderr output as of last update."""
 
         # Post-resolving data
+        self.workflow_hash = None
+        """Union[str, NoneType]: The hash of the workflow description
+        file, or None if it has not been resolved yet.
+        """
         self.workflow_content = None
         """Union[bytes, NoneType]: The content of the workflow
         description file, or None if it has not been resolved yet.
@@ -88,6 +98,27 @@ class MockJob:
         # Logging
         self.__log = list()
         """list: The job's execution log: [(level, time, msg)]."""
+        self.timings = list()
+        """list: Recorded timings: [(phase, start, duration, nbytes,
+        detail)]."""
+        self.staged_files = dict()
+        """dict: Completely staged input files: {path: (size, hash,
+        checksum)}."""
+        self.published_files = dict()
+        """dict: Completely published output files: {location: (size,
+        hash, checksum)}."""
+        self.lazy_outputs = dict()
+        """dict: Output files not destaged yet: {location: requested}."""
+
+    @property
+    def workflow_content(self):
+        return self.__workflow_content
+
+    @workflow_content.setter
+    def workflow_content(self, value):
+        self.__workflow_content = value
+        if value is not None:
+            self.workflow_hash = hashlib.sha256(value).hexdigest()
 
     def try_transition(self, from_state, to_state):
         """Attempts to transition the job's state to a new one.
@@ -117,6 +148,102 @@ class MockJob:
         """
         self.__log.append((level, time(), message))
 
+    def add_timing(self, phase, start, duration, nbytes=None, detail=None,
+                   accumulate=False):
+        """Record how long the job spent in a phase of processing.
+
+        Args:
+            phase (str): Name of the phase.
+            start (float): When the phase started.
+            duration (float): The wall time of the phase in seconds.
+            nbytes (int): The number of bytes transferred, if any.
+            detail (str): What the phase was working on, if anything.
+            accumulate (bool): Ignored.
+        """
+        self.timings.append((phase, start, duration, nbytes, detail))
+
+    def add_staged_file(self, path, size, digest, checksum=None):
+        """Record that an input file was staged completely.
+
+        Args:
+            path (str): The path of the file, relative to the job dir.
+            size (int): The size of the file in bytes.
+            digest (str): The SHA-256 hash of the file, as hex.
+            checksum (str): The CWL checksum of the file, if known.
+        """
+        self.staged_files[path] = (size, digest, checksum)
+
+    def get_staged_files(self):
+        """Return the input files that were staged for this job.
+
+        Returns:
+            (dict): Maps paths to StagedFiles.
+        """
+        return {path: StagedFile(path, size, digest, 0.0, checksum)
+                for path, (size, digest, checksum)
+                in self.staged_files.items()}
+
+    def add_published_file(self, location, size, digest, checksum):
+        """Record that an output file was published completely.
+
+        Args:
+            location (str): The location of the file in the output dir.
+            size (int): The size of the file in bytes.
+            digest (str): The SHA-256 hash of the file, as hex.
+            checksum (str): The CWL checksum of the file, if known.
+        """
+        self.published_files[location] = (size, digest, checksum)
+
+    def get_published_files(self):
+        """Return the output files that were published for this job.
+
+        Returns:
+            (dict): Maps locations to StagedFiles.
+        """
+        return {location: StagedFile(location, size, digest, 0.0, checksum)
+                for location, (size, digest, checksum)
+                in self.published_files.items()}
+
+    def add_lazy_output(self, location):
+        """Record that an output file was left on the compute resource.
+
+        Args:
+            location (str): The path of the file, relative to the work
+                    and output directories.
+        """
+        self.lazy_outputs[location] = False
+
+    def get_lazy_outputs(self):
+        """Return the output files that were not destaged yet.
+
+        Returns:
+            (dict): Maps locations to whether they were requested.
+        """
+        return dict(self.lazy_outputs)
+
+    def remove_lazy_output(self, location):
+        """Record that a lazy output file has been destaged.
+
+        Args:
+            location (str): The location of the file.
+        """
+        del self.lazy_outputs[location]
+
+    @contextmanager
+    def timing(self, phase, accumulate=False):
+        """Record the wall time of a with statement as a phase.
+
+        Args:
+            phase (str): Name of the phase.
+            accumulate (bool): Ignored.
+        """
+        start = time()
+        start_counter = perf_counter()
+        try:
+            yield
+        finally:
+            self.add_timing(phase, start, perf_counter() - start_counter)
+
     def debug(self, message):
         """Add a message to the job's log at level DEBUG.
 
@@ -0,0 +1,85 @@
+import os
+
+import pytest
+
+from cerise.back_end.admission_control import AdmissionControl
+from cerise.config import Config
+from cerise.job_store.job_state import JobState
+from cerise.job_store.sqlite_job_store import SQLiteJobStore
+
+
+@pytest.fixture
+def store(tmpdir):
+    return SQLiteJobStore(os.path.join(str(tmpdir), 'jobs.db'))
+
+
+def _make_control(store, **limits):
+    api_config = {'compute-resource': {'jobs': limits}}
+    return AdmissionControl(store, Config({}, api_config))
+
+
+def _add_jobs(store, state, count, staged_bytes=0):
+    for i in range(count):
+        job_id = store.create_job('job', 'file:///wf.cwl', '{}')
+        job = store.get_job(job_id)
+        job.state = state
+        if staged_bytes:
+            job.add_staged_file('work/input', staged_bytes, '0' * 64)
+
+
+def test_no_limits(store):
+    control = _make_control(store)
+    with store:
+        _add_jobs(store, JobState.WAITING, 10)
+        control.refresh()
+    assert control.may_admit()
+
+
+def test_max_staging_jobs(store):
+    control = _make_control(store, **{'max-staging-jobs': 2})
+    with store:
+        _add_jobs(store, JobState.STAGING_IN, 1)
+        _add_jobs(store, JobState.WAITING, 10)
+        control.refresh()
+    assert control.may_admit()
+    control.admitted()
+    assert not control.may_admit()
+    control.started(0)
+    assert control.may_admit()
+    control.admitted()
+    assert not control.may_admit()
+    control.failed()
+    assert control.may_admit()
+
+
+def test_max_remote_jobs(store):
+    control = _make_control(store, **{'max-remote-jobs': 3})
+    with store:
+        _add_jobs(store, JobState.WAITING, 1)
+        _add_jobs(store, JobState.RUNNING_CR, 1)
+        _add_jobs(store, JobState.SUCCESS, 5)
+        control.refresh()
+    assert control.may_admit()
+    control.admitted()
+    assert not control.may_admit()
+    control.started(0)
+    assert not control.may_admit()
+
+    with store:
+        for job in store.list_jobs():
+            if job.state == JobState.WAITING:
+                job.state = JobState.FINISHED
+        control.refresh()
+    assert control.may_admit()
+
+
+def test_max_staged_bytes(store):
+    control = _make_control(store, **{'max-staged-bytes': 1000})
+    with store:
+        _add_jobs(store, JobState.WAITING, 1, 600)
+        _add_jobs(store, JobState.RUNNING, 1, 600)
+        control.refresh()
+    assert control.may_admit()
+    control.admitted()
+    control.started(400)
+    assert not control.may_admit()
@@ -0,0 +1,145 @@
+import hashlib
+
+import pytest
+
+from cerise.back_end.chunked_transfer import ChunkedTransfer
+
+
+@pytest.fixture
+def chunked_config(mock_config):
+    mock_config.chunk_threshold = 32
+    mock_config.chunk_size = 16
+    return mock_config
+
+
+@pytest.fixture
+def data():
+    return bytes(range(100))
+
+
+def test_applies_to(mock_config, chunked_config, data):
+    source = mock_config.get_store_location_service() / 'large'
+    source.write_bytes(data)
+    small = mock_config.get_store_location_service() / 'small'
+    small.write_bytes(data[:31])
+
+    chunked_config.chunk_threshold = None
+    assert not ChunkedTransfer(chunked_config).applies_to(source)
+
+    chunked_config.chunk_threshold = 32
+    transfer = ChunkedTransfer(chunked_config)
+    assert transfer.applies_to(source)
+    assert not transfer.applies_to(small)
+    assert not transfer.applies_to(mock_config.get_basedir())
+
+
+def test_upload(chunked_config, data):
+    source = chunked_config.get_store_location_service() / 'input'
+    source.write_bytes(data)
+    target = chunked_config.get_basedir() / 'input'
+
+    size, digest, checksum = ChunkedTransfer(chunked_config).upload(
+            source, target)
+
+    assert size == len(data)
+    assert digest == hashlib.sha256(data).hexdigest()
+    assert checksum == 'sha1$' + hashlib.sha1(data).hexdigest()
+    assert target.read_bytes() == data
+    assert not (chunked_config.get_basedir() / '.input.parts').exists()
+
+
+def test_resume_upload(chunked_config, data):
+    source = chunked_config.get_store_location_service() / 'input'
+    source.write_bytes(data)
+    target = chunked_config.get_basedir() / 'input'
+
+    # an interrupted earlier attempt, which garbled a part
+    parts_dir = chunked_config.get_basedir() / '.input.parts'
+    parts_dir.mkdir()
+    (parts_dir / 'part.000000').write_bytes(data[:16])
+    (parts_dir / 'part.000001').write_bytes(bytes(16))
+    (parts_dir / 'part.000002').write_bytes(data[32:40])
+
+    ChunkedTransfer(chunked_config).upload(source, target)
+
+    assert target.read_bytes() == data
+    assert not parts_dir.exists()
+
+
+def test_upload_shrunken(chunked_config, data):
+    source = chunked_config.get_store_location_service() / 'input'
+    source.write_bytes(data[:32])
+    target = chunked_config.get_basedir() / 'input'
+
+    # parts left behind by an interrupted upload of a longer version
+    parts_dir = chunked_config.get_basedir() / '.input.parts'
+    parts_dir.mkdir()
+    for i in range(5):
+        (parts_dir / 'part.{:06d}'.format(i)).write_bytes(b'X' * 16)
+
+    size, digest, _ = ChunkedTransfer(chunked_config).upload(source, target)
+
+    assert size == 32
+    assert digest == hashlib.sha256(data[:32]).hexdigest()
+    assert target.read_bytes() == data[:32]
+    assert not parts_dir.exists()
+
+
+def test_join_missing_part(chunked_config, data):
+    parts_dir = chunked_config.get_basedir() / '.input.parts'
+    parts_dir.mkdir()
+    (parts_dir / 'part.000000').write_bytes(data[:16])
+    (parts_dir / 'SHA256SUMS').write_text(
+            '{}  part.000000\n{}  part.000001\n'.format(
+                hashlib.sha256(data[:16]).hexdigest(),
+                hashlib.sha256(data[16:32]).hexdigest()))
+
+    target = chunked_config.get_basedir() / 'input'
+    transfer = ChunkedTransfer(chunked_config)
+    assert transfer._join_parts(parts_dir, target) == {'part.000001'}
+    assert not target.exists()
+
+
+def test_join_unexpected_output(chunked_config, monkeypatch):
+    transfer = ChunkedTransfer(chunked_config)
+    monkeypatch.setattr(transfer, '_run_script',
+                        lambda *args: (3, 'sha256sum: SHA256SUMS: no such'
+                                          ' file or directory\n'))
+    with pytest.raises(IOError):
+        transfer._join_parts(chunked_config.get_basedir() / '.input.parts',
+                             chunked_config.get_basedir() / 'input')
+
+
+def test_download(chunked_config, data):
+    source = chunked_config.get_basedir() / 'output'
+    source.write_bytes(data)
+    target = chunked_config.get_store_location_service() / 'output'
+
+    size, digest, checksum = ChunkedTransfer(chunked_config).download(
+            source, target)
+
+    assert size == len(data)
+    assert digest == hashlib.sha256(data).hexdigest()
+    assert checksum == 'sha1$' + hashlib.sha1(data).hexdigest()
+    assert target.read_bytes() == data
+    assert not (chunked_config.get_basedir() / '.output.parts').exists()
+    assert not (chunked_config.get_store_location_service() /
+                '.output.parts').exists()
+    assert not (chunked_config.get_store_location_service() /
+                '.output.partial').exists()
+
+
+def test_resume_download(chunked_config, data):
+    source = chunked_config.get_basedir() / 'output'
+    source.write_bytes(data)
+    target = chunked_config.get_store_location_service() / 'output'
+
+    local_parts = chunked_config.get_store_location_service() / '.output.parts'
+    local_parts.mkdir()
+    (local_parts / 'part.000000').write_bytes(data[:16])
+    (local_parts / 'part.000001').write_bytes(bytes(16))
+
+    ChunkedTransfer(chunked_config).download(source, target)
+
+    assert target.read_bytes() == data
+    assert not local_parts.exists()
@@ -0,0 +1,47 @@
+import time
+
+from cerise.back_end.circuit_breaker import CircuitBreaker
+
+
+def test_circuit_breaker():
+    breaker = CircuitBreaker(3, 0.05, 0.1)
+    assert breaker.allow()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.allow()
+    assert not breaker.is_open()
+
+    breaker.record_failure()
+    assert breaker.is_open()
+    assert not breaker.allow()
+    time.sleep(0.05)
+    assert breaker.allow()
+    # only a single probe is let through
+    assert not breaker.allow()
+    assert breaker.is_open()
+
+    # a failing trial reopens it, for longer
+    breaker.record_failure()
+    assert not breaker.allow()
+    time.sleep(0.05)
+    assert not breaker.allow()
+    time.sleep(0.05)
+    assert breaker.allow()
+
+    breaker.record_success()
+    assert not breaker.is_open()
+    breaker.record_failure()
+    assert breaker.allow()
+
+
+def test_circuit_breaker_lost_probe():
+    breaker = CircuitBreaker(1, 0.05, 0.2)
+    breaker.record_failure()
+    time.sleep(0.05)
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    # no result was reported, so another probe follows after a while
+    time.sleep(0.05)
+    assert breaker.allow()
+    assert not breaker.allow()
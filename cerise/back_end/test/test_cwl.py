@@ -297,7 +297,8 @@ def test_get_files_from_binding():
         "input_1": 10,
         "input_2": {
             "class": "File",
-            "location": "http://example.com/test.txt"
+            "location": "http://example.com/test.txt",
+            "size": 1234
         },
         "input_3": {
             "class": "File",
@@ -331,6 +332,7 @@ def test_get_files_from_binding():
     assert input_2.location == 'http://example.com/test.txt'
     assert input_2.source is None
     assert input_2.secondary_files == []
+    assert input_2.size == 1234
 
     input_3 = [f for f in files if f.name == 'input_3'][0]
     assert input_3.index is None
@@ -1,6 +1,11 @@
+import copy
+import hashlib
+import json
+
 import pytest
 
 from cerise.back_end.local_files import LocalFiles
+from cerise.back_end.transfer import CorruptedFileError
 from cerise.test.fixture_jobs import BrokenJob
 
 
@@ -40,6 +45,29 @@ def test_resolve_input(mock_config, mock_store_submitted):
                 mock_config.get_store_location_client() + '/input/test_job/')
 
 
+def test_resolve_cached_workflow(mock_config, mock_store_submitted):
+    store, job_fixture = mock_store_submitted
+    if job_fixture == BrokenJob:
+        return
+
+    local_files = LocalFiles(store, mock_config)
+    local_files.resolve_input('test_job')
+    job = store.get_job('test_job')
+    workflow_hash = job.workflow_hash
+
+    job.workflow_content = None
+    local_files.resolve_input('test_job')
+    assert job.workflow_content is None
+    assert job.workflow_hash == workflow_hash
+
+    exchange_dir = mock_config.get_store_location_service()
+    wf_path = exchange_dir / 'input' / 'test_job' / 'test_workflow.cwl'
+    wf_path.write_bytes(job_fixture.workflow + b'\n')
+    local_files.resolve_input('test_job')
+    assert job.workflow_content == job_fixture.workflow + b'\n'
+    assert job.workflow_hash != workflow_hash
+
+
 def test_create_output_dir(mock_config, mock_store_destaged, output_dir):
     store, job_fixture = mock_store_destaged
 
@@ -62,11 +90,99 @@ def test_delete_output_dir(mock_config, mock_store_destaged, output_dir):
     assert not output_dir.exists()
 
 
-def test_publish_output(mock_config, mock_store_destaged, output_dir):
+@pytest.mark.parametrize('streams', [1, 3])
+def test_publish_output(mock_config, mock_store_destaged, output_dir,
+                        streams):
+    store, job_fixture = mock_store_destaged
+
+    mock_config.transfer_streams = streams
+    local_files = LocalFiles(store, mock_config)
+    local_files.publish_job_output('test_job', job_fixture.output_files)
+
+    for location, content in job_fixture.output_content.items():
+        assert (output_dir / location).read_bytes() == content
+
+
+def test_publish_output_checksums(mock_config, mock_store_destaged,
+                                  output_dir):
     store, job_fixture = mock_store_destaged
+    if not job_fixture.output_files:
+        return
 
     local_files = LocalFiles(store, mock_config)
     local_files.publish_job_output('test_job', job_fixture.output_files)
 
+    job = store.get_job('test_job')
+    output = json.loads(job.local_output)
+    published_files = job.get_published_files()
+    for outf in job_fixture.output_files:
+        content = job_fixture.output_content[outf.location]
+        checksum = 'sha1$' + hashlib.sha1(content).hexdigest()
+        assert output[outf.name]['size'] == len(content)
+        assert output[outf.name]['checksum'] == checksum
+        assert published_files[outf.location].size == len(content)
+        assert published_files[outf.location].checksum == checksum
+
+    # publishing again skips the files that are already there
+    job.timings.clear()
+    local_files.publish_job_output('test_job', job_fixture.output_files)
+    assert job.timings == []
+    assert json.loads(job.local_output) == output
+
+    # a copy that was changed since is published again, even if its
+    # size is still the same
+    changed = output_dir / job_fixture.output_files[0].location
+    content = job_fixture.output_content[job_fixture.output_files[0].location]
+    changed.write_bytes(bytes(len(content)))
+    local_files.publish_job_output('test_job', job_fixture.output_files)
+    assert len(job.timings) == 1
+    assert changed.read_bytes() == content
+
+    # a copy that does not match the runner's checksum is an error
+    (output_dir / job_fixture.output_files[0].location).unlink()
+    corrupted = copy.copy(job_fixture.output_files[0])
+    corrupted.checksum = 'sha1$' + '0' * 40
+    with pytest.raises(CorruptedFileError):
+        local_files.publish_job_output('test_job', [corrupted])
+    assert not (output_dir / corrupted.location).exists()
+
+
+def test_publish_output_linked(mock_config, mock_store_destaged, output_dir):
+    store, job_fixture = mock_store_destaged
+
+    mock_config.link_files = True
+    local_files = LocalFiles(store, mock_config)
+    local_files.publish_job_output('test_job', job_fixture.output_files)
+
+    for location, content in job_fixture.output_content.items():
+        assert (output_dir / location).read_bytes() == content
+
+    # publishing again replaces the read-only links
+    local_files.publish_job_output('test_job', job_fixture.output_files)
+    for location, content in job_fixture.output_content.items():
+        assert (output_dir / location).read_bytes() == content
+
+
+def test_publish_output_lazy(mock_config, mock_store_destaged, output_dir):
+    store, job_fixture = mock_store_destaged
+    if not job_fixture.output_files:
+        return
+
+    job = store.get_job('test_job')
+    eager_name = job_fixture.output_files[0].name
+    job.eager_outputs = [eager_name]
+    local_files = LocalFiles(store, mock_config)
+    local_files.publish_job_output('test_job', job_fixture.output_files)
+
+    lazy_files = [outf for outf in job_fixture.output_files
+                  if outf.name != eager_name]
+    assert set(job.get_lazy_outputs()) == {
+            outf.location for outf in lazy_files}
+    for outf in job_fixture.output_files:
+        published = (output_dir / outf.location).exists()
+        assert published == (outf.name == eager_name)
+
+    local_files.publish_lazy_outputs('test_job', lazy_files)
+    assert job.get_lazy_outputs() == {}
     for location, content in job_fixture.output_content.items():
         assert (output_dir / location).read_bytes() == content
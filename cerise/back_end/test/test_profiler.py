@@ -0,0 +1,46 @@
+import os
+import time
+
+from cerise.back_end.profiler import Profiler
+
+
+def _busy_loop():
+    return sum(range(1000))
+
+
+def test_profiler_toggle(tmpdir):
+    output_dir = os.path.join(str(tmpdir), 'profiles')
+    profiler = Profiler(output_dir, 60.0)
+
+    profiler.poll()
+    assert not profiler.is_running()
+
+    profiler.toggle()
+    profiler.poll()
+    assert profiler.is_running()
+    _busy_loop()
+
+    profiler.toggle()
+    profiler.poll()
+    assert not profiler.is_running()
+
+    files = sorted(os.listdir(output_dir))
+    assert len(files) == 3
+    assert files[0].endswith('.prof')
+    assert files[1].endswith('.stacks.txt')
+    assert files[2].endswith('.txt')
+    with open(os.path.join(output_dir, files[2])) as f:
+        assert '_busy_loop' in f.read()
+    with open(os.path.join(output_dir, files[1])) as f:
+        assert 'test_profiler_toggle' in f.read()
+
+
+def test_profiler_timeout(tmpdir):
+    profiler = Profiler(str(tmpdir), 0.01)
+    profiler.toggle()
+    profiler.poll()
+    assert profiler.is_running()
+    time.sleep(0.02)
+    profiler.poll()
+    assert not profiler.is_running()
+    assert len(os.listdir(str(tmpdir))) == 3
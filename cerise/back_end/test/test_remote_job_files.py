@@ -1,7 +1,10 @@
+import errno
 import json
+import os
 
 import pytest
 
+from cerise.back_end import transfer
 from cerise.back_end.remote_job_files import RemoteJobFiles
 from cerise.test.fixture_jobs import MissingInputJob
 
@@ -16,9 +19,11 @@ def _assert_remote_files_are_equal(output_file, reference_output_file, prefix):
             secondary_file, reference_output_file.secondary_files[i], prefix)
 
 
-def test_stage_job(mock_config, mock_store_resolved):
+@pytest.mark.parametrize('streams', [1, 3])
+def test_stage_job(mock_config, mock_store_resolved, streams):
     store, job_fixture = mock_store_resolved
 
+    mock_config.transfer_streams = streams
     remote_job_files = RemoteJobFiles(store, mock_config)
 
     input_files = job_fixture.local_input_files
@@ -44,6 +49,172 @@ def test_stage_job(mock_config, mock_store_resolved):
         staged_file = jobdir / 'work' / path
         assert staged_file.read_bytes() == content
 
+    timings = store.get_job('test_job').timings
+    assert len(timings) == len(job_fixture.remote_input_files)
+    for phase, _, duration, nbytes, _ in timings:
+        assert phase == 'stage_file'
+        assert duration >= 0.0
+        assert nbytes >= 0
+
+
+def test_resume_staging(mock_config, mock_store_resolved):
+    store, job_fixture = mock_store_resolved
+    if job_fixture == MissingInputJob:
+        return
+
+    remote_job_files = RemoteJobFiles(store, mock_config)
+    input_files = job_fixture.local_input_files
+    remote_job_files.stage_job('test_job', input_files, job_fixture.workflow)
+
+    job = store.get_job('test_job')
+    staged_files = job.get_staged_files()
+    assert len(staged_files) == len(job_fixture.remote_input_files)
+    for _, path, content in job_fixture.remote_input_files:
+        assert staged_files['work/' + path].size == len(content)
+
+    # simulate an interrupted copy of one file
+    work_dir = mock_config.get_basedir() / 'jobs' / 'test_job' / 'work'
+    partial = None
+    if job_fixture.remote_input_files:
+        _, partial, content = job_fixture.remote_input_files[0]
+        (work_dir / partial).write_bytes(content[:len(content) // 2])
+
+    job.timings.clear()
+    remote_job_files.stage_job('test_job', input_files, job_fixture.workflow)
+
+    restaged = [detail for phase, _, _, _, detail in job.timings]
+    assert len(restaged) == (1 if partial is not None else 0)
+    for _, path, content in job_fixture.remote_input_files:
+        assert (work_dir / path).read_bytes() == content
+
+    # a source that changed since it was staged is staged again, even
+    # if its size is still the same
+    if job_fixture.remote_input_files:
+        _, path, content = job_fixture.remote_input_files[0]
+        staged = staged_files['work/' + path]
+        job.add_staged_file('work/' + path, staged.size, '0' * 64,
+                            staged.checksum)
+        job.timings.clear()
+        remote_job_files.stage_job('test_job', input_files,
+                                   job_fixture.workflow)
+        assert len(job.timings) == 1
+
+
+@pytest.mark.parametrize('compression', [0, 6])
+def test_stage_job_bundled(mock_config, mock_store_resolved, compression):
+    store, job_fixture = mock_store_resolved
+    if job_fixture == MissingInputJob:
+        return
+
+    mock_config.bundle_threshold = 1
+    mock_config.bundle_compression = compression
+    remote_job_files = RemoteJobFiles(store, mock_config)
+    remote_job_files.stage_job('test_job', job_fixture.local_input_files,
+                               job_fixture.workflow)
+
+    jobdir = mock_config.get_basedir() / 'jobs' / 'test_job'
+    input_file = jobdir / 'input.json'
+    assert json.loads(input_file.read_text()) == job_fixture.remote_input(
+        jobdir / 'work')
+
+    for _, path, content in job_fixture.remote_input_files:
+        assert (jobdir / 'work' / path).read_bytes() == content
+    assert not (jobdir / 'inputs.tar').exists()
+    assert not (jobdir / 'inputs.tar.gz').exists()
+
+    job = store.get_job('test_job')
+    assert len(job.get_staged_files()) == len(job_fixture.remote_input_files)
+    if job_fixture.remote_input_files:
+        assert len(job.timings) == 1
+    staged_bytes = sum(nbytes for _, _, _, nbytes, _ in job.timings)
+    assert staged_bytes == sum(
+        len(content) for _, _, content in job_fixture.remote_input_files)
+
+
+def test_stage_job_bundle_max_size(mock_config, mock_store_resolved):
+    store, job_fixture = mock_store_resolved
+    if job_fixture == MissingInputJob:
+        return
+
+    mock_config.bundle_threshold = 1
+    mock_config.bundle_max_size = 20
+    remote_job_files = RemoteJobFiles(store, mock_config)
+    remote_job_files.stage_job('test_job', job_fixture.local_input_files,
+                               job_fixture.workflow)
+
+    jobdir = mock_config.get_basedir() / 'jobs' / 'test_job'
+    for _, path, content in job_fixture.remote_input_files:
+        assert (jobdir / 'work' / path).read_bytes() == content
+
+    sizes = [len(content)
+             for _, _, content in job_fixture.remote_input_files]
+    num_bundled = len([size for size in sizes if size < 20])
+    num_separate = len(sizes) - num_bundled
+    job = store.get_job('test_job')
+    details = [detail for _, _, _, _, detail in job.timings]
+    assert len(details) == min(num_bundled, 1) + num_separate
+    assert len([detail for detail in details if 'inputs.tar' in detail]
+               ) == min(num_bundled, 1)
+
+
+def test_stage_job_linked(mock_config, mock_store_resolved):
+    store, job_fixture = mock_store_resolved
+    if job_fixture == MissingInputJob:
+        return
+
+    sources = [str(input_file.source)
+               for input_file in job_fixture.local_input_files
+               if input_file.source.is_file()]
+    modes = [os.stat(source).st_mode for source in sources]
+
+    mock_config.link_files = True
+    mock_config.bundle_threshold = 1
+    remote_job_files = RemoteJobFiles(store, mock_config)
+    remote_job_files.stage_job('test_job', job_fixture.local_input_files,
+                               job_fixture.workflow)
+
+    jobdir = mock_config.get_basedir() / 'jobs' / 'test_job'
+    for _, path, content in job_fixture.remote_input_files:
+        assert (jobdir / 'work' / path).read_bytes() == content
+    assert not (jobdir / 'inputs.tar').exists()
+
+    job = store.get_job('test_job')
+    # only files that were copied rather than linked are recorded
+    staged_files = job.get_staged_files()
+    assert len(staged_files) <= len(job_fixture.remote_input_files)
+    for staged_file in staged_files.values():
+        assert staged_file.hash != ''
+        assert staged_file.size == (jobdir / staged_file.path).size()
+
+    # the client's files are never made read-only
+    assert [os.stat(source).st_mode for source in sources] == modes
+
+
+def test_stage_job_linked_no_reflink(mock_config, mock_store_resolved,
+                                     monkeypatch):
+    store, job_fixture = mock_store_resolved
+    if job_fixture == MissingInputJob:
+        return
+
+    def no_reflink(*args):
+        raise OSError(errno.EOPNOTSUPP, 'Operation not supported')
+
+    monkeypatch.setattr(transfer.fcntl, 'ioctl', no_reflink)
+    mock_config.link_files = True
+    remote_job_files = RemoteJobFiles(store, mock_config)
+    remote_job_files.stage_job('test_job', job_fixture.local_input_files,
+                               job_fixture.workflow)
+
+    # inputs are copied rather than hard linked
+    jobdir = mock_config.get_basedir() / 'jobs' / 'test_job'
+    for _, path, content in job_fixture.remote_input_files:
+        assert (jobdir / 'work' / path).read_bytes() == content
+        assert os.stat(str(jobdir / 'work' / path)).st_nlink == 1
+
+    job = store.get_job('test_job')
+    for staged_file in job.get_staged_files().values():
+        assert staged_file.hash != ''
+
 
 def test_update_job(mock_config, mock_store_run):
     store, job_fixture = mock_store_run
@@ -68,6 +239,20 @@ def test_destage_job(mock_config, mock_store_run_and_updated):
                                        job_fixture.output_files[i], '')
 
 
+def test_locate_outputs(mock_config, mock_store_run_and_updated):
+    store, job_fixture = mock_store_run_and_updated
+    remote_job_files = RemoteJobFiles(store, mock_config)
+
+    locations = [outf.location for outf in
+                 remote_job_files.destage_job_output('test_job')]
+    output_files = remote_job_files.locate_outputs('test_job', locations)
+
+    work_dir = mock_config.get_basedir() / 'jobs' / 'test_job' / 'work'
+    assert [outf.location for outf in output_files] == locations
+    for output_file in output_files:
+        assert output_file.source == work_dir / output_file.location
+
+
 def test_delete_job(mock_config, mock_store_run_and_updated):
     store, _ = mock_store_run_and_updated
 
@@ -0,0 +1,39 @@
+import hashlib
+import io
+import tarfile
+
+from cerise.back_end.transfer import _tar_stream, copy_as_bundle
+
+
+def test_copy_as_bundle(mock_config):
+    exchange = mock_config.get_store_location_service()
+    contents = {'work/small.txt': b'Small file\n',
+                'work/large.bin': bytes(range(256)) * 12345}
+    files = []
+    for name, content in sorted(contents.items()):
+        source = exchange / name.replace('/', '_')
+        source.write_bytes(content)
+        files.append((source, name))
+
+    target = mock_config.get_basedir() / 'inputs.tar'
+    written, hashes = copy_as_bundle(files, target, 'in')
+
+    data = target.read_bytes()
+    assert written == len(data)
+    assert len(data) % tarfile.RECORDSIZE == 0
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+        assert sorted(tar.getnames()) == sorted(contents)
+        for name, content in contents.items():
+            assert tar.extractfile(name).read() == content
+
+    for (_, name), (size, digest, checksum) in zip(files, hashes):
+        content = contents[name]
+        assert size == len(content)
+        assert digest == hashlib.sha256(content).hexdigest()
+        assert checksum == 'sha1$' + hashlib.sha1(content).hexdigest()
+
+    # files are passed on in blocks, not as a whole
+    hashes = []
+    blocks = list(_tar_stream(files, hashes))
+    assert max(len(block) for block in blocks) < len(
+        contents['work/large.bin'])
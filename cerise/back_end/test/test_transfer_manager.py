@@ -0,0 +1,100 @@
+import threading
+import time
+
+import pytest
+
+from cerise.back_end.transfer import TokenBucket
+from cerise.back_end.transfer_manager import TransferManager
+
+
+def test_single_stream(mock_config):
+    manager = TransferManager(mock_config)
+    order = []
+
+    def transfer(item):
+        order.append(item)
+        return item, threading.current_thread()
+
+    results = manager.map(transfer, ['c', 'a', 'd', 'b'],
+                          [30, 10, None, 20])
+    assert [item for item, _ in results] == ['c', 'a', 'd', 'b']
+    assert order == ['a', 'b', 'c', 'd']
+    assert {thread for _, thread in results} == {threading.current_thread()}
+
+    path = mock_config.get_basedir() / 'file'
+    assert manager.remote(path) is path
+    assert manager.bucket is None
+
+
+def test_parallel_streams(mock_config):
+    mock_config.transfer_streams = 4
+    manager = TransferManager(mock_config)
+
+    def transfer(item):
+        time.sleep(0.1 * (4 - item))
+        return item, threading.current_thread()
+
+    results = manager.map(transfer, range(4), [1, 1, 1, 1])
+    assert [item for item, _ in results] == [0, 1, 2, 3]
+    assert len({thread for _, thread in results}) == 4
+
+    path = mock_config.get_basedir() / 'file'
+    assert manager.map(manager.remote, [path], [None]) == [path]
+
+
+def test_shortest_first(mock_config):
+    mock_config.transfer_streams = 2
+    manager = TransferManager(mock_config)
+    order = []
+    events = {1: threading.Event(), 2: threading.Event()}
+
+    def block(item):
+        events[item].wait()
+
+    def transfer(item):
+        order.append(item)
+
+    # occupy both streams, so that everything below queues up
+    blocked = threading.Thread(target=manager.map,
+                               args=(block, [1, 2], [1, 1]))
+    blocked.start()
+    time.sleep(0.1)
+
+    queued = threading.Thread(
+            target=manager.map,
+            args=(transfer, ['a', 'b', 'c', 'd'], [1000, None, 10, 20]))
+    queued.start()
+    time.sleep(0.1)
+
+    # free one stream, which then runs the queued transfers in order
+    events[1].set()
+    queued.join()
+    events[2].set()
+    blocked.join()
+
+    assert order == ['c', 'd', 'a', 'b']
+
+
+def test_failed_transfer(mock_config):
+    mock_config.transfer_streams = 2
+    manager = TransferManager(mock_config)
+    done = []
+
+    def transfer(item):
+        if item == 1:
+            raise IOError('Connection dropped')
+        time.sleep(0.1)
+        done.append(item)
+
+    with pytest.raises(IOError):
+        manager.map(transfer, range(2), [None, None])
+    assert done == [0]
+
+
+def test_token_bucket():
+    bucket = TokenBucket(1000.0, 100.0)
+    start = time.perf_counter()
+    for _ in range(5):
+        bucket.take(100)
+    duration = time.perf_counter() - start
+    assert 0.35 < duration < 1.0
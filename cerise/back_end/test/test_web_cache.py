@@ -0,0 +1,102 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cerulean import LocalFileSystem
+
+from cerise.back_end.web_cache import WebCache
+from cerise.back_end.web_sources import WebSources
+
+
+def test_get(web_server, tmpdir):
+    sources = WebSources(2)
+    cache = WebCache(str(tmpdir / 'cache'), 1000, sources)
+    url = web_server.url + '/data/a.txt'
+
+    first = cache.get(url)
+    assert isinstance(first.filesystem, LocalFileSystem)
+    assert first.read_bytes() == web_server.files['/data/a.txt']
+    assert web_server.requests.count(('GET', '/data/a.txt')) == 1
+
+    assert str(cache.get(url)) == str(first)
+    assert web_server.requests.count(('GET', '/data/a.txt')) == 1
+    cache.release(first)
+    cache.release(first)
+
+    web_server.files['/data/a.txt'] = b'New contents of a'
+    second = cache.get(url)
+    assert second.read_bytes() == b'New contents of a'
+    assert web_server.requests.count(('GET', '/data/a.txt')) == 2
+    assert os.listdir(str(tmpdir / 'cache')) == [second.name]
+
+    sources.close()
+
+
+def test_evict(web_server, tmpdir):
+    sources = WebSources(2)
+    cache = WebCache(str(tmpdir / 'cache'), 50, sources)
+
+    a = cache.get(web_server.url + '/data/a.txt')
+    cache.release(a)
+    time.sleep(0.01)
+    c = cache.get(web_server.url + '/other/c.txt')
+    cache.release(c)
+    time.sleep(0.01)
+    cache.release(cache.get(web_server.url + '/data/a.txt'))
+    time.sleep(0.01)
+    b = cache.get(web_server.url + '/data/b.txt')
+
+    assert a.exists()
+    assert b.exists()
+    assert not c.exists()
+
+    sources.close()
+
+
+def test_pinned(web_server, tmpdir):
+    sources = WebSources(2)
+    cache = WebCache(str(tmpdir / 'cache'), 30, sources)
+
+    # a is still in use by a job that has not been staged yet
+    a = cache.get(web_server.url + '/data/a.txt')
+    time.sleep(0.01)
+    b = cache.get(web_server.url + '/data/b.txt')
+    assert a.exists()
+    assert b.exists()
+
+    cache.release(a)
+    cache.release(b)
+    time.sleep(0.01)
+    c = cache.get(web_server.url + '/other/c.txt')
+    assert not a.exists()
+    assert c.exists()
+
+    sources.close()
+
+
+def test_concurrent_get(web_server, tmpdir):
+    sources = WebSources(4)
+    cache = WebCache(str(tmpdir / 'cache'), 1000, sources)
+    url = web_server.url + '/data/a.txt'
+
+    with ThreadPoolExecutor(4) as executor:
+        paths = list(executor.map(cache.get, [url] * 8))
+    assert len({str(path) for path in paths}) == 1
+    assert web_server.requests.count(('GET', '/data/a.txt')) == 1
+
+    sources.close()
+
+
+def test_uncacheable(web_server, tmpdir):
+    sources = WebSources(2)
+    (tmpdir / 'cache').mkdir()
+    (tmpdir / 'cache' / 'partial.tmp').write('interrupted')
+    cache = WebCache(str(tmpdir / 'cache'), 1000, sources)
+    assert os.listdir(str(tmpdir / 'cache')) == []
+
+    web_server.files['/data/empty.txt'] = b''
+    empty = cache.get(web_server.url + '/data/empty.txt')
+    assert not isinstance(empty.filesystem, LocalFileSystem)
+    assert os.listdir(str(tmpdir / 'cache')) == []
+
+    sources.close()
@@ -0,0 +1,77 @@
+import socket
+import time
+
+from cerise.back_end.web_sources import WebSources
+
+
+def test_get(web_server):
+    sources = WebSources(4)
+
+    a = sources.get(web_server.url + '/data/a.txt')
+    b = sources.get(web_server.url + '/data/b.txt')
+    assert a.read_bytes() == web_server.files['/data/a.txt']
+    assert b.read_bytes() == web_server.files['/data/b.txt']
+    assert a.filesystem is b.filesystem
+    assert web_server.requests.count(('HEAD', '/data')) == 1
+
+    sources.close()
+
+
+def test_get_evicts(web_server):
+    sources = WebSources(1)
+
+    a = sources.get(web_server.url + '/data/a.txt')
+    c = sources.get(web_server.url + '/other/c.txt')
+    assert a.filesystem is not c.filesystem
+    assert a.read_bytes() == web_server.files['/data/a.txt']
+
+    sources.get(web_server.url + '/data/b.txt')
+    assert web_server.requests.count(('HEAD', '/data')) == 2
+
+    sources.close()
+
+
+def test_sizes(web_server):
+    sources = WebSources(2)
+
+    names = sorted(web_server.files)
+    urls = [web_server.url + name for name in names]
+    urls.append(web_server.url + '/data/missing.txt')
+    urls.append('http://127.0.0.1:1/unreachable.txt')
+    sizes = sources.sizes(urls)
+    assert sizes == [len(web_server.files[name]) for name in names] + [
+            None, None]
+
+    sources.close()
+
+
+def test_validator(web_server):
+    sources = WebSources(2)
+
+    url = web_server.url + '/data/a.txt'
+    validator = sources.validator(url)
+    assert validator.startswith('etag:')
+    assert sources.validator(url) == validator
+
+    web_server.files['/data/a.txt'] = b'New contents of a'
+    assert sources.validator(url) != validator
+    assert sources.validator(web_server.url + '/data/missing.txt') is None
+
+    sources.close()
+
+
+def test_timeout():
+    # accepts connections, but never answers
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(4)
+    url = 'http://127.0.0.1:{}/slow.txt'.format(server.getsockname()[1])
+
+    sources = WebSources(2, timeout=0.2)
+    start = time.perf_counter()
+    assert sources.validator(url) is None
+    assert sources.sizes([url]) == [None]
+    assert time.perf_counter() - start < 5.0
+
+    sources.close()
+    server.close()
@@ -0,0 +1,352 @@
+import errno
+import fcntl
+import hashlib
+import os
+import stat
+import tarfile
+import threading
+import zlib
+from time import perf_counter, sleep
+from typing import Generator, List, Optional, Tuple
+
+import cerulean
+from cerulean import LocalFileSystem, Path
+
+from cerise import metrics
+
+_FICLONE = 0x40049409
+"""Linux ioctl request that makes a file a copy-on-write clone."""
+
+
+class CorruptedFileError(IOError):
+    """A copy of a file does not match the checksum it should have."""
+
+
+class TokenBucket:
+    """Limits the rate at which data is transferred.
+
+    Transfers take tokens, one per byte, which are added at a fixed
+    rate up to a maximum, allowing short bursts. If there are not
+    enough tokens, take() blocks until there are. The bucket may be
+    shared by any number of threads.
+
+    Args:
+        rate: The number of bytes per second to allow.
+        burst: The maximum number of bytes to allow at once, by \
+                default one second's worth.
+    """
+    def __init__(self, rate: float, burst: Optional[float] = None) -> None:
+        self._rate = rate
+        """Tokens added per second."""
+        self._capacity = burst if burst is not None else rate
+        """Maximum number of tokens in the bucket."""
+        self._tokens = self._capacity
+        """Tokens currently available, negative if overdrawn."""
+        self._last = perf_counter()
+        """When tokens were last added."""
+        self._lock = threading.Lock()
+        """Protects the above."""
+
+    def take(self, amount: int) -> None:
+        """Take tokens for the given number of bytes, waiting if needed.
+
+        Tokens are reserved immediately, so that callers are served
+        in order.
+
+        Args:
+            amount: The number of bytes about to be transferred.
+        """
+        with self._lock:
+            now = perf_counter()
+            self._tokens = min(self._capacity,
+                               self._tokens + (now - self._last) * self._rate)
+            self._last = now
+            self._tokens -= amount
+            delay = -self._tokens / self._rate
+        if delay > 0.0:
+            sleep(delay)
+
+
+class StreamHash:
+    """Calculates the size and hashes of data as it streams past.
+
+    Both hashes are calculated in a single pass, so that files never
+    have to be read a second time. SHA-256 is what Cerise uses to
+    record staged files, SHA-1 is what CWL uses for the checksum of a
+    File.
+    """
+    def __init__(self) -> None:
+        self.size = 0
+        """The number of bytes seen so far."""
+        self._sha256 = hashlib.sha256()
+        """The SHA-256 hash of the data so far."""
+        self._sha1 = hashlib.sha1()
+        """The SHA-1 hash of the data so far."""
+
+    def update(self, data: bytes) -> None:
+        """Add a block of data.
+
+        Args:
+            data: The next block.
+        """
+        self.size += len(data)
+        self._sha256.update(data)
+        self._sha1.update(data)
+
+    @property
+    def digest(self) -> str:
+        """The SHA-256 hash of the data, as hex."""
+        return self._sha256.hexdigest()
+
+    @property
+    def checksum(self) -> str:
+        """The SHA-1 hash of the data, in CWL's sha1$<hex> format."""
+        return 'sha1$' + self._sha1.hexdigest()
+
+
+def hash_file(path: Path) -> str:
+    """Calculate the SHA-256 hash of a file's contents.
+
+    Args:
+        path: The file to hash.
+
+    Returns:
+        The hash, as hex.
+    """
+    stream_hash = StreamHash()
+    for data in path.streaming_read():
+        stream_hash.update(data)
+    return stream_hash.digest
+
+
+def copy_file(source: Path, target: Path, direction: str,
+              overwrite: str = 'never',
+              bucket: Optional[TokenBucket] = None) -> int:
+    """Copy a file or directory, and record it in the staging metrics.
+
+    Args:
+        source: The path to copy from.
+        target: The path to copy to.
+        direction: Either 'in' for staging to the compute resource, \
+                or 'out' for staging from it.
+        overwrite: What to do with existing files at the target, see \
+                cerulean.copy().
+        bucket: A bucket to take tokens from as data is copied.
+
+    Returns:
+        The number of bytes copied.
+    """
+    copied = [0]
+
+    def count_bytes(count: int, total: int) -> None:
+        if bucket is not None:
+            bucket.take(count - copied[0] if count >= copied[0] else count)
+        copied[0] = count
+
+    start = perf_counter()
+    cerulean.copy(source, target, overwrite=overwrite, callback=count_bytes)
+    metrics.STAGING_DURATION.inc(perf_counter() - start, direction)
+    metrics.STAGED_BYTES.inc(copied[0], direction)
+    metrics.STAGED_FILES.inc(1, direction)
+    return copied[0]
+
+
+def copy_and_hash_file(source: Path, target: Path, direction: str,
+                       bucket: Optional[TokenBucket] = None
+                       ) -> Tuple[int, str, str]:
+    """Copy a file, calculating its hashes on the way.
+
+    Any existing file at the target is overwritten. Directories are
+    copied using copy_file(), and get empty hashes.
+
+    Args:
+        source: The path to copy from.
+        target: The path to copy to.
+        direction: Either 'in' for staging to the compute resource, \
+                or 'out' for staging from it.
+        bucket: A bucket to take tokens from as data is copied.
+
+    Returns:
+        The number of bytes copied, the SHA-256 hex digest of the \
+        data, and its CWL checksum.
+    """
+    if not source.is_file():
+        return copy_file(source, target, direction, 'always', bucket), '', ''
+
+    hasher = StreamHash()
+
+    def hashed_data() -> Generator[bytes, None, None]:
+        for chunk in source.streaming_read():
+            if bucket is not None:
+                bucket.take(len(chunk))
+            hasher.update(chunk)
+            yield chunk
+
+    start = perf_counter()
+    target.streaming_write(hashed_data())
+    metrics.STAGING_DURATION.inc(perf_counter() - start, direction)
+    metrics.STAGED_BYTES.inc(hasher.size, direction)
+    metrics.STAGED_FILES.inc(1, direction)
+    return hasher.size, hasher.digest, hasher.checksum
+
+
+def can_link(source: Path, target: Path) -> bool:
+    """Return whether link_file() may be able to stage a file.
+
+    Args:
+        source: The path to link from.
+        target: The path to link to.
+    """
+    return (isinstance(source.filesystem, LocalFileSystem) and
+            isinstance(target.filesystem, LocalFileSystem) and
+            source.is_file())
+
+
+def link_file(source: Path, target: Path, direction: str) -> Optional[int]:
+    """Make a file available at the target without copying its data.
+
+    This first tries to make the target a copy-on-write clone of the
+    source (a reflink), which file systems such as Btrfs and XFS
+    support, and which behaves as an independent copy. If that is not
+    supported, output files are hard linked instead. Both names then
+    refer to the same data, so any change to one would change the
+    other. To keep that from happening by accident, write permission
+    is removed from hard-linked files. Input files are not hard
+    linked, as that would remove write permission from the client's
+    file as well.
+
+    Any existing file at the target is replaced.
+
+    Args:
+        source: A regular file on the local file system.
+        target: A path on the local file system.
+        direction: Either 'in' for staging to the compute resource, \
+                or 'out' for staging from it.
+
+    Returns:
+        The size of the file, or None if it could not be linked, in
+        which case it should be copied instead.
+    """
+    start = perf_counter()
+    source_path, target_path = str(source), str(target)
+    if os.path.lexists(target_path):
+        os.unlink(target_path)
+
+    method = 'reflink'
+    with open(source_path, 'rb') as src:
+        try:
+            with open(target_path, 'wb') as tgt:
+                fcntl.ioctl(tgt.fileno(), _FICLONE, src.fileno())
+        except OSError:
+            method = 'hardlink'
+
+    if method == 'hardlink':
+        if os.path.lexists(target_path):
+            os.unlink(target_path)
+        if direction == 'in':
+            return None
+        try:
+            os.link(source_path, target_path)
+        except OSError as exc:
+            if exc.errno in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                return None
+            raise
+        mode = os.stat(target_path).st_mode
+        os.chmod(target_path, stat.S_IMODE(mode) & ~(
+            stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+    metrics.STAGING_DURATION.inc(perf_counter() - start, direction)
+    metrics.STAGED_FILES.inc(1, direction)
+    metrics.LINKED_FILES.inc(1, direction, method)
+    return os.stat(target_path).st_size
+
+
+def copy_as_bundle(files: List[Tuple[Path, str]], target: Path,
+                   direction: str, compression: int = 0,
+                   bucket: Optional[TokenBucket] = None
+                   ) -> Tuple[int, List[Tuple[int, str, str]]]:
+    """Copy files into a single tar archive.
+
+    The archive is created on the fly while it is being written, so
+    that many small files can be sent over a single channel, without
+    a round trip per file. The hashes of the files are calculated on
+    the way.
+
+    Args:
+        files: Pairs of a regular file to copy and the name to give \
+                it in the archive.
+        target: The path to write the archive to.
+        direction: Either 'in' for staging to the compute resource, \
+                or 'out' for staging from it.
+        compression: The gzip compression level, 0 for an \
+                uncompressed archive.
+        bucket: A bucket to take tokens from as data is copied.
+
+    Returns:
+        The number of bytes written, and the size, SHA-256 hex digest \
+        and CWL checksum of each file, in the order given.
+    """
+    hashes = []  # type: List[Tuple[int, str, str]]
+    written = [0]
+
+    def archive_data() -> Generator[bytes, None, None]:
+        compressor = None
+        if compression > 0:
+            compressor = zlib.compressobj(compression, zlib.DEFLATED, 31)
+        def count(block: bytes) -> bytes:
+            if bucket is not None:
+                bucket.take(len(block))
+            written[0] += len(block)
+            return block
+
+        for block in _tar_stream(files, hashes):
+            if compressor is not None:
+                block = compressor.compress(block)
+            yield count(block)
+        if compressor is not None:
+            yield count(compressor.flush())
+
+    start = perf_counter()
+    target.streaming_write(archive_data())
+    metrics.STAGING_DURATION.inc(perf_counter() - start, direction)
+    metrics.STAGED_BYTES.inc(written[0], direction)
+    metrics.STAGED_FILES.inc(len(files), direction)
+    return written[0], hashes
+
+
+def _tar_stream(files: List[Tuple[Path, str]],
+                hashes: List[Tuple[int, str, str]]
+                ) -> Generator[bytes, None, None]:
+    """Generate a tar archive of the given files.
+
+    The data of each file is passed on block by block as it is read,
+    so that files are never held in memory as a whole. The size and
+    hashes of each file are appended to hashes as it is added.
+    """
+    written = 0
+    for source, name in files:
+        info = tarfile.TarInfo(name)
+        info.size = source.size()
+        info.mode = 0o600
+        header = info.tobuf(tarfile.PAX_FORMAT)
+        yield header
+
+        hasher = StreamHash()
+        for block in source.streaming_read():
+            hasher.update(block)
+            yield block
+        if hasher.size != info.size:
+            raise IOError('{} changed size while it was being archived'
+                          .format(source))
+        padding = -hasher.size % tarfile.BLOCKSIZE
+        if padding > 0:
+            yield bytes(padding)
+
+        written += len(header) + hasher.size + padding
+        hashes.append((hasher.size, hasher.digest, hasher.checksum))
+
+    # two empty blocks mark the end, padded to a whole record, as
+    # tarfile does
+    end = 2 * tarfile.BLOCKSIZE
+    end += -(written + end) % tarfile.RECORDSIZE
+    yield bytes(end)
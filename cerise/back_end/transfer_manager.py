@@ -0,0 +1,172 @@
+import heapq
+import logging
+import math
+import threading
+from concurrent.futures import Future, wait
+from itertools import count
+from typing import (Any, Callable, Dict, List, Optional, Sequence, Tuple,
+                    TypeVar)
+
+from cerulean import Path
+
+from cerise.back_end.transfer import TokenBucket
+from cerise.config import Config
+
+T = TypeVar('T')
+U = TypeVar('U')
+
+_Task = Tuple[float, int, Callable[[], Any], Future]
+"""A queued transfer: size, sequence number, function and result."""
+
+
+class TransferManager:
+    """Schedules all file transfers to and from the compute resource.
+
+    Transfers are run by a number of worker threads, each of which
+    has its own connection to the remote file system, as obtained
+    from Config.get_file_system(). With a single stream, transfers
+    are run in the calling thread on the shared connection instead.
+
+    When a stream becomes free, it picks the smallest waiting
+    transfer, so that small transfers finish quickly (shortest job
+    first). Transfers of unknown size go last. Jobs are staged one at
+    a time by the execution manager, so these are all transfers of
+    the same job.
+
+    If a bandwidth limit is configured, all transfers together take
+    their bytes from a single token bucket, which can be passed to
+    the functions in cerise.back_end.transfer, so that Cerise does not
+    saturate a link it shares with other services.
+
+    Transfer functions run in the worker threads, and should use
+    remote() to get paths on the current stream's connection. They
+    may use the job store, which gives each thread its own database
+    connection.
+
+    Args:
+        config: The configuration to get the number of streams, the \
+                bandwidth limit and the file systems from.
+    """
+    def __init__(self, config: Config) -> None:
+        self._logger = logging.getLogger(__name__)
+        """Logger: The logger for this class."""
+        self._config = config
+        """The configuration to get file systems from."""
+        self._streams = config.get_transfer_streams()
+        """The number of transfers to run at the same time."""
+
+        bandwidth = config.get_transfer_bandwidth()
+        self.bucket = None  # type: Optional[TokenBucket]
+        """Limits the bandwidth of all transfers together, if set."""
+        if bandwidth is not None:
+            self.bucket = TokenBucket(bandwidth)
+
+        self._lock = threading.Condition()
+        """Protects the queue, and signals new work."""
+        self._queue = []  # type: List[_Task]
+        """Waiting transfers, as a heap ordered by size."""
+        self._sequence = count()
+        """Orders transfers of the same size in order of arrival."""
+
+        self._thread_local_data = threading.local()
+        """The stream number of the current thread."""
+        self._workers = []  # type: List[threading.Thread]
+        """Threads running the transfers, if more than one stream."""
+        if self._streams > 1:
+            for stream in range(1, self._streams + 1):
+                worker = threading.Thread(
+                        target=self._worker, args=(stream, ),
+                        name='transfer-{}'.format(stream), daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def map(self, transfer: Callable[[T], U], items: Sequence[T],
+            sizes: Sequence[Optional[int]]) -> List[U]:
+        """Runs a transfer function for each of the given items.
+
+        If a transfer raises, transfers of these items that have not
+        started yet are cancelled, and the exception is raised once
+        the running ones have finished.
+
+        Args:
+            transfer: A function that transfers an item.
+            items: The items to transfer.
+            sizes: The size in bytes of each item, or None if unknown.
+
+        Returns:
+            The results of the transfers, in the order of the items.
+        """
+        if not items:
+            return []
+
+        if not self._workers:
+            order = sorted(range(len(items)),
+                           key=lambda i: _size_key(sizes[i]))
+            results = dict()  # type: Dict[int, U]
+            for i in order:
+                results[i] = transfer(items[i])
+            return [results[i] for i in range(len(items))]
+
+        futures = []  # type: List[Future]
+        with self._lock:
+            for item, size in zip(items, sizes):
+                future = Future()  # type: Future
+                task = (_size_key(size), next(self._sequence),
+                        _bind(transfer, item), future)
+                heapq.heappush(self._queue, task)
+                futures.append(future)
+            self._lock.notify_all()
+
+        try:
+            return [future.result() for future in futures]
+        finally:
+            for future in futures:
+                future.cancel()
+            wait(futures)
+
+    def remote(self, path: Path) -> Path:
+        """Returns the given remote path on this thread's stream.
+
+        Args:
+            path: A path on the remote file system.
+        """
+        stream = self._thread_local_data.__dict__.get('stream', 0)
+        if stream == 0:
+            return path
+        return self._config.get_file_system(stream) / str(path)
+
+    def _worker(self, stream: int) -> None:
+        """Runs transfers as they come in.
+
+        Args:
+            stream: The number of the stream this worker uses.
+        """
+        self._thread_local_data.stream = stream
+        while True:
+            _, _, run, future = self._next_task()
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(run())
+                except BaseException as exc:
+                    future.set_exception(exc)
+
+    def _next_task(self) -> _Task:
+        """Waits for a transfer, and takes it from the queue.
+
+        Returns:
+            The smallest waiting transfer.
+        """
+        with self._lock:
+            while not self._queue:
+                self._lock.wait()
+            return heapq.heappop(self._queue)
+
+
+def _size_key(size: Optional[int]) -> float:
+    """Sorts transfers of unknown size after all others."""
+    return math.inf if size is None else float(size)
+
+
+def _bind(transfer: Callable[[T], U], item: T) -> Callable[[], U]:
+    """Returns a function that transfers the given item."""
+    return lambda: transfer(item)
@@ -0,0 +1,185 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from typing import Dict, List, Tuple
+
+from cerulean import LocalFileSystem, Path
+
+from cerise import metrics
+from cerise.back_end.web_sources import WebSources
+
+
+class WebCache:
+    """Keeps copies of files from web servers on local disk.
+
+    Files are stored under a name made from hashes of their URL and
+    of their ETag or Last-Modified header, so that a cached copy is
+    used only if the server says the file has not changed since. Files
+    for which the server gives neither header are not cached.
+
+    Downloads go to a temporary file, which is renamed once complete,
+    so that an interrupted download is never mistaken for a cached
+    file. They run without holding the cache's lock, so that other
+    files can be looked up and fetched meanwhile, and if several jobs
+    need the same file at the same time, it is downloaded once.
+
+    Each use of a file updates its modification time, and when the
+    total size exceeds the limit, the least recently used files are
+    removed. Files that get() returned are pinned until they are
+    released with release(), so that they are not removed before the
+    job that needs them has been staged. The cache may therefore
+    temporarily grow beyond its limit.
+
+    Args:
+        directory: The local directory to keep the files in.
+        max_size: The maximum total size of the files in bytes.
+        web_sources: Connections to fetch files through.
+    """
+    def __init__(self, directory: str, max_size: int,
+                 web_sources: WebSources) -> None:
+        self._logger = logging.getLogger(__name__)
+        """Logger: The logger for this class."""
+        self._directory = os.path.abspath(directory)
+        """The directory to keep the files in."""
+        self._max_size = max_size
+        """The maximum total size of the files in bytes."""
+        self._web_sources = web_sources
+        """Connections to fetch files through."""
+        self._lock = threading.Lock()
+        """Protects the files and the bookkeeping below."""
+        self._downloads = dict()  # type: Dict[str, threading.Event]
+        """Downloads in progress, by file name, set when done."""
+        self._pins = dict()  # type: Dict[str, int]
+        """Number of unreleased uses of each file, by file name."""
+
+        os.makedirs(self._directory, exist_ok=True)
+        for name in os.listdir(self._directory):
+            if name.endswith('.tmp'):
+                os.remove(os.path.join(self._directory, name))
+
+    def get(self, url: str) -> Path:
+        """Returns a Path for the file at the given URL.
+
+        This is a local copy if the file can be cached, and the file
+        on the web server otherwise. A local copy stays in the cache
+        until the Path is passed to release().
+
+        Args:
+            url: An http:// or https:// URL.
+        """
+        validator = self._web_sources.validator(url)
+        if validator is None:
+            return self._web_sources.get(url)
+
+        url_key = _hash(url)
+        name = '{}-{}'.format(url_key, _hash(validator))
+        path = os.path.join(self._directory, name)
+        while True:
+            with self._lock:
+                if os.path.exists(path):
+                    self._logger.debug('Using cached copy of {}'.format(url))
+                    os.utime(path)
+                    self._pin(name)
+                    metrics.WEB_CACHE_REQUESTS.inc(1, 'hit')
+                    return LocalFileSystem() / path
+
+                download = self._downloads.get(name)
+                if download is None:
+                    download = threading.Event()
+                    self._downloads[name] = download
+                    break
+            # another thread is fetching it, wait for it and look again
+            download.wait()
+
+        self._logger.debug('Caching {}'.format(url))
+        metrics.WEB_CACHE_REQUESTS.inc(1, 'miss')
+        fetched = False
+        try:
+            self._download(url, path)
+            fetched = True
+        finally:
+            with self._lock:
+                del self._downloads[name]
+                download.set()
+                if fetched:
+                    self._pin(name)
+                    for old_name, _, _ in self._entries():
+                        if (old_name.startswith(url_key)
+                                and old_name != name
+                                and old_name not in self._pins):
+                            os.remove(os.path.join(self._directory,
+                                                   old_name))
+                    self._evict()
+        return LocalFileSystem() / path
+
+    def release(self, path: Path) -> None:
+        """Allows a file returned by get() to be removed again.
+
+        Paths that are not in the cache are ignored.
+
+        Args:
+            path: A Path returned by get().
+        """
+        if str(path.parent) != self._directory:
+            return
+        with self._lock:
+            count = self._pins.get(path.name, 0)
+            if count > 1:
+                self._pins[path.name] = count - 1
+            elif count == 1:
+                del self._pins[path.name]
+
+    def _pin(self, name: str) -> None:
+        """Keeps a file from being removed until it is released.
+
+        Args:
+            name: The name of the file.
+        """
+        self._pins[name] = self._pins.get(name, 0) + 1
+
+    def _download(self, url: str, path: str) -> None:
+        """Downloads a file into the cache.
+
+        Args:
+            url: The URL of the file.
+            path: The local path to store it at.
+        """
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self._directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for block in self._web_sources.get(url).streaming_read():
+                    f.write(block)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def _evict(self) -> None:
+        """Removes least recently used files until the cache fits.
+
+        Pinned files are not removed.
+        """
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for name, size, _ in sorted(entries, key=lambda entry: entry[2]):
+            if total <= self._max_size:
+                break
+            if name not in self._pins:
+                os.remove(os.path.join(self._directory, name))
+                total -= size
+
+    def _entries(self) -> List[Tuple[str, int, float]]:
+        """Returns the name, size and last use time of cached files."""
+        entries = []  # type: List[Tuple[str, int, float]]
+        for name in os.listdir(self._directory):
+            if not name.endswith('.tmp'):
+                stat = os.stat(os.path.join(self._directory, name))
+                entries.append((name, stat.st_size, stat.st_mtime))
+        return entries
+
+
+def _hash(text: str) -> str:
+    """Returns a hash of a string, for use in a file name."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:32]
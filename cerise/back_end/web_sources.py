@@ -0,0 +1,192 @@
+import logging
+import threading
+import urllib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import requests
+from cerulean import Path, WebdavFileSystem
+
+_Host = Tuple[str, str]
+"""A web server, as a scheme and a network location."""
+
+
+class WebSources:
+    """Gives access to input files on web servers.
+
+    Connections are kept open and reused between files and jobs. For
+    each host, there is a single HTTP session with at most a given
+    number of keep-alive connections, which is used to check the size
+    and version of files. Files are read through Cerulean WebDAV file
+    systems. Cerulean checks the base URL of such a file system when
+    it is made, so there is one for each directory that files are
+    read from, each with its own session, and for each host only the
+    given number of most recently used ones are kept.
+
+    Args:
+        max_connections: Number of connections to keep per host, \
+                and number of size checks to do at the same time.
+        timeout: Seconds to wait for a server to accept a connection, \
+                and to answer a HEAD request.
+    """
+    def __init__(self, max_connections: int, timeout: float = 30.0
+                 ) -> None:
+        self._logger = logging.getLogger(__name__)
+        """Logger: The logger for this class."""
+        self._max_connections = max_connections
+        """Number of connections and file systems to keep per host."""
+        self._timeout = timeout
+        """Seconds to wait for a connection or a response."""
+        self._lock = threading.Lock()
+        """Protects the sessions and file systems."""
+        self._sessions = dict()  # type: Dict[_Host, requests.Session]
+        """A session for each host, for HEAD requests."""
+        self._file_systems = dict()  # type: Dict[_Host, OrderedDict]
+        """File systems for each host by base URL, least recent first."""
+        self._executor = ThreadPoolExecutor(max_connections)
+        """Runs size checks concurrently."""
+
+    def get(self, url: str) -> Path:
+        """Returns a Path for the file at the given URL.
+
+        Args:
+            url: An http:// or https:// URL.
+        """
+        parsed_url = urllib.parse.urlparse(url)
+        host = parsed_url.scheme, parsed_url.netloc
+        dir_path, _, name = parsed_url.path.rpartition('/')
+        base_url = '{}://{}{}'.format(parsed_url.scheme, parsed_url.netloc,
+                                      dir_path)
+
+        evicted = None  # type: Optional[WebdavFileSystem]
+        with self._lock:
+            file_systems = self._file_systems.setdefault(host, OrderedDict())
+            if base_url in file_systems:
+                file_systems.move_to_end(base_url)
+                return file_systems[base_url] / name
+
+        self._logger.debug('Connecting to {}'.format(base_url))
+        file_system = WebdavFileSystem(base_url)
+        with self._lock:
+            file_systems = self._file_systems.setdefault(host, OrderedDict())
+            if base_url in file_systems:
+                # another thread beat us to it
+                evicted = file_system
+                file_system = file_systems[base_url]
+            else:
+                file_systems[base_url] = file_system
+                if len(file_systems) > self._max_connections:
+                    _, evicted = file_systems.popitem(last=False)
+
+        # Paths on an evicted file system still work, requests will
+        # connect again if needed.
+        if evicted is not None:
+            evicted.close()
+        return file_system / name
+
+    def head(self, url: str) -> requests.Response:
+        """Does a HEAD request, following redirects.
+
+        Args:
+            url: An http:// or https:// URL.
+
+        Raises:
+            requests.exceptions.Timeout: If the server did not answer \
+                    in time.
+        """
+        return self._session(url).head(url, allow_redirects=True,
+                                       timeout=self._timeout)
+
+    def validator(self, url: str) -> Optional[str]:
+        """Returns a string that changes when the file changes.
+
+        This is based on the ETag or Last-Modified header.
+
+        Args:
+            url: An http:// or https:// URL.
+
+        Returns:
+            A validator string, or None if the file does not exist,
+            the server gives neither header, or it did not answer in
+            time.
+        """
+        try:
+            response = self.head(url)
+        except requests.exceptions.Timeout as exc:
+            self._logger.warning('Could not check version of {}: {}'.format(
+                url, exc))
+            return None
+        if response.status_code != 200:
+            return None
+        if 'ETag' in response.headers:
+            return 'etag:{}'.format(response.headers['ETag'])
+        if 'Last-Modified' in response.headers:
+            return 'last-modified:{}'.format(
+                response.headers['Last-Modified'])
+        return None
+
+    def sizes(self, urls: Sequence[str]) -> List[Optional[int]]:
+        """Returns the sizes of the files at the given URLs.
+
+        The sizes are requested concurrently.
+
+        Args:
+            urls: The http:// or https:// URLs of the files.
+
+        Returns:
+            The size of each file in bytes, or None if the server
+            did not say.
+        """
+        return list(self._executor.map(self._size, urls))
+
+    def close(self) -> None:
+        """Closes all connections.
+
+        To be called on shutdown.
+        """
+        self._executor.shutdown()
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+            for file_systems in self._file_systems.values():
+                for file_system in file_systems.values():
+                    file_system.close()
+            self._file_systems.clear()
+
+    def _size(self, url: str) -> Optional[int]:
+        """Returns the size of the file at the given URL, if known.
+
+        Args:
+            url: An http:// or https:// URL.
+        """
+        try:
+            response = self.head(url)
+        except requests.exceptions.RequestException as exc:
+            self._logger.debug('Could not get size of {}: {}'.format(
+                url, exc))
+            return None
+        if (response.status_code != 200
+                or 'Content-Length' not in response.headers):
+            return None
+        return int(response.headers['Content-Length'])
+
+    def _session(self, url: str) -> requests.Session:
+        """Returns the session for the host of the given URL.
+
+        Args:
+            url: An http:// or https:// URL.
+        """
+        parsed_url = urllib.parse.urlparse(url)
+        host = parsed_url.scheme, parsed_url.netloc
+        with self._lock:
+            if host not in self._sessions:
+                adapter = requests.adapters.HTTPAdapter(
+                        pool_connections=1,
+                        pool_maxsize=self._max_connections,
+                        pool_block=True)
+                session = requests.Session()
+                session.mount('{}://'.format(parsed_url.scheme), adapter)
+                self._sessions[host] = session
+            return self._sessions[host]
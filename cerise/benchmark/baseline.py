@@ -0,0 +1,71 @@
+import json
+import platform
+import time
+from typing import Any, Dict, List
+
+
+def save_results(path: str, benchmark: str,
+                 results: List[Dict[str, Any]]) -> None:
+    """Save benchmark results as JSON.
+
+    The file contains the name of the benchmark, when and where it
+    was run, and the results. Each result is a dictionary with a
+    unique 'name' identifying the scenario, and its measurements.
+
+    Args:
+        path: The file to write to.
+        benchmark: The name of the benchmark.
+        results: The results to save.
+    """
+    data = {
+            'benchmark': benchmark,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'results': results}
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+
+
+def load_results(path: str) -> List[Dict[str, Any]]:
+    """Load benchmark results saved by save_results().
+
+    Args:
+        path: The file to read.
+
+    Returns:
+        The results stored in it.
+    """
+    with open(path) as f:
+        return json.load(f)['results']
+
+
+def find_regressions(results: List[Dict[str, Any]],
+                     baseline: List[Dict[str, Any]], metric: str,
+                     tolerance: float) -> List[str]:
+    """Compare results against a baseline.
+
+    Scenarios are matched by name, and compared on the given metric,
+    for which higher is taken to be better. Scenarios that are missing
+    from either side are ignored.
+
+    Args:
+        results: The new results.
+        baseline: The results to compare against.
+        metric: The key of the measurement to compare.
+        tolerance: The fraction by which a result may be worse than
+                the baseline before it is considered a regression.
+
+    Returns:
+        A description of each regression found.
+    """
+    baseline_by_name = {result['name']: result for result in baseline}
+    regressions = []
+    for result in results:
+        old = baseline_by_name.get(result['name'])
+        if old is None or metric not in old or metric not in result:
+            continue
+        if result[metric] < old[metric] * (1.0 - tolerance):
+            regressions.append('{}: {} went from {:.4g} to {:.4g}'.format(
+                result['name'], metric, old[metric], result[metric]))
+    return regressions
@@ -0,0 +1,297 @@
+"""Microbenchmarks for the SQLite job store.
+
+This fills a fresh database with a given number of jobs and log
+entries, and then measures the time taken by the common store and job
+operations: creating, getting and listing jobs, reading properties,
+transitioning state, adding log messages and reading the log back.
+Each operation is measured with the main thread working alone, and
+with a number of reader threads hammering the store at the same time,
+like the front end does when clients poll their jobs.
+
+Run with e.g.
+
+    python -m cerise.benchmark.store --jobs 10000 100000 \\
+            --readers 0 4 --output store.json
+
+and compare a later run against it with --baseline store.json.
+"""
+import argparse
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+from uuid import uuid4
+
+from cerise.benchmark.baseline import (find_regressions, load_results,
+                                       save_results)
+from cerise.job_store.job_state import JobState
+from cerise.job_store.sqlite_job import compress_text
+from cerise.job_store.sqlite_job_store import SQLiteJobStore
+from cerise.util import percentiles
+
+_JOB_INPUT = '{"file": {"class": "File", "location": "input.txt"}}'
+"""Input description used for all generated jobs."""
+
+
+def populate(store: SQLiteJobStore, num_jobs: int,
+             log_lines: int) -> List[str]:
+    """Fill the store with jobs and log entries.
+
+    This writes to the tables directly, in large transactions, since
+    creating a million jobs through create_job() would take far
+    longer than the benchmark itself.
+
+    Args:
+        store: The store to fill, which must be empty.
+        num_jobs: The number of jobs to create.
+        log_lines: The number of log entries to add to each job.
+
+    Returns:
+        The ids of the created jobs.
+    """
+    job_ids = [uuid4().hex for _ in range(num_jobs)]
+    states = list(JobState)
+    now = time.time()
+    batch_size = 10000
+    with store:
+        conn = store._thread_local_data.conn
+        for begin in range(0, num_jobs, batch_size):
+            batch = job_ids[begin:begin + batch_size]
+            conn.executemany(
+                'INSERT INTO jobs (job_id, name, workflow, local_input,'
+                ' state, state_time) VALUES (?, ?, ?, ?, ?, ?)',
+                [(job_id, 'job{}'.format(begin + i),
+                  'file:///tmp/workflow.cwl', compress_text(_JOB_INPUT),
+                  states[(begin + i) % len(states)].name, now)
+                 for i, job_id in enumerate(batch)])
+            conn.executemany(
+                'INSERT INTO job_events (job_id, from_state, to_state, time)'
+                ' VALUES (?, NULL, ?, ?)',
+                [(job_id, JobState.SUBMITTED.name, now) for job_id in batch])
+            conn.executemany(
+                'INSERT INTO job_log (job_id, level, time, message)'
+                ' VALUES (?, ?, ?, ?)',
+                [(job_id, logging.INFO, now,
+                  compress_text('Log message {} for this job'.format(j)))
+                 for job_id in batch for j in range(log_lines)])
+            conn.commit()
+    return job_ids
+
+
+def _reader(store: SQLiteJobStore, job_ids: List[str],
+            stop: threading.Event, counts: List[int]) -> None:
+    """Read jobs the way the front end does, until told to stop.
+
+    Args:
+        store: The store to read from.
+        job_ids: The jobs to choose from.
+        stop: Set when the reader should stop.
+        counts: A list to append the number of requests done to.
+    """
+    rng = random.Random()
+    count = 0
+    while not stop.is_set():
+        with store:
+            job = store.get_job(rng.choice(job_ids))
+            job.state
+            job.log
+        count += 1
+    counts.append(count)
+
+
+def _measure(operation: Callable[[int], Any], samples: int) -> List[float]:
+    """Time an operation a number of times.
+
+    Each sample is done in its own store transaction, like the back
+    end and front end do for each request or job.
+
+    Args:
+        operation: The operation to perform, which gets the sample
+                number.
+        samples: The number of times to run it.
+
+    Returns:
+        The duration of each run, in seconds.
+    """
+    durations = []
+    for i in range(samples):
+        start = time.perf_counter()
+        operation(i)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def _operations(store: SQLiteJobStore, job_ids: List[str],
+                rng: random.Random) -> Dict[str, Callable[[int], Any]]:
+    """Make the operations to benchmark.
+
+    Args:
+        store: The store to use.
+        job_ids: The jobs in the store.
+        rng: Random number generator for choosing jobs.
+
+    Returns:
+        A function for each operation, by name.
+    """
+    def create_job(i: int) -> None:
+        with store:
+            store.create_job('new_job{}'.format(i), 'file:///tmp/wf.cwl',
+                             _JOB_INPUT)
+
+    def get_job(i: int) -> None:
+        with store:
+            store.get_job(rng.choice(job_ids))
+
+    def list_jobs(i: int) -> None:
+        with store:
+            store.list_jobs()
+
+    def properties(i: int) -> None:
+        with store:
+            job = store.get_job(rng.choice(job_ids))
+            job.name
+            job.state
+            job.local_input
+            job.remote_job_id
+
+    def try_transition(i: int) -> None:
+        with store:
+            job = store.get_job(rng.choice(job_ids))
+            job.try_transition(job.state, JobState.RUNNING)
+
+    def add_log(i: int) -> None:
+        with store:
+            job = store.get_job(rng.choice(job_ids))
+            job.info('Benchmark message {}'.format(i))
+
+    def get_log(i: int) -> None:
+        with store:
+            store.get_job(rng.choice(job_ids)).log
+
+    return {
+            'create_job': create_job,
+            'get_job': get_job,
+            'list_jobs': list_jobs,
+            'properties': properties,
+            'try_transition': try_transition,
+            'add_log': add_log,
+            'get_log': get_log}
+
+
+def run_scenario(num_jobs: int, log_lines: int, num_readers: int,
+                 samples: int, list_samples: int) -> List[Dict[str, Any]]:
+    """Benchmark all operations on a store of a given size.
+
+    Args:
+        num_jobs: The number of jobs to put in the store.
+        log_lines: The number of log entries per job.
+        num_readers: The number of concurrent reader threads.
+        samples: The number of times to run each operation.
+        list_samples: The number of times to run list_jobs, which
+                is much slower than the others.
+
+    Returns:
+        A result for each operation, with the parameters, operations
+        per second, and percentiles of the latency in seconds.
+    """
+    work_dir = tempfile.mkdtemp(prefix='cerise_benchmark_')
+    try:
+        store = SQLiteJobStore(os.path.join(work_dir, 'jobs.db'))
+        populate_start = time.perf_counter()
+        job_ids = populate(store, num_jobs, log_lines)
+        populate_duration = time.perf_counter() - populate_start
+
+        stop = threading.Event()
+        reader_counts = []  # type: List[int]
+        readers = [
+                threading.Thread(target=_reader,
+                                 args=(store, job_ids, stop, reader_counts))
+                for _ in range(num_readers)]
+        for reader in readers:
+            reader.start()
+
+        results = []
+        start = time.perf_counter()
+        try:
+            rng = random.Random(0)
+            for name, operation in _operations(store, job_ids, rng).items():
+                num_samples = list_samples if name == 'list_jobs' else samples
+                durations = _measure(operation, num_samples)
+                result = {
+                        'name': '{}-{}-{}-{}'.format(name, num_jobs, log_lines,
+                                                     num_readers),
+                        'operation': name,
+                        'jobs': num_jobs,
+                        'log_lines': log_lines,
+                        'readers': num_readers,
+                        'populate_duration': populate_duration,
+                        'ops_per_second': len(durations) / sum(durations),
+                        'latency': percentiles(durations)}
+                results.append(result)
+        finally:
+            stop.set()
+            for reader in readers:
+                reader.join()
+        duration = time.perf_counter() - start
+
+        for result in results:
+            result['reader_requests_per_second'] = (
+                    sum(reader_counts) / duration)
+        return results
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description='Measure the performance of the SQLite job store.')
+    parser.add_argument('--jobs', nargs='+', type=int, default=[10000],
+                        help='Numbers of jobs to put in the store')
+    parser.add_argument('--log-lines', nargs='+', type=int, default=[10],
+                        help='Numbers of log entries per job')
+    parser.add_argument('--readers', nargs='+', type=int, default=[0, 4],
+                        help='Numbers of concurrent reader threads')
+    parser.add_argument('--samples', type=int, default=1000,
+                        help='Number of times to run each operation')
+    parser.add_argument('--list-samples', type=int, default=10,
+                        help='Number of times to run list_jobs')
+    parser.add_argument('--output', help='File to save the results to')
+    parser.add_argument('--baseline', help='Results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed fractional loss of operations per'
+                        ' second versus the baseline')
+    args = parser.parse_args(argv)
+
+    results = []  # type: List[Dict[str, Any]]
+    for num_jobs in args.jobs:
+        for log_lines in args.log_lines:
+            for num_readers in args.readers:
+                scenario = run_scenario(num_jobs, log_lines, num_readers,
+                                        args.samples, args.list_samples)
+                for result in scenario:
+                    print('{}: {:.1f} ops/s, p99 {:.3g} ms'.format(
+                        result['name'], result['ops_per_second'],
+                        result['latency']['p99'] * 1000.0))
+                results.extend(scenario)
+
+    if args.output:
+        save_results(args.output, 'store', results)
+
+    if args.baseline:
+        regressions = find_regressions(
+            results, load_results(args.baseline), 'ops_per_second',
+            args.tolerance)
+        for regression in regressions:
+            print('Regression: {}'.format(regression))
+        if regressions != []:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
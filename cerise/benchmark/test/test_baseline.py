@@ -0,0 +1,26 @@
+import os
+
+from cerise.benchmark.baseline import (find_regressions, load_results,
+                                       save_results)
+
+
+def test_save_load_results(tmpdir):
+    path = os.path.join(str(tmpdir), 'results.json')
+    results = [{'name': 'a', 'ops_per_second': 10.0}]
+    save_results(path, 'test', results)
+    assert load_results(path) == results
+
+
+def test_find_regressions():
+    baseline = [
+            {'name': 'a', 'ops_per_second': 100.0},
+            {'name': 'b', 'ops_per_second': 100.0},
+            {'name': 'c', 'ops_per_second': 100.0}]
+    results = [
+            {'name': 'a', 'ops_per_second': 85.0},
+            {'name': 'b', 'ops_per_second': 75.0},
+            {'name': 'd', 'ops_per_second': 1.0}]
+
+    regressions = find_regressions(results, baseline, 'ops_per_second', 0.2)
+    assert len(regressions) == 1
+    assert regressions[0].startswith('b:')
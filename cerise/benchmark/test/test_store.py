@@ -0,0 +1,38 @@
+import json
+import os
+
+from cerise.benchmark.store import main, populate, run_scenario
+from cerise.job_store.sqlite_job_store import SQLiteJobStore
+
+
+def test_populate(tmpdir):
+    store = SQLiteJobStore(os.path.join(str(tmpdir), 'jobs.db'))
+    job_ids = populate(store, 25, 3)
+    with store:
+        assert len(store.list_jobs()) == 25
+        job = store.get_job(job_ids[0])
+        assert job.name == 'job0'
+        assert len(list(job.get_log())) == 3
+
+
+def test_run_scenario():
+    results = run_scenario(100, 2, 2, 10, 2)
+    operations = [result['operation'] for result in results]
+    assert 'create_job' in operations
+    assert 'get_log' in operations
+    for result in results:
+        assert result['ops_per_second'] > 0.0
+        assert result['readers'] == 2
+        assert result['reader_requests_per_second'] > 0.0
+    list_jobs = [r for r in results if r['operation'] == 'list_jobs'][0]
+    assert list_jobs['latency']['count'] == 2
+
+
+def test_main(tmpdir):
+    output = os.path.join(str(tmpdir), 'store.json')
+    assert main(['--jobs', '50', '--readers', '0', '--samples', '5',
+                 '--list-samples', '1', '--output', output]) == 0
+    with open(output) as f:
+        data = json.load(f)
+    assert data['benchmark'] == 'store'
+    assert len(data['results']) == 7
@@ -0,0 +1,34 @@
+import json
+import os
+
+from cerise.benchmark.throughput import main, run_scenario
+
+
+def test_run_scenario():
+    result = run_scenario('WcJob', 2, 1000, 0.1, 60.0)
+    assert result['completed']
+    assert result['final_states'] == {'SUCCESS': 2}
+    assert result['jobs_per_second'] > 0.0
+    assert result['phase_latency']['stage_file']['count'] == 2
+    assert 'RUNNING' in result['state_latency']
+
+
+def test_main_baseline(tmpdir):
+    output = os.path.join(str(tmpdir), 'results.json')
+    assert main(['--jobs', '1', '--refresh', '0.1', '--output', output]) == 0
+    with open(output) as f:
+        results = json.load(f)['results']
+
+    results[0]['jobs_per_second'] *= 100.0
+    with open(output, 'w') as f:
+        json.dump({'results': results}, f)
+    assert main(['--jobs', '1', '--refresh', '0.1', '--baseline', output]
+                ) == 1
+
+
+def test_run_scenario_simulated():
+    simulation = {'latency': 0.001, 'queue-wait': 0.1, 'run-time': 0.1}
+    result = run_scenario('WcJob', 20, None, 0.1, 60.0, simulation)
+    assert result['name'].endswith('-simulated')
+    assert result['completed']
+    assert result['final_states'] == {'SUCCESS': 20}
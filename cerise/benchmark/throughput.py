@@ -0,0 +1,330 @@
+"""End-to-end throughput benchmark for the back end.
+
+This runs an ExecutionManager against the local machine, using the
+local file system and the directgnu scheduler, so no Docker container
+or remote resource is needed. For each combination of fixture job,
+number of jobs, input file size and refresh interval, it submits the
+jobs, waits for them all to finish, and reports jobs per second as
+well as percentiles of the time spent in each state and each phase.
+
+Run with e.g.
+
+    python -m cerise.benchmark.throughput --jobs 100 1000 \\
+            --fixture WcJob FileArrayJob --output results.json
+
+and compare a later run against it with --baseline results.json.
+
+With --simulate, the remote resource is replaced by the simulated one
+from cerise.simulated, which adds latency, bandwidth limits and queue
+waits but does not actually run the jobs. This makes it possible to
+see how the back end itself scales to many thousands of jobs, e.g.
+
+    python -m cerise.benchmark.throughput --jobs 10000 --simulate \\
+            --latency 0.05 --queue-wait 30 --run-time 60
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import cerulean
+
+import cerise.config
+from cerise.back_end.execution_manager import ExecutionManager
+from cerise.benchmark.baseline import (find_regressions, load_results,
+                                       save_results)
+from cerise.job_store.job_state import JobState
+from cerise.job_store.sqlite_job_store import SQLiteJobStore
+from cerise.test import fixture_jobs
+from cerise.util import percentiles
+
+_ROOT_DIR = os.path.join(os.path.dirname(__file__), '..', '..')
+"""The root of the source tree."""
+
+
+def _make_api_dir(work_dir: str) -> str:
+    """Build a local API with the test steps and the real CWL runner.
+
+    Args:
+        work_dir: The directory to build it in.
+
+    Returns:
+        The path of the API directory.
+    """
+    api_dir = os.path.join(work_dir, 'api')
+    shutil.copytree(os.path.join(_ROOT_DIR, 'cerise', 'test', 'api'),
+                    api_dir)
+    shutil.copy(
+        os.path.join(_ROOT_DIR, 'api', 'cerise', 'files', 'cwltiny.py'),
+        os.path.join(api_dir, 'cerise', 'files', 'cwltiny.py'))
+    return api_dir
+
+
+def _make_config(work_dir: str, refresh: float,
+                 simulation: Optional[Dict[str, Any]] = None
+                 ) -> cerise.config.Config:
+    """Create a configuration that runs everything locally.
+
+    Args:
+        work_dir: The directory to put the database, the exchange
+                store and the remote directory in.
+        refresh: The remote refresh interval, in seconds.
+        simulation: Settings for a simulated remote resource, or None
+                to use the local machine directly.
+    """
+    exchange_url = 'file://' + os.path.join(work_dir, 'exchange')
+    config = {
+            'database': {'file': os.path.join(work_dir, 'cerise.db')},
+            'client-file-exchange': {
+                'store-location-service': exchange_url,
+                'store-location-client': exchange_url}}
+    api_config = {
+            'compute-resource': {
+                'refresh': refresh,
+                'files': {
+                    'protocol': 'local',
+                    'path': os.path.join(work_dir, 'remote')},
+                'jobs': {
+                    'protocol': 'local',
+                    'scheduler': 'directgnu',
+                    'cwl-runner': '$CERISE_API/cerise/files/cwltiny.py'}}}
+    if simulation is not None:
+        for kind in ['files', 'jobs']:
+            api_config['compute-resource'][kind]['protocol'] = 'simulated'
+            api_config['compute-resource'][kind]['simulation'] = simulation
+    return cerise.config.Config(config, api_config)
+
+
+def _input_content(job_fixture: Any, name: str,
+                   input_size: Optional[int]) -> bytes:
+    """Return the content of an input file.
+
+    Args:
+        job_fixture: The fixture job the file is for.
+        name: The name of the file.
+        input_size: The size of the file in bytes, or None to use the
+                fixture's content.
+    """
+    if input_size is None:
+        return job_fixture.input_content.get(name, b'')
+    line = b'A line of benchmark input data.\n'
+    return (line * (input_size // len(line) + 1))[:input_size]
+
+
+def _submit_jobs(store: SQLiteJobStore, exchange_dir: str,
+                 job_fixture: Any, num_jobs: int,
+                 input_size: Optional[int]) -> None:
+    """Submit jobs the way the front end does.
+
+    Args:
+        store: The store to submit to.
+        exchange_dir: The local path of the file exchange store.
+        job_fixture: The fixture job to submit copies of.
+        num_jobs: The number of jobs to submit.
+        input_size: The size of the input files, or None to use the
+                fixture's content.
+    """
+    with store:
+        for i in range(num_jobs):
+            input_dir = os.path.join(exchange_dir, 'input', 'job{}'.format(i))
+            os.makedirs(input_dir)
+            workflow_file = os.path.join(input_dir, 'workflow.cwl')
+            with open(workflow_file, 'wb') as f:
+                f.write(job_fixture.workflow)
+
+            def write_inputs(input_files: List[Any]) -> None:
+                for input_file in input_files:
+                    with open(os.path.join(input_dir, input_file.location),
+                              'wb') as f:
+                        f.write(_input_content(
+                            job_fixture, input_file.location, input_size))
+                    write_inputs(input_file.secondary_files)
+
+            write_inputs(job_fixture.local_input_files)
+
+            local_input = job_fixture.local_input(
+                'file://{}/'.format(input_dir))
+            store.create_job('job{}'.format(i), 'file://' + workflow_file,
+                             json.dumps(json.loads(local_input)))
+
+
+def _wait_for_jobs(store: SQLiteJobStore, timeout: float) -> bool:
+    """Wait until all jobs in the store are in a final state.
+
+    Args:
+        store: The store to check.
+        timeout: The maximum time to wait, in seconds.
+
+    Returns:
+        True iff all jobs finished within the timeout.
+    """
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        with store:
+            counts = store.count_jobs_by_state()
+        if all(JobState.is_final(state) for state in counts):
+            return True
+        time.sleep(0.1)
+    return False
+
+
+def run_scenario(fixture_name: str, num_jobs: int,
+                 input_size: Optional[int], refresh: float,
+                 timeout: float,
+                 simulation: Optional[Dict[str, Any]] = None
+                 ) -> Dict[str, Any]:
+    """Run a single benchmark scenario.
+
+    Args:
+        fixture_name: The name of the fixture job class to run.
+        num_jobs: The number of jobs to run.
+        input_size: The size of the input files, or None to use the
+                fixture's content.
+        refresh: The remote refresh interval, in seconds.
+        timeout: The maximum time to wait for the jobs, in seconds.
+        simulation: Settings for a simulated remote resource, or None
+                to use the local machine directly.
+
+    Returns:
+        A dictionary with the parameters and the results.
+    """
+    job_fixture = getattr(fixture_jobs, fixture_name)
+    work_dir = tempfile.mkdtemp(prefix='cerise_benchmark_')
+    config = _make_config(work_dir, refresh, simulation)
+    try:
+        api_dir = cerulean.LocalFileSystem() / _make_api_dir(work_dir)
+        manager = ExecutionManager(config, api_dir)
+        store = SQLiteJobStore(config.get_database_location())
+        start_time = time.time()
+        _submit_jobs(store, os.path.join(work_dir, 'exchange'), job_fixture,
+                     num_jobs, input_size)
+
+        start = time.perf_counter()
+        manager_thread = threading.Thread(target=manager.execute_jobs)
+        manager_thread.start()
+        try:
+            completed = _wait_for_jobs(store, timeout)
+            duration = time.perf_counter() - start
+        finally:
+            manager.shutdown()
+            manager_thread.join()
+        end_time = time.time()
+
+        with store:
+            states = store.count_jobs_by_state()
+            state_latencies = store.get_phase_latency_percentiles(
+                start_time, end_time)
+            phase_durations = dict()  # type: Dict[str, List[float]]
+            for job in store.list_jobs():
+                for timing in job.get_timings():
+                    phase_durations.setdefault(timing.phase, []).append(
+                        timing.duration)
+
+        name = '{}-{}-{}-{}'.format(fixture_name, num_jobs, input_size,
+                                    refresh)
+        if simulation is not None:
+            name += '-simulated'
+
+        return {
+                'name': name,
+                'fixture': fixture_name,
+                'jobs': num_jobs,
+                'input_size': input_size,
+                'refresh': refresh,
+                'simulation': simulation,
+                'completed': completed,
+                'duration': duration,
+                'jobs_per_second': num_jobs / duration,
+                'final_states': {
+                    state.name: count for state, count in states.items()},
+                'state_latency': {
+                    state.name: stats
+                    for state, stats in state_latencies.items()},
+                'phase_latency': {
+                    phase: percentiles(durations)
+                    for phase, durations in phase_durations.items()}}
+    finally:
+        config.close_file_systems()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description='Measure end-to-end job throughput of the back end.')
+    parser.add_argument('--fixture', nargs='+', default=['WcJob'],
+                        help='Fixture jobs to run, from'
+                        ' cerise.test.fixture_jobs')
+    parser.add_argument('--jobs', nargs='+', type=int, default=[100],
+                        help='Numbers of jobs to run')
+    parser.add_argument('--input-size', nargs='+', type=int, default=None,
+                        help='Sizes of the input files in bytes, by default'
+                        ' the fixture inputs are used')
+    parser.add_argument('--refresh', nargs='+', type=float, default=[0.5],
+                        help='Remote refresh intervals in seconds')
+    parser.add_argument('--timeout', type=float, default=3600.0,
+                        help='Maximum time to wait for a scenario')
+    parser.add_argument('--output', help='File to save the results to')
+    parser.add_argument('--baseline', help='Results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed fractional throughput loss versus the'
+                        ' baseline')
+    parser.add_argument('--simulate', action='store_true',
+                        help='Use a simulated remote resource')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Simulated latency per call in seconds')
+    parser.add_argument('--bandwidth', type=float, default=0.0,
+                        help='Simulated bandwidth in bytes per second')
+    parser.add_argument('--queue-wait', type=float, default=0.0,
+                        help='Simulated mean queue wait in seconds')
+    parser.add_argument('--run-time', type=float, default=0.0,
+                        help='Simulated job run time in seconds')
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help='Simulated fraction of failing remote calls')
+    args = parser.parse_args(argv)
+
+    simulation = None
+    if args.simulate:
+        simulation = {
+                'latency': args.latency,
+                'bandwidth': args.bandwidth,
+                'queue-wait': args.queue_wait,
+                'run-time': args.run_time,
+                'failure-rate': args.failure_rate,
+                'seed': 0}
+
+    logging.basicConfig(level=logging.WARNING)
+
+    results = []
+    for fixture_name in args.fixture:
+        for num_jobs in args.jobs:
+            for input_size in (args.input_size or [None]):
+                for refresh in args.refresh:
+                    result = run_scenario(fixture_name, num_jobs, input_size,
+                                          refresh, args.timeout, simulation)
+                    print('{}: {:.2f} jobs/s{}'.format(
+                        result['name'], result['jobs_per_second'],
+                        '' if result['completed'] else ' (timed out)'))
+                    results.append(result)
+
+    if args.output:
+        save_results(args.output, 'throughput', results)
+
+    if args.baseline:
+        regressions = find_regressions(
+            results, load_results(args.baseline), 'jobs_per_second',
+            args.tolerance)
+        for regression in regressions:
+            print('Regression: {}'.format(regression))
+        if regressions != []:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -9,6 +9,8 @@ import yaml
 
 _remote_file_system = None
 
+_stream_file_systems = dict()  # type: Dict[int, cerulean.FileSystem]
+
 
 class Config:
     def __init__(self, config: Dict[str, Any],
@@ -31,6 +33,12 @@ class Config:
         if 'compute-resource' in self._api_config:
             self._cr_config = cast(dict, self._api_config['compute-resource'])
 
+        files_config = self._cr_config.get('files', {})
+        if (files_config.get('link', False)
+                and files_config.get('protocol') == 'simulated'):
+            self._logger.warning('Files cannot be linked with the simulated'
+                                 ' protocol, copying them instead')
+
     def _get_credential_variable(self, kind: str, name: str) -> Optional[str]:
         def have_config(kind: str, name: str) -> bool:
             if kind == '':
@@ -102,6 +110,10 @@ class Config:
         global _remote_file_system
         if _remote_file_system is not None:
             _remote_file_system.close()
+            _remote_file_system = None
+        for file_system in _stream_file_systems.values():
+            file_system.close()
+        _stream_file_systems.clear()
 
     def get_service_host(self) -> str:
         """
@@ -123,6 +135,32 @@ class Config:
         rs_config = self._config.get('rest-service', {})
         return int(rs_config.get('port', 29593))
 
+    def get_max_backlog(self) -> Optional[int]:
+        """
+        Return the number of submitted jobs above which new ones are \
+        refused.
+
+        Returns:
+            (Union[int,None]): The maximum backlog, or None to accept \
+                    all jobs.
+        """
+        rs_config = self._config.get('rest-service', {})
+        max_backlog = rs_config.get('max-backlog')
+        if max_backlog is None:
+            return None
+        return int(max_backlog)
+
+    def get_retry_after(self) -> int:
+        """
+        Return the number of seconds clients should wait before \
+        submitting again after a job was refused.
+
+        Returns:
+            int: The delay in seconds.
+        """
+        rs_config = self._config.get('rest-service', {})
+        return int(rs_config.get('retry-after', 60))
+
     def get_username(self, kind: str) -> Optional[str]:
         """
         Return the username used to connect to the specified kind of resource.
@@ -158,6 +196,13 @@ class Config:
             scheduler_type = self._cr_config['jobs'].get(
                 'scheduler', 'directgnu')
 
+        if protocol == 'simulated':
+            from cerise.simulated import SimulatedHeadNode, SimulatedScheduler
+            settings = self._get_simulation_settings('jobs')
+            if run_on_head_node:
+                return SimulatedHeadNode(settings)
+            return SimulatedScheduler(settings)
+
         if run_on_head_node:
             scheduler_type = 'directgnu'
 
@@ -166,31 +211,78 @@ class Config:
         scheduler = cerulean.make_scheduler(scheduler_type, terminal)
         return scheduler
 
-    def get_file_system(self) -> cerulean.FileSystem:
+    def get_file_system(self, stream: int = 0) -> cerulean.FileSystem:
         """
         Returns a remote file system as configured by the user.
 
+        Each stream has its own connection, so that files can be \
+        transferred in parallel. Stream 0 is the one used for \
+        everything else.
+
+        Args:
+            stream (int): The transfer stream to get a file system for.
+
         Returns:
             (cerulean.FileSystem) A new filesystem
         """
         global _remote_file_system
+        if stream != 0:
+            if stream not in _stream_file_systems:
+                _stream_file_systems[stream] = self._make_file_system()
+            return _stream_file_systems[stream]
+
         if _remote_file_system is None:
-            if 'files' not in self._cr_config:
-                protocol = 'local'
-                location = None
-            else:
-                protocol = self._cr_config['files'].get('protocol', 'local')
-                location = self._cr_config['files'].get('location')
+            _remote_file_system = self._make_file_system()
+        return _remote_file_system
 
-            credential = self._get_credential('files')
-            self._logger.debug(
-                ('protocol: {}, location: {}, credential: {}').format(
-                    protocol, location, credential))
+    def _make_file_system(self) -> cerulean.FileSystem:
+        """
+        Connects to the remote file system as configured by the user.
 
-            _remote_file_system = cerulean.make_file_system(
-                protocol, location, credential)
+        Returns:
+            (cerulean.FileSystem) A new filesystem
+        """
+        if 'files' not in self._cr_config:
+            protocol = 'local'
+            location = None
+        else:
+            protocol = self._cr_config['files'].get('protocol', 'local')
+            location = self._cr_config['files'].get('location')
 
-        return _remote_file_system
+        if protocol == 'simulated':
+            from cerise.simulated import SimulatedFileSystem
+            return SimulatedFileSystem(self._get_simulation_settings('files'))
+
+        credential = self._get_credential('files')
+        self._logger.debug(
+            ('protocol: {}, location: {}, credential: {}').format(
+                protocol, location, credential))
+
+        return cerulean.make_file_system(protocol, location, credential)
+
+    def get_transfer_streams(self) -> int:
+        """
+        Returns the number of files to transfer at the same time.
+
+        Returns:
+            (int): The number of streams.
+        """
+        if 'files' not in self._cr_config:
+            return 1
+        return max(1, int(self._cr_config['files'].get('streams', 1)))
+
+    def _get_simulation_settings(self, kind: str) -> Dict[str, Any]:
+        """Returns the settings for a simulated compute resource.
+
+        Args:
+            kind (str): Either 'files' or 'jobs'.
+
+        Returns:
+            (dict): A copy of the simulation block, or an empty dict.
+        """
+        if kind not in self._cr_config:
+            return dict()
+        return dict(self._cr_config[kind].get('simulation', dict()))
 
     def get_remote_cwl_runner(self) -> str:
         """
@@ -223,6 +315,107 @@ class Config:
         basedir = basedir.strip('/')
         return self.get_file_system() / basedir
 
+    def get_transfer_bandwidth(self) -> Optional[float]:
+        """
+        Returns the maximum total rate at which to transfer files.
+
+        Returns:
+            (Union[float,None]): The rate in bytes per second, or \
+                    None for no limit.
+        """
+        if 'files' not in self._cr_config:
+            return None
+        bandwidth = self._cr_config['files'].get('bandwidth')
+        if bandwidth is None:
+            return None
+        return float(bandwidth)
+
+    def get_chunk_threshold(self) -> Optional[int]:
+        """
+        Returns the size from which files are copied in chunks, so \
+        that an interrupted copy can be resumed.
+
+        Returns:
+            (Union[int,None]): The size in bytes, or None to never \
+                    copy in chunks.
+        """
+        if 'files' not in self._cr_config:
+            return None
+        threshold = self._cr_config['files'].get('chunk-threshold')
+        if threshold is None:
+            return None
+        return int(threshold)
+
+    def get_chunk_size(self) -> int:
+        """
+        Returns the size of the chunks to copy large files in.
+
+        Returns:
+            (int): The size in bytes.
+        """
+        default = 64 * 1024 * 1024
+        if 'files' not in self._cr_config:
+            return default
+        return int(self._cr_config['files'].get('chunk-size', default))
+
+    def get_link_files(self) -> bool:
+        """
+        Returns whether files are staged by linking them, when the \
+        compute resource is on the local file system.
+
+        This is never the case for the simulated protocol, as linked \
+        files would bypass the simulated connection.
+
+        Returns:
+            (bool): True iff files should be linked rather than \
+                    copied where possible.
+        """
+        if 'files' not in self._cr_config:
+            return False
+        if self._cr_config['files'].get('protocol') == 'simulated':
+            return False
+        return bool(self._cr_config['files'].get('link', False))
+
+    def get_bundle_threshold(self) -> Optional[int]:
+        """
+        Returns the number of input files from which a job's inputs \
+        are staged as a single archive.
+
+        Returns:
+            (Union[int,None]): The number of files, or None to always \
+                    stage files one by one.
+        """
+        if 'files' not in self._cr_config:
+            return None
+        threshold = self._cr_config['files'].get('bundle-threshold')
+        if threshold is None:
+            return None
+        return int(threshold)
+
+    def get_bundle_max_size(self) -> int:
+        """
+        Returns the size from which input files are staged separately \
+        rather than in the archive.
+
+        Returns:
+            (int): The size in bytes.
+        """
+        if 'files' not in self._cr_config:
+            return 16 * 2**20
+        return int(self._cr_config['files'].get(
+            'bundle-max-size', 16 * 2**20))
+
+    def get_bundle_compression(self) -> int:
+        """
+        Returns the gzip compression level for input archives.
+
+        Returns:
+            (int): The level, from 1 to 9, or 0 for no compression.
+        """
+        if 'files' not in self._cr_config:
+            return 0
+        return int(self._cr_config['files'].get('bundle-compression', 0))
+
     def get_queue_name(self) -> Optional[str]:
         """
         Returns the name of the queue to submit jobs to, or None if no
@@ -277,6 +470,54 @@ class Config:
             return 32
         return self._cr_config['jobs'].get('cores-per-node', 32)
 
+    def _get_job_limit(self, name: str) -> Optional[int]:
+        """Returns a limit from the jobs configuration, if set.
+
+        Args:
+            name (str): The name of the setting.
+
+        Returns:
+            (Union[int,None]): The limit, or None if there is none.
+        """
+        if 'jobs' not in self._cr_config:
+            return None
+        limit = self._cr_config['jobs'].get(name)
+        if limit is None:
+            return None
+        return int(limit)
+
+    def get_max_staging_jobs(self) -> Optional[int]:
+        """
+        Returns the maximum number of jobs to stage in at the same time.
+
+        Returns:
+            (Union[int,None]): The limit, or None if there is none.
+        """
+        return self._get_job_limit('max-staging-jobs')
+
+    def get_max_remote_jobs(self) -> Optional[int]:
+        """
+        Returns the maximum number of jobs to have on the compute \
+        resource at the same time, waiting or running.
+
+        This should be set below any limit the scheduler puts on the \
+        number of jobs per user.
+
+        Returns:
+            (Union[int,None]): The limit, or None if there is none.
+        """
+        return self._get_job_limit('max-remote-jobs')
+
+    def get_max_staged_bytes(self) -> Optional[int]:
+        """
+        Returns the maximum number of bytes of input data to have \
+        staged for jobs that are not yet running.
+
+        Returns:
+            (Union[int,None]): The limit, or None if there is none.
+        """
+        return self._get_job_limit('max-staged-bytes')
+
     def get_remote_refresh(self) -> float:
         """
         Returns the interval in between checks of the remote job \
@@ -287,6 +528,39 @@ class Config:
         """
         return self._cr_config.get('refresh', 60.0)
 
+    def get_backoff_initial(self) -> float:
+        """
+        Returns the time to wait before retrying a job after a \
+        connection problem, in seconds.
+
+        This doubles with each consecutive problem, up to the \
+        maximum given by get_backoff_max().
+
+        Returns:
+            (float): The initial delay.
+        """
+        return float(self._cr_config.get('backoff', {}).get('initial', 10.0))
+
+    def get_backoff_max(self) -> float:
+        """
+        Returns the maximum time to wait before retrying a job after \
+        a connection problem, in seconds.
+
+        Returns:
+            (float): The maximum delay.
+        """
+        return float(self._cr_config.get('backoff', {}).get('max', 600.0))
+
+    def get_circuit_breaker_threshold(self) -> int:
+        """
+        Returns the number of consecutive connection problems after \
+        which all remote work is paused.
+
+        Returns:
+            (int): The number of problems.
+        """
+        return int(self._cr_config.get('backoff', {}).get('failures', 5))
+
     def get_database_location(self) -> str:
         """
         Returns the local path to the database file.
@@ -299,6 +573,96 @@ class Config:
         """
         return self._config['database']['file']
 
+    def get_retention_days(self) -> Optional[float]:
+        """
+        Returns the number of days to keep finished jobs, if any.
+
+        Returns:
+            (Union[float,None]): The number of days, or None to keep \
+                    jobs until they are deleted by the client.
+        """
+        days = self._config.get('retention', {}).get('days')
+        if days is None:
+            return None
+        return float(days)
+
+    def get_retention_action(self) -> str:
+        """
+        Returns what to do with jobs that have expired.
+
+        Returns:
+            (str): Either 'delete' or 'archive'.
+
+        Raises:
+            RuntimeError: An invalid action was configured.
+        """
+        action = self._config.get('retention', {}).get('action', 'delete')
+        if action not in ['delete', 'archive']:
+            raise RuntimeError('Config retention action must be either'
+                               ' "delete" or "archive".')
+        return action
+
+    def get_archive_dir(self) -> str:
+        """
+        Returns the local path to the directory to archive jobs to.
+
+        Returns:
+            (str): The path.
+        """
+        return self._config.get('retention', {}).get(
+            'archive-dir', 'run/archive')
+
+    def get_metrics_host(self) -> str:
+        """
+        Returns the address the back end serves its metrics on.
+
+        Returns:
+            (str): An IP address or host name, 127.0.0.1 by default.
+        """
+        return self._config.get('metrics', {}).get('hostname', '127.0.0.1')
+
+    def get_metrics_port(self) -> Optional[int]:
+        """
+        Returns the port the back end serves its metrics on, if any.
+
+        Returns:
+            (Union[int,None]): The port, or None if the back end \
+                    should not serve metrics.
+        """
+        port = self._config.get('metrics', {}).get('port')
+        if port is None:
+            return None
+        return int(port)
+
+    def get_trace_file(self) -> Optional[str]:
+        """
+        Returns the local path to write a job timing trace to, if any.
+
+        Returns:
+            (Union[str,None]): The path, or None if no trace should \
+                    be written.
+        """
+        return self._config.get('metrics', {}).get('trace-file')
+
+    def get_profile_dir(self) -> str:
+        """
+        Returns the local path to the directory to write profiles to.
+
+        Returns:
+            (str): The path.
+        """
+        return self._config.get('profiling', {}).get('dir', 'run/profiles')
+
+    def get_profile_duration(self) -> float:
+        """
+        Returns the maximum time to profile the back end for, once
+        started.
+
+        Returns:
+            (float): The time in seconds.
+        """
+        return float(self._config.get('profiling', {}).get('duration', 60.0))
+
     def get_pid_file(self) -> Optional[str]:
         """
         Returns the location of the PID file, if any.
@@ -393,6 +757,53 @@ class Config:
         return self._config['client-file-exchange'].get(
             'store-location-client')
 
+    def get_web_connections(self) -> int:
+        """
+        Returns the number of connections to keep open to each web \
+        server that input files are fetched from.
+
+        Returns:
+            (int): The number of connections.
+        """
+        return max(1, int(self._config.get('client-file-exchange', {}).get(
+            'web-connections', 4)))
+
+    def get_web_timeout(self) -> float:
+        """
+        Returns how long to wait for a web server that input files \
+        are fetched from to accept a connection or answer a request.
+
+        Returns:
+            (float): The timeout in seconds.
+        """
+        return float(self._config.get('client-file-exchange', {}).get(
+            'web-timeout', 30.0))
+
+    def get_web_cache_dir(self) -> Optional[str]:
+        """
+        Returns the local directory to cache files from web servers in.
+
+        Returns:
+            (Union[str,None]): The path, or None if files should not \
+                    be cached.
+        """
+        cache = self._config.get('client-file-exchange', {}).get(
+            'web-cache')
+        if cache is None:
+            return None
+        return cache.get('dir', 'run/web_cache')
+
+    def get_web_cache_size(self) -> int:
+        """
+        Returns the maximum total size of the files in the web cache.
+
+        Returns:
+            (int): The size in bytes.
+        """
+        cache = self._config.get('client-file-exchange', {}).get(
+            'web-cache', {})
+        return int(cache.get('size', 10 * 2**30))
+
 
 def make_config() -> Config:
     """Make a configuration object.
@@ -3,13 +3,20 @@ from front_end.models.job import Job
 from front_end.models.job_description import JobDescription
 import flask
 import json
+import logging
 
+from cerise import metrics
 from cerise.job_store import job_state
+from cerise.job_store.sqlite_job import format_log_entry
 from cerise.job_store.sqlite_job_store import JobNotFound, SQLiteJobStore
 from cerise.config import make_config
 
 _config = make_config()
 _job_store = SQLiteJobStore(_config.get_database_location())
+metrics.add_job_state_collector(_job_store)
+
+_OUTPUT_RETRY_AFTER = 10
+"""Seconds clients should wait before asking for a lazy output again."""
 
 def _internal_job_to_rest_job(job):
     if job.local_output == '':
@@ -88,22 +95,106 @@ def get_job_by_id(jobId):
             flask.abort(404, "Job not found")
 
 
-def get_job_log_by_id(jobId):
+def get_job_log_by_id(jobId, since=0, limit=None, min_level=None):
     """
     Log of a job
+    The log is streamed. The X-Cerise-Log-Next header contains the
+    sequence number to pass as since to get the next part.
 
     :param jobId: Job ID
     :type jobId: str
+    :param since: Only return entries after this sequence number
+    :type since: int
+    :param limit: Maximum number of entries to return
+    :type limit: int
+    :param min_level: Only return entries of at least this level
+    :type min_level: str
 
     :rtype: str
     """
+    level = logging.NOTSET
+    if min_level is not None:
+        level = logging.getLevelName(min_level)
+
     with _job_store:
         try:
             job = _job_store.get_job(jobId)
-            return job.log
+            until = job.last_log_seq(since, limit, level)
         except JobNotFound:
             flask.abort(404, "Job not found")
 
+    def generate_log():
+        with _job_store:
+            try:
+                job = _job_store.get_job(jobId)
+            except JobNotFound:
+                return
+            for entry in job.get_log(since, until, level):
+                yield format_log_entry(entry)
+
+    return flask.Response(
+            flask.stream_with_context(generate_log()),
+            mimetype='text/plain',
+            headers={'X-Cerise-Log-Next': str(until)})
+
+
+def get_job_timings_by_id(jobId):
+    """
+    Timings of a job
+    Wall time spent by the service on each phase of processing the job.
+
+    :param jobId: Job ID
+    :type jobId: str
+
+    :rtype: List[Dict]
+    """
+    with _job_store:
+        try:
+            job = _job_store.get_job(jobId)
+            return [timing._asdict() for timing in job.get_timings()], 200
+        except JobNotFound:
+            flask.abort(404, "Job not found")
+
+
+def get_job_output_by_id(jobId, location):
+    """
+    Output file of a job
+    Redirects to an output file of the job. If the job was submitted
+    with lazy_output and the file was not fetched yet, asks the back
+    end to fetch it from the compute resource and replies with 202
+    Accepted right away, so that the client can try again later.
+
+    :param jobId: Job ID
+    :type jobId: str
+    :param location: Path of the file relative to the job's output dir
+    :type location: str
+
+    :rtype: None
+    """
+    if '..' in location.split('/'):
+        flask.abort(404, "Output not found")
+
+    output_url = '{}/output/{}/{}'.format(
+            _config.get_store_location_client(), jobId, location)
+    with _job_store:
+        try:
+            _job_store.get_job(jobId)
+        except JobNotFound:
+            flask.abort(404, "Job not found")
+        pending = _job_store.request_lazy_output(jobId, location)
+
+    if not pending:
+        output_path = (_config.get_store_location_service() / 'output' /
+                       jobId / location)
+        if not output_path.exists():
+            flask.abort(404, "Output not found")
+        return flask.redirect(output_url, code=303)
+
+    return flask.Response(
+            'Output is being fetched, please try again later',
+            status=202, mimetype='text/plain',
+            headers={'Retry-After': str(_OUTPUT_RETRY_AFTER)})
+
 
 def get_jobs():
     """
@@ -117,10 +208,23 @@ def get_jobs():
         job_list = _job_store.list_jobs()
         return [_internal_job_to_rest_job(job) for job in job_list]
 
+def get_metrics():
+    """
+    Service metrics
+    Performance metrics of the front end, in the Prometheus text format.
+
+    :rtype: str
+    """
+    return flask.Response(
+            metrics.REGISTRY.expose(), content_type=metrics.CONTENT_TYPE)
+
+
 def post_job(body):
     """
     submit a new job
-    Submit a new job from a workflow definition.
+    Submit a new job from a workflow definition. Jobs are shared
+    fairly between clients identified by an X-Cerise-Client header,
+    or if there is none, by job name without any trailing number.
     :param body: Input binding for workflow.
     :type body: dict | bytes
 
@@ -130,8 +234,26 @@ def post_job(body):
         body = JobDescription.from_dict(connexion.request.get_json())
 
     with _job_store:
+        max_backlog = _config.get_max_backlog()
+        if max_backlog is not None:
+            backlog = _job_store.count_jobs_by_state().get(
+                    job_state.JobState.SUBMITTED, 0)
+            if backlog >= max_backlog:
+                return flask.Response(
+                        'Too many jobs waiting to be processed,'
+                        ' please try again later',
+                        status=429, mimetype='text/plain',
+                        headers={'Retry-After': str(_config.get_retry_after())})
+
+        eager_outputs = None
+        if body.lazy_output:
+            eager_outputs = body.eager_outputs or []
+
         job_id = _job_store.create_job(
-                body.name, body.workflow, json.dumps(body.input))
+                body.name, body.workflow, json.dumps(body.input),
+                body.priority or 0,
+                connexion.request.headers.get('X-Cerise-Client'),
+                eager_outputs)
 
         job = _job_store.get_job(job_id)
         return _internal_job_to_rest_job(job), 201
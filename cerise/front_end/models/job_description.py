@@ -4,6 +4,7 @@ from __future__ import absolute_import
 from front_end.models.workflow_binding import WorkflowBinding
 from .base_model_ import Model
 from datetime import datetime
+from typing import List
 from ..util import deserialize_model
 
 
@@ -12,7 +13,7 @@ class JobDescription(Model):
     NOTE: This class is auto generated by the swagger code generator program.
     Do not edit the class manually.
     """
-    def __init__(self, name: str=None, workflow: str=None, input: WorkflowBinding=None):
+    def __init__(self, name: str=None, workflow: str=None, input: WorkflowBinding=None, priority: int=None, lazy_output: bool=None, eager_outputs: List[str]=None):
         """
         JobDescription - a model defined in Swagger
 
@@ -22,22 +23,37 @@ class JobDescription(Model):
         :type workflow: str
         :param input: The input of this JobDescription.
         :type input: WorkflowBinding
+        :param priority: The priority of this JobDescription.
+        :type priority: int
+        :param lazy_output: The lazy_output of this JobDescription.
+        :type lazy_output: bool
+        :param eager_outputs: The eager_outputs of this JobDescription.
+        :type eager_outputs: List[str]
         """
         self.swagger_types = {
             'name': str,
             'workflow': str,
-            'input': WorkflowBinding
+            'input': WorkflowBinding,
+            'priority': int,
+            'lazy_output': bool,
+            'eager_outputs': List[str]
         }
 
         self.attribute_map = {
             'name': 'name',
             'workflow': 'workflow',
-            'input': 'input'
+            'input': 'input',
+            'priority': 'priority',
+            'lazy_output': 'lazy_output',
+            'eager_outputs': 'eager_outputs'
         }
 
         self._name = name
         self._workflow = workflow
         self._input = input
+        self._priority = priority
+        self._lazy_output = lazy_output
+        self._eager_outputs = eager_outputs
 
     @classmethod
     def from_dict(cls, dikt) -> 'JobDescription':
@@ -120,3 +136,71 @@ class JobDescription(Model):
 
         self._input = input
 
+    @property
+    def priority(self) -> int:
+        """
+        Gets the priority of this JobDescription.
+        jobs with a higher priority are started first
+
+        :return: The priority of this JobDescription.
+        :rtype: int
+        """
+        return self._priority
+
+    @priority.setter
+    def priority(self, priority: int):
+        """
+        Sets the priority of this JobDescription.
+        jobs with a higher priority are started first
+
+        :param priority: The priority of this JobDescription.
+        :type priority: int
+        """
+
+        self._priority = priority
+
+    @property
+    def lazy_output(self) -> bool:
+        """
+        Gets the lazy_output of this JobDescription.
+        if true, output files are fetched when first requested
+
+        :return: The lazy_output of this JobDescription.
+        :rtype: bool
+        """
+        return self._lazy_output
+
+    @lazy_output.setter
+    def lazy_output(self, lazy_output: bool):
+        """
+        Sets the lazy_output of this JobDescription.
+        if true, output files are fetched when first requested
+
+        :param lazy_output: The lazy_output of this JobDescription.
+        :type lazy_output: bool
+        """
+
+        self._lazy_output = lazy_output
+
+    @property
+    def eager_outputs(self) -> List[str]:
+        """
+        Gets the eager_outputs of this JobDescription.
+        with lazy_output, outputs that are fetched when the job finishes
+
+        :return: The eager_outputs of this JobDescription.
+        :rtype: List[str]
+        """
+        return self._eager_outputs
+
+    @eager_outputs.setter
+    def eager_outputs(self, eager_outputs: List[str]):
+        """
+        Sets the eager_outputs of this JobDescription.
+        with lazy_output, outputs that are fetched when the job finishes
+
+        :param eager_outputs: The eager_outputs of this JobDescription.
+        :type eager_outputs: List[str]
+        """
+
+        self._eager_outputs = eager_outputs
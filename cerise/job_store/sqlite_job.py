@@ -1,10 +1,118 @@
+import hashlib
+import json
 import logging
-from time import asctime, localtime, time
-from typing import Any, List, Optional, Union, cast
+import random
+import zlib
+from contextlib import contextmanager
+from time import asctime, localtime, perf_counter, time
+from typing import (Any, Dict, Generator, List, NamedTuple, Optional,
+                    Union, cast)
 
 from cerise.job_store.job_state import JobState
 
 
+LogEntry = NamedTuple('LogEntry', [('seq', int), ('level', int),
+                                   ('time', float), ('message', str)])
+"""A single entry in a job's log.
+
+The sequence number increases monotonically with every entry added to
+the store, so it can be used to retrieve a log incrementally.
+"""
+
+
+Timing = NamedTuple('Timing', [('phase', str), ('start', float),
+                               ('duration', float), ('count', int),
+                               ('bytes', Optional[int]),
+                               ('detail', Optional[str])])
+"""The wall time a job spent in a phase of processing.
+
+Start is a time stamp as returned by time.time(), duration is in
+seconds. Phases that occur repeatedly, like status polling, may be
+accumulated into a single Timing, in which case start is the first
+occurrence, duration the total, and count the number of occurrences.
+Bytes is the amount of data transferred, if any, and detail describes
+what the phase was working on, e.g. a file name.
+"""
+
+
+StagedFile = NamedTuple('StagedFile', [('path', str), ('size', int),
+                                       ('hash', str), ('time', float),
+                                       ('checksum', Optional[str])])
+"""A file that was staged completely to or from the compute resource.
+
+For an input file, path is relative to the job's remote directory, for
+an output file it is the file's location in the job's output
+directory. Size is in bytes, hash is the SHA-256 hex digest of the
+contents, or empty for a directory or a linked file, time is when it
+was staged, as returned by time.time(), and checksum is the CWL
+checksum (sha1$<hex>), or None if it is not known.
+"""
+
+
+COMPRESSION_THRESHOLD = 4096
+"""Text values of at least this many characters are stored compressed."""
+
+
+def compress_text(value: str) -> Union[str, bytes]:
+    """Prepares a text value for storage.
+
+    Large values are compressed, and stored as BLOBs, small ones are
+    stored as they are. Since SQLite's columns are dynamically typed,
+    decompress_text() can tell them apart.
+
+    Args:
+        value: The text to store.
+
+    Returns:
+        Either the original string, or a zlib-compressed bytes object.
+    """
+    if len(value) < COMPRESSION_THRESHOLD:
+        return value
+    return zlib.compress(value.encode('utf-8'))
+
+
+def decompress_text(value: Union[str, bytes, None]) -> Optional[str]:
+    """Decodes a text value read from the database.
+
+    Args:
+        value: The stored value, as produced by compress_text().
+
+    Returns:
+        The original text.
+    """
+    if isinstance(value, bytes):
+        return zlib.decompress(value).decode('utf-8')
+    return value
+
+
+def format_log_entry(entry: LogEntry) -> str:
+    """Formats a log entry as a line of text.
+
+    Args:
+        entry: The entry to format.
+
+    Returns:
+        A string with time, level and message, terminated by a newline.
+    """
+    level_str = logging.getLevelName(entry.level)
+    time_str = asctime(localtime(entry.time))
+    return '{} {}: {}\n'.format(time_str, level_str, entry.message)
+
+
+def workflow_hash(content: Union[bytes, str]) -> str:
+    """Return the hash by which a workflow is stored.
+
+    Args:
+        content: The content of the workflow.
+
+    Returns:
+        A hex string containing the SHA-256 hash of the content.
+    """
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    return hashlib.sha256(content).hexdigest()
+
+
 class SQLiteJob:
     """This class provides the internal representation of a job. These
     are stored inside the service. Note that there is also a JobDescription,
@@ -46,7 +154,19 @@ class SQLiteJob:
     def local_input(self) -> str:
         """Input JSON string, as specified by the submitter.
         """
-        return cast(str, self._get_var('local_input'))
+        return cast(str, self._get_text_var('local_input'))
+
+    @property
+    def eager_outputs(self) -> Optional[List[str]]:
+        """Names of the outputs to destage when the job finishes.
+
+        The others are destaged when they are first requested. If
+        None, all outputs are destaged when the job finishes.
+        """
+        value = self._get_var('eager_outputs')
+        if value is None:
+            return None
+        return cast(List[str], json.loads(cast(str, value)))
 
     # Current status
     @property
@@ -58,7 +178,92 @@ class SQLiteJob:
 
     @state.setter
     def state(self, value: JobState) -> None:
-        self._set_var('state', value.name)
+        now = time()
+        # The insert starts the transaction, so the state cannot change
+        # in between reading it and updating it.
+        cursor = self._store._thread_local_data.conn.execute(
+            """
+            INSERT INTO job_events (job_id, from_state, to_state, time)
+            SELECT job_id, state, ?, ? FROM jobs
+            WHERE job_id = ? AND state != ?""",
+            (value.name, now, self.id, value.name))
+        cursor.execute(
+            """
+            UPDATE jobs SET state = ?, state_time = ? WHERE job_id = ?""",
+            (value.name, now, self.id))
+        self._store._thread_local_data.conn.commit()
+        cursor.close()
+
+    @property
+    def state_time(self) -> float:
+        """The time at which the job entered its current state.
+        """
+        return cast(float, self._get_var('state_time'))
+
+    # Scheduling
+    @property
+    def priority(self) -> int:
+        """Jobs with a higher priority are started first.
+        """
+        return int(self._get_var('priority'))
+
+    @property
+    def submit_time(self) -> float:
+        """The time at which the job was submitted.
+        """
+        return cast(float, self._get_var('submit_time'))
+
+    @property
+    def share_group(self) -> str:
+        """The group of jobs this job shares the resource with.
+        """
+        return cast(str, self._get_var('share_group'))
+
+    @property
+    def backoff_count(self) -> int:
+        """Number of consecutive connection problems.
+        """
+        return int(self._get_var('backoff_count'))
+
+    @property
+    def next_attempt_at(self) -> float:
+        """Time before which the job should not be processed.
+        """
+        return cast(float, self._get_var('next_attempt_at'))
+
+    def back_off(self, initial: float, maximum: float) -> float:
+        """Postpone processing after a connection problem.
+
+        The delay doubles with each consecutive problem, up to the
+        maximum, and is randomised so that jobs that failed together
+        do not all retry at the same moment.
+
+        Args:
+            initial: The delay after the first problem, in seconds.
+            maximum: The maximum delay, in seconds.
+
+        Returns:
+            The delay chosen, in seconds.
+        """
+        count = self.backoff_count + 1
+        delay = min(initial * 2.0 ** min(count - 1, 32), maximum)
+        delay = delay / 2.0 + random.uniform(0.0, delay / 2.0)
+        cursor = self._store._thread_local_data.conn.execute(
+            """
+            UPDATE jobs SET backoff_count = ?, next_attempt_at = ?
+            WHERE job_id = ?""", (count, time() + delay, self.id))
+        self._store._thread_local_data.conn.commit()
+        cursor.close()
+        return delay
+
+    def reset_backoff(self) -> None:
+        """Allow processing again, after a success."""
+        cursor = self._store._thread_local_data.conn.execute(
+            """
+            UPDATE jobs SET backoff_count = 0, next_attempt_at = 0
+            WHERE job_id = ?""", (self.id, ))
+        self._store._thread_local_data.conn.commit()
+        cursor.close()
 
     @property
     def resolve_retry_count(self) -> int:
@@ -84,40 +289,100 @@ class SQLiteJob:
     def log(self) -> str:
         """Log output as of last update.
         """
-        result = ''
+        return ''.join(map(format_log_entry, self.get_log()))
+
+    def get_log(self, since: int = 0, until: Optional[int] = None,
+                min_level: int = logging.NOTSET
+                ) -> Generator[LogEntry, None, None]:
+        """Retrieves (part of) the job's log.
+
+        Entries are produced in order of their sequence number, and
+        read from the database as they are consumed, so that large
+        logs can be streamed.
+
+        Args:
+            since: Only return entries with a sequence number larger
+                    than this.
+            until: Only return entries with a sequence number smaller
+                    than or equal to this, if given.
+            min_level: Only return entries of at least this level.
+
+        Yields:
+            The matching log entries.
+        """
+        self._store.flush_log()
+        query = """
+            SELECT seq, level, time, message FROM job_log
+            WHERE job_id = ? AND seq > ? AND level >= ?"""
+        params = [self.id, since, min_level]  # type: List[Any]
+        if until is not None:
+            query += ' AND seq <= ?'
+            params.append(until)
+        query += ' ORDER BY seq ASC'
+
+        cursor = self._store._thread_local_data.conn.execute(query, params)
+        try:
+            for row in cursor:
+                yield LogEntry(row[0], row[1], row[2],
+                               cast(str, decompress_text(row[3])))
+        finally:
+            cursor.close()
+
+    def last_log_seq(self, since: int = 0, limit: Optional[int] = None,
+                     min_level: int = logging.NOTSET) -> int:
+        """Returns the sequence number of the last matching log entry.
+
+        This selects up to limit entries with a sequence number larger
+        than since and a level of at least min_level, and returns the
+        sequence number of the last one. If there are no such entries,
+        since is returned. Pass the result as until to get_log() to
+        retrieve a page, and as since on the next call to continue
+        where it left off.
+
+        Args:
+            since: Only consider entries after this sequence number.
+            limit: The maximum number of entries to consider, or None
+                    for no limit.
+            min_level: Only consider entries of at least this level.
+
+        Returns:
+            The sequence number of the last entry in the page.
+        """
+        self._store.flush_log()
+        if limit is None:
+            limit = -1
         cursor = self._store._thread_local_data.conn.execute(
             """
-            SELECT level, time, message FROM job_log
-            WHERE job_id = ? or job_id IS NULL
-            ORDER BY time ASC""", (self.id, ))
-        for row in cursor:
-            level_str = logging.getLevelName(row[0])
-            time_str = asctime(localtime(row[1]))
-            message = row[2]
-            result += '{} {}: {}\n'.format(time_str, level_str, message)
+            SELECT MAX(seq) FROM (
+                SELECT seq FROM job_log
+                WHERE job_id = ? AND seq > ? AND level >= ?
+                ORDER BY seq ASC LIMIT ?)""",
+            (self.id, since, min_level, limit))
+        last_seq = cursor.fetchone()[0]
         cursor.close()
-
-        return result
+        if last_seq is None:
+            return since
+        return last_seq
 
     @property
     def remote_output(self) -> str:
         """cwl-runner output as of last update.
         """
-        return cast(str, self._get_var('remote_output'))
+        return cast(str, self._get_text_var('remote_output'))
 
     @remote_output.setter
     def remote_output(self, value: str) -> None:
-        self._set_var('remote_output', value)
+        self._set_text_var('remote_output', value)
 
     @property
     def remote_error(self) -> str:
         """cwl-runner stderr output as of last update.
         """
-        return cast(str, self._get_var('remote_error'))
+        return cast(str, self._get_text_var('remote_error'))
 
     @remote_error.setter
     def remote_error(self, value: str) -> None:
-        self._set_var('remote_error', value)
+        self._set_text_var('remote_error', value)
 
     # Post-resolving data
     @property
@@ -125,11 +390,42 @@ class SQLiteJob:
         """The content of the workflow description file, or None if it has not
         been resolved yet.
         """
-        return cast(bytes, self._get_var('workflow_content'))
+        cursor = self._store._thread_local_data.conn.execute(
+            """
+            SELECT workflows.content FROM jobs
+            LEFT JOIN workflows ON jobs.workflow_hash = workflows.hash
+            WHERE job_id = ?""", (self.id, ))
+        value = cursor.fetchone()[0]
+        cursor.close()
+        return value
 
     @workflow_content.setter
     def workflow_content(self, value: bytes) -> None:
-        self._set_var('workflow_content', value)
+        content_hash = workflow_hash(value)
+        cursor = self._store._thread_local_data.conn.execute(
+            """
+            INSERT OR IGNORE INTO workflows (hash, content)
+            VALUES (?, ?)""", (content_hash, value))
+        cursor.execute(
+            'UPDATE jobs SET workflow_hash = ? WHERE job_id = ?',
+            (content_hash, self.id))
+        self._store._thread_local_data.conn.commit()
+        cursor.close()
+
+    @property
+    def workflow_hash(self) -> Optional[str]:
+        """The SHA-256 hash of the workflow description, or None if it
+        has not been resolved yet.
+
+        Workflows are stored only once, so setting this to the hash of
+        a workflow that is already in the store is equivalent to
+        setting workflow_content.
+        """
+        return cast(Optional[str], self._get_var('workflow_hash'))
+
+    @workflow_hash.setter
+    def workflow_hash(self, value: str) -> None:
+        self._set_var('workflow_hash', value)
 
     @property
     def required_num_cores(self) -> int:
@@ -228,11 +524,11 @@ class SQLiteJob:
         """The serialised JSON output object describing the
                 destaged outputs.
         """
-        return cast(str, self._get_var('local_output'))
+        return cast(str, self._get_text_var('local_output'))
 
     @local_output.setter
     def local_output(self, value: str) -> None:
-        self._set_var('local_output', value)
+        self._set_text_var('local_output', value)
 
     # Internal data
     @property
@@ -256,34 +552,155 @@ class SQLiteJob:
             from_state: The expected current state
             to_state: The desired next state
 
+        Successful transitions are recorded in the job_events table,
+        as are changes made by setting the state property.
+
         Returns:
             True iff the transition was successful.
         """
+        now = time()
         res = self._store._thread_local_data.conn.execute(
             """
-            UPDATE jobs SET state = ? WHERE job_id = ? AND state = ?;""",
-            (to_state.name, self.id, from_state.name))
-        self._store._thread_local_data.conn.commit()
+            UPDATE jobs SET state = ?, state_time = ?
+            WHERE job_id = ? AND state = ?;""",
+            (to_state.name, now, self.id, from_state.name))
         success = res.rowcount == 1
+        if success:
+            res.execute(
+                """
+                INSERT INTO job_events (job_id, from_state, to_state, time)
+                VALUES (?, ?, ?, ?)""",
+                (self.id, from_state.name, to_state.name, now))
+        self._store._thread_local_data.conn.commit()
         res.close()
         return success
 
     def add_log(self, level: int, message: Union[str, List[str]]) -> None:
         """Add a message to the job's log.
 
+        Messages are buffered by the store, and may not show up in
+        the database until it is released or flushed.
+
         Args:
             level: Level of importance
             message: The log message.
         """
         if not isinstance(message, list):
             message = [message]
-        cursor = self._store._thread_local_data.conn.cursor()
-        for msg in message:
-            cursor.execute(
-                'INSERT INTO job_log (job_id, level, time, message)'
-                'VALUES (?, ?, ?, ?)', (self.id, level, time(), msg))
-        cursor.connection.commit()
-        cursor.close()
+        self._store.add_log(self.id, level, message)
+
+    def add_timing(self, phase: str, start: float, duration: float,
+                   nbytes: Optional[int] = None,
+                   detail: Optional[str] = None,
+                   accumulate: bool = False) -> None:
+        """Record how long the job spent in a phase of processing.
+
+        Args:
+            phase: Name of the phase, e.g. 'stage_job'.
+            start: When the phase started, as returned by time.time().
+            duration: The wall time of the phase in seconds.
+            nbytes: The number of bytes transferred, if applicable.
+            detail: What the phase was working on, if applicable.
+            accumulate: Add to an existing timing for this phase,
+                    rather than recording a separate one.
+        """
+        self._store.add_timing(self.id, phase, start, duration, nbytes,
+                               detail, accumulate)
+
+    @contextmanager
+    def timing(self, phase: str, accumulate: bool = False
+               ) -> Generator[None, None, None]:
+        """Record the wall time of a with statement as a phase.
+
+        The time is recorded even if an exception is raised.
+
+        Args:
+            phase: Name of the phase, e.g. 'stage_job'.
+            accumulate: Add to an existing timing for this phase,
+                    rather than recording a separate one.
+        """
+        start = time()
+        start_counter = perf_counter()
+        try:
+            yield
+        finally:
+            self.add_timing(phase, start, perf_counter() - start_counter,
+                            accumulate=accumulate)
+
+    def get_timings(self) -> List[Timing]:
+        """Return the recorded timings of the job's phases.
+
+        Returns:
+            A list of Timings, in order of their start time.
+        """
+        return self._store.get_timings(self.id)
+
+    def add_staged_file(self, path: str, size: int, digest: str,
+                        checksum: Optional[str] = None) -> None:
+        """Record that an input file was staged completely.
+
+        Args:
+            path: The path of the file, relative to the job's directory.
+            size: The size of the file in bytes.
+            digest: The SHA-256 hash of the file's contents, as hex.
+            checksum: The CWL checksum of the file, if known.
+        """
+        self._store.add_staged_file(self.id, path, size, digest, checksum)
+
+    def get_staged_files(self) -> Dict[str, StagedFile]:
+        """Return the input files that were staged for this job.
+
+        Returns:
+            A dictionary mapping paths to StagedFiles.
+        """
+        return self._store.get_staged_files(self.id)
+
+    def add_published_file(self, location: str, size: int, digest: str,
+                           checksum: Optional[str]) -> None:
+        """Record that an output file was published completely.
+
+        Args:
+            location: The location of the file in the output directory.
+            size: The size of the file in bytes.
+            digest: The SHA-256 hash of the file's contents, as hex.
+            checksum: The CWL checksum of the file, if known.
+        """
+        self._store.add_published_file(
+                self.id, location, size, digest, checksum)
+
+    def get_published_files(self) -> Dict[str, StagedFile]:
+        """Return the output files that were published for this job.
+
+        Returns:
+            A dictionary mapping locations to StagedFiles.
+        """
+        return self._store.get_published_files(self.id)
+
+    def add_lazy_output(self, location: str) -> None:
+        """Record that an output file was left on the compute resource.
+
+        Args:
+            location: The path of the file, relative to the job's
+                    work directory and output directory.
+        """
+        self._store.add_lazy_output(self.id, location)
+
+    def get_lazy_outputs(self) -> Dict[str, bool]:
+        """Return the output files that were not destaged yet.
+
+        Returns:
+            A dictionary mapping locations to whether the file has
+            been requested.
+        """
+        return self._store.get_lazy_outputs(self.id)
+
+    def remove_lazy_output(self, location: str) -> None:
+        """Record that a lazy output file has been destaged.
+
+        Args:
+            location: The location of the file.
+        """
+        self._store.remove_lazy_output(self.id, location)
 
     def debug(self, message: Union[str, List[str]]) -> None:
         """Add a message to the job's log at level DEBUG.
@@ -334,6 +751,14 @@ class SQLiteJob:
         cursor.close()
         return value
 
+    def _get_text_var(self, var: str) -> Optional[str]:
+        """Like _get_var, for text columns that may be compressed."""
+        return decompress_text(cast(Union[str, bytes], self._get_var(var)))
+
+    def _set_text_var(self, var: str, value: str) -> None:
+        """Like _set_var, compressing large values."""
+        self._set_var(var, compress_text(value))
+
     def _set_var(self, var: str, value: Union[str, int, bytes]) -> None:
         """Do NOT feed this user input for var. Static strings only."""
         cursor = self._store._thread_local_data.conn.execute(
@@ -1,20 +1,122 @@
+import heapq
+import json
 import logging
+import re
 import sqlite3
 import threading
-from time import time
+from collections import OrderedDict, deque
+from time import perf_counter, time
 from types import TracebackType
-from typing import Any, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from uuid import uuid4
 
+from cerise import metrics
 from cerise.job_store.job_state import JobState
-from cerise.job_store.sqlite_job import SQLiteJob
+from cerise.job_store.sqlite_job import (SQLiteJob, StagedFile, Timing,
+                                         compress_text, decompress_text,
+                                         workflow_hash)
+from cerise.job_store.trace_file import TraceFile
 from cerise.util import BaseExceptionType
+from cerise.util import percentiles as nearest_rank
+
+
+_SCHEMA_VERSION = 11
+"""The current version of the database schema, see _upgrade_schema()."""
+
+_COMPRESSED_COLUMNS = [
+        'local_input', 'remote_output', 'remote_error', 'local_output']
+"""Text columns that may contain compressed values, see compress_text()."""
+
+
+def _name_prefix(name: str) -> str:
+    """Return a job name without any trailing number.
+
+    This makes jobs named e.g. sweep-001, sweep-002 and so on end up
+    in the same share group.
+
+    Args:
+        name: The name of the job.
+    """
+    return re.sub(r'[\s._-]*\d*$', '', name or '')
+
+
+def _fair_share_order(jobs: List[Tuple[str, int, str]],
+                      load: Dict[str, int]) -> List[str]:
+    """Order jobs of equal priority by fair share.
+
+    Args:
+        jobs: Tuples (job_id, priority, share_group), in order of
+                submission.
+        load: The number of jobs in progress per share group. This
+                is updated with the jobs that are ordered.
+
+    Returns:
+        The job ids, in the order to start them in.
+    """
+    queues = OrderedDict()  # type: Dict[str, deque]
+    for i, (job_id, _, group) in enumerate(jobs):
+        queues.setdefault(group or '', deque()).append((i, job_id))
+
+    heap = [(load.get(group, 0), queue[0][0], group)
+            for group, queue in queues.items()]
+    heapq.heapify(heap)
+
+    ret = []  # type: List[str]
+    while heap:
+        group_load, _, group = heapq.heappop(heap)
+        queue = queues[group]
+        ret.append(queue.popleft()[1])
+        load[group] = group_load + 1
+        if queue:
+            heapq.heappush(heap, (group_load + 1, queue[0][0], group))
+    return ret
 
 
 class JobNotFound(RuntimeError):
     pass
 
 
+class _TimedCursor(sqlite3.Cursor):
+    """A cursor that records statement durations in the metrics."""
+    def execute(self, sql: str, parameters: Any = ()) -> sqlite3.Cursor:
+        start = perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            metrics.SQLITE_QUERY_DURATION.observe(
+                    perf_counter() - start, 'execute')
+
+    def executemany(self, sql: str, seq_of_parameters: Any
+                    ) -> sqlite3.Cursor:
+        start = perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            metrics.SQLITE_QUERY_DURATION.observe(
+                    perf_counter() - start, 'executemany')
+
+
+class _TimedConnection(sqlite3.Connection):
+    """A connection that records statement durations in the metrics."""
+    def cursor(self, factory: Any = _TimedCursor) -> sqlite3.Cursor:
+        return super().cursor(factory)
+
+    def execute(self, sql: str, parameters: Any = ()) -> sqlite3.Cursor:
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters: Any
+                    ) -> sqlite3.Cursor:
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self) -> None:
+        start = perf_counter()
+        try:
+            super().commit()
+        finally:
+            metrics.SQLITE_QUERY_DURATION.observe(
+                    perf_counter() - start, 'commit')
+
+
 class SQLiteJobStore:
     """A JobStore that stores jobs in a SQLite database.
     You must acquire the store to do anything with it or
@@ -30,14 +132,45 @@ class SQLiteJobStore:
     can call other functions that use the store and acquire
     it themselves without incident.
 
+    Log messages added to jobs are buffered in memory, and written to
+    the database in batches, when flush_log() is called, when the
+    outermost with statement exits, and when a message is added
+    more than log_flush_interval seconds after the last flush.
+    There is no timer, so a long-running holder of the store that
+    adds messages only occasionally must call flush_log() regularly;
+    the back end does so on each pass of its main loop.
+
     Args:
         dbfile (str): The path to the file storing the database.
+        log_flush_interval (float): Maximum time in seconds to keep
+                log messages buffered, unless the store is released
+                first.
+        trace_file (str): A file to also write job timings to, in
+                Chrome trace-event format, or None to not write them.
     """
 
-    def __init__(self, dbfile: str) -> None:
+    def __init__(self, dbfile: str, log_flush_interval: float = 1.0,
+                 trace_file: Optional[str] = None) -> None:
         self._db_file = dbfile
         """The location of the database file."""
 
+        self._trace_file = None  # type: Optional[TraceFile]
+        """Trace file to write timings to, if any."""
+        if trace_file is not None:
+            self._trace_file = TraceFile(trace_file)
+
+        self._log_lock = threading.Lock()
+        """A lock protecting the log buffer."""
+
+        self._log_buffer = []  # type: List[Tuple[str, int, float, str]]
+        """Log entries (job_id, level, time, message) not yet written."""
+
+        self._log_flush_interval = log_flush_interval
+        """Maximum time in seconds to buffer log entries."""
+
+        self._last_log_flush = time()
+        """The time the log buffer was last flushed."""
+
         self._pool_lock = threading.RLock()
         """A lock protecting the connection pool."""
 
@@ -50,6 +183,8 @@ class SQLiteJobStore:
         """
 
         conn = sqlite3.connect(self._db_file)
+        # Only has an effect on a new database, see _upgrade_schema()
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
         conn.execute("""CREATE TABLE IF NOT EXISTS jobs(
                 job_id CHARACTER(32),
                 name VARCHAR(255),
@@ -60,7 +195,7 @@ class SQLiteJobStore:
                 resolve_retry_count INTEGER DEFAULT 0,
                 remote_output TEXT DEFAULT '',
                 remote_error TEXT DEFAULT '',
-                workflow_content BLOB,
+                workflow_hash CHARACTER(64),
                 required_num_cores INTEGER DEFAULT 0,
                 time_limit INTEGER DEFAULT 0,
                 remote_workdir_path VARCHAR(255) DEFAULT '',
@@ -71,19 +206,271 @@ class SQLiteJobStore:
                 remote_system_out_path VARCHAR(255) DEFAULT '',
                 remote_system_err_path VARCHAR(255) DEFAULT '',
                 remote_job_id VARCHAR(255),
-                local_output TEXT DEFAULT ''
+                local_output TEXT DEFAULT '',
+                state_time DOUBLE PRECISION,
+                priority INTEGER DEFAULT 0,
+                submit_time DOUBLE PRECISION,
+                share_group VARCHAR(255) DEFAULT '',
+                backoff_count INTEGER DEFAULT 0,
+                next_attempt_at DOUBLE PRECISION DEFAULT 0,
+                eager_outputs TEXT
                 )
                 """)
         conn.execute("""CREATE TABLE IF NOT EXISTS job_log(
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
                 job_id CHARACTER(32),
                 level INTEGER,
                 time DOUBLE PRECISION,
                 message TEXT
                 )
                 """)
+        conn.execute("""CREATE TABLE IF NOT EXISTS workflows(
+                hash CHARACTER(64) PRIMARY KEY,
+                content BLOB
+                )
+                """)
+        conn.execute("""CREATE TABLE IF NOT EXISTS workflow_sources(
+                url TEXT PRIMARY KEY,
+                validator TEXT,
+                hash CHARACTER(64)
+                )
+                """)
+        conn.execute("""CREATE TABLE IF NOT EXISTS job_events(
+                job_id CHARACTER(32),
+                from_state VARCHAR(17),
+                to_state VARCHAR(17),
+                time DOUBLE PRECISION
+                )
+                """)
+        conn.execute("""CREATE TABLE IF NOT EXISTS job_timings(
+                job_id CHARACTER(32),
+                phase VARCHAR(32),
+                start DOUBLE PRECISION,
+                duration DOUBLE PRECISION,
+                count INTEGER DEFAULT 1,
+                bytes INTEGER,
+                detail TEXT
+                )
+                """)
+        conn.execute("""CREATE TABLE IF NOT EXISTS staged_files(
+                job_id CHARACTER(32),
+                path VARCHAR(255),
+                size INTEGER,
+                hash CHARACTER(64),
+                time DOUBLE PRECISION,
+                checksum VARCHAR(45),
+                PRIMARY KEY (job_id, path)
+                )
+                """)
+        conn.execute("""CREATE TABLE IF NOT EXISTS published_files(
+                job_id CHARACTER(32),
+                location VARCHAR(255),
+                size INTEGER,
+                hash CHARACTER(64),
+                time DOUBLE PRECISION,
+                checksum VARCHAR(45),
+                PRIMARY KEY (job_id, location)
+                )
+                """)
+        conn.execute("""CREATE TABLE IF NOT EXISTS lazy_outputs(
+                job_id CHARACTER(32),
+                location VARCHAR(255),
+                requested INTEGER DEFAULT 0,
+                PRIMARY KEY (job_id, location)
+                )
+                """)
+        self._upgrade_schema(conn)
+        conn.execute("""CREATE INDEX IF NOT EXISTS job_log_job_id_seq
+                ON job_log(job_id, seq)""")
+        conn.execute("""CREATE INDEX IF NOT EXISTS jobs_state_time
+                ON jobs(state, state_time)""")
+        conn.execute("""CREATE INDEX IF NOT EXISTS jobs_state_priority
+                ON jobs(state, priority DESC, submit_time)""")
+        conn.execute("""CREATE INDEX IF NOT EXISTS jobs_workflow_hash
+                ON jobs(workflow_hash)""")
+        conn.execute("""CREATE INDEX IF NOT EXISTS job_events_job_id_time
+                ON job_events(job_id, time)""")
+        conn.execute("""CREATE INDEX IF NOT EXISTS job_events_time
+                ON job_events(time)""")
+        conn.execute("""CREATE INDEX IF NOT EXISTS job_timings_job_id
+                ON job_timings(job_id, phase)""")
         conn.commit()
         conn.close()
 
+    def _upgrade_schema(self, conn: sqlite3.Connection) -> None:
+        """Upgrades a database created by an older version of Cerise.
+
+        The schema version is stored in the database's user_version
+        pragma. Each upgrade step checks the actual table layout, so
+        that it is safe to run on a database that was created with the
+        current schema.
+
+        Args:
+            conn: A connection to the database to upgrade.
+        """
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+
+        if version < 1:
+            # Add sequence numbers to the log, so that clients can
+            # retrieve it incrementally.
+            columns = [row[1] for row in conn.execute(
+                'PRAGMA table_info(job_log)')]
+            if 'seq' not in columns:
+                conn.execute('ALTER TABLE job_log RENAME TO job_log_old')
+                conn.execute("""CREATE TABLE job_log(
+                        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                        job_id CHARACTER(32),
+                        level INTEGER,
+                        time DOUBLE PRECISION,
+                        message TEXT
+                        )
+                        """)
+                conn.execute("""
+                        INSERT INTO job_log (job_id, level, time, message)
+                        SELECT job_id, level, time, message FROM job_log_old
+                        ORDER BY time ASC, rowid ASC""")
+                conn.execute('DROP TABLE job_log_old')
+
+        if version < 2:
+            # Record when jobs last changed state, for the retention
+            # policy. For existing jobs, we start counting now.
+            columns = [row[1] for row in conn.execute(
+                'PRAGMA table_info(jobs)')]
+            if 'state_time' not in columns:
+                conn.execute(
+                    'ALTER TABLE jobs ADD COLUMN state_time DOUBLE PRECISION')
+                conn.execute('UPDATE jobs SET state_time = ?', (time(), ))
+
+            # Switching an existing database to incremental vacuuming
+            # requires a full vacuum, once.
+            auto_vacuum = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+            if auto_vacuum != 2:
+                conn.commit()
+                conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                conn.execute('VACUUM')
+
+        if version < 3:
+            # Store workflows once, by content hash, rather than per job.
+            # The old column is left in place, but emptied.
+            columns = [row[1] for row in conn.execute(
+                'PRAGMA table_info(jobs)')]
+            if 'workflow_hash' not in columns:
+                conn.execute(
+                    'ALTER TABLE jobs ADD COLUMN workflow_hash CHARACTER(64)')
+            if 'workflow_content' in columns:
+                rows = conn.execute("""
+                        SELECT job_id, workflow_content FROM jobs
+                        WHERE workflow_content IS NOT NULL""").fetchall()
+                for job_id, content in rows:
+                    content_hash = workflow_hash(content)
+                    conn.execute("""
+                            INSERT OR IGNORE INTO workflows (hash, content)
+                            VALUES (?, ?)""", (content_hash, content))
+                    conn.execute("""
+                            UPDATE jobs SET workflow_hash = ?,
+                                workflow_content = NULL
+                            WHERE job_id = ?""", (content_hash, job_id))
+
+        # Version 4 stores large values in _COMPRESSED_COLUMNS and in
+        # job_log.message compressed. Existing values are left as they
+        # are, and compressed when they are next written.
+
+        # Version 5 adds the job_events table, and version 6 the
+        # job_timings table, which are created above.
+
+        if version < 7:
+            # Add priorities and fair-share groups. Existing jobs get
+            # the default priority, and are ordered by their last
+            # state change, which is all we have.
+            columns = [row[1] for row in conn.execute(
+                'PRAGMA table_info(jobs)')]
+            if 'priority' not in columns:
+                conn.execute(
+                    'ALTER TABLE jobs ADD COLUMN priority INTEGER DEFAULT 0')
+            if 'submit_time' not in columns:
+                conn.execute('ALTER TABLE jobs ADD COLUMN'
+                             ' submit_time DOUBLE PRECISION')
+                conn.execute('UPDATE jobs SET submit_time = state_time')
+            if 'share_group' not in columns:
+                conn.execute('ALTER TABLE jobs ADD COLUMN'
+                             " share_group VARCHAR(255) DEFAULT ''")
+
+        if version < 8:
+            # Add per-job backoff after connection problems.
+            columns = [row[1] for row in conn.execute(
+                'PRAGMA table_info(jobs)')]
+            if 'backoff_count' not in columns:
+                conn.execute('ALTER TABLE jobs ADD COLUMN'
+                             ' backoff_count INTEGER DEFAULT 0')
+            if 'next_attempt_at' not in columns:
+                conn.execute('ALTER TABLE jobs ADD COLUMN'
+                             ' next_attempt_at DOUBLE PRECISION DEFAULT 0')
+
+        # Version 9 adds the staged_files table, which is created above.
+
+        if version < 10:
+            # Add lazy destaging. Existing jobs have all their outputs
+            # destaged when they finish, as before. The lazy_outputs
+            # table is created above.
+            columns = [row[1] for row in conn.execute(
+                'PRAGMA table_info(jobs)')]
+            if 'eager_outputs' not in columns:
+                conn.execute('ALTER TABLE jobs ADD COLUMN eager_outputs TEXT')
+
+        if version < 11:
+            # Add CWL checksums of staged files. Files staged before
+            # have none. The published_files table is created above.
+            columns = [row[1] for row in conn.execute(
+                'PRAGMA table_info(staged_files)')]
+            if 'checksum' not in columns:
+                conn.execute('ALTER TABLE staged_files ADD COLUMN'
+                             ' checksum VARCHAR(45)')
+
+        conn.execute('PRAGMA user_version = {}'.format(_SCHEMA_VERSION))
+        conn.commit()
+
+    def get_workflow_source(self, url: str, validator: str) -> Optional[str]:
+        """Look up a previously resolved workflow.
+
+        Args:
+            url: The URL the workflow was resolved from.
+            validator: A string that changes whenever the content at
+                    the URL changes, e.g. an ETag or a modification
+                    time.
+
+        Returns:
+            The hash of the workflow, if it was resolved from this URL
+            before with the same validator and is still stored, or
+            None otherwise.
+        """
+        cursor = self._thread_local_data.conn.execute(
+            """
+                SELECT workflow_sources.hash FROM workflow_sources
+                JOIN workflows ON workflow_sources.hash = workflows.hash
+                WHERE url = ? AND validator = ?""", (url, validator))
+        row = cursor.fetchone()
+        cursor.close()
+        if row is None:
+            return None
+        return row[0]
+
+    def set_workflow_source(self, url: str, validator: str,
+                            content_hash: str) -> None:
+        """Remember that a workflow was resolved from a URL.
+
+        Args:
+            url: The URL the workflow was resolved from.
+            validator: A string that changes whenever the content at
+                    the URL changes.
+            content_hash: The hash of the workflow that was found.
+        """
+        cursor = self._thread_local_data.conn.execute(
+            """
+                INSERT OR REPLACE INTO workflow_sources (url, validator, hash)
+                VALUES (?, ?, ?)""", (url, validator, content_hash))
+        self._thread_local_data.conn.commit()
+        cursor.close()
+
     def __enter__(self) -> 'SQLiteJobStore':
         """Grabs a connection from the shared connection pool, and
         puts it in thread-local storage, thus reserving it for the
@@ -102,8 +489,11 @@ class SQLiteJobStore:
             if self._connection_pool != []:
                 self._thread_local_data.conn = self._connection_pool.pop()
             else:
+                # Connections move between threads via the pool, but
+                # are only ever used by one thread at a time.
                 self._thread_local_data.conn = sqlite3.connect(
-                    self._db_file, isolation_level="IMMEDIATE")
+                    self._db_file, isolation_level="IMMEDIATE",
+                    check_same_thread=False, factory=_TimedConnection)
 
             self._thread_local_data.recursion_depth = 1
 
@@ -116,24 +506,95 @@ class SQLiteJobStore:
     def __exit__(self, exc_type: Optional[BaseExceptionType],
                  exc_value: Optional[BaseException],
                  traceback: Optional[TracebackType]) -> None:
-        """Returns the connection back to the pool.
+        """Writes any buffered log messages, then returns the
+        connection back to the pool.
+
+        If an exception is propagating, a failure to write the log
+        is ignored so as not to mask it, and the messages stay in the
+        buffer for the next flush.
         """
         if self._thread_local_data.recursion_depth == 1:
-            self._pool_lock.acquire()
+            try:
+                self.flush_log()
+            except sqlite3.Error:
+                if exc_type is None:
+                    raise
+            finally:
+                self._release_connection()
 
-            connection = self._thread_local_data.__dict__.pop('conn')
+        self._thread_local_data.recursion_depth -= 1
 
-            # Roll back any open transaction so we don't keep the DB
-            # locked forever if an error occurs.
-            connection.rollback()
+    def _release_connection(self) -> None:
+        """Returns this thread's connection to the pool.
+        """
+        self._pool_lock.acquire()
 
-            self._connection_pool.append(connection)
+        connection = self._thread_local_data.__dict__.pop('conn')
 
-            self._pool_lock.release()
+        # Roll back any open transaction so we don't keep the DB
+        # locked forever if an error occurs.
+        connection.rollback()
 
-        self._thread_local_data.recursion_depth -= 1
+        self._connection_pool.append(connection)
+
+        self._pool_lock.release()
+
+    def close(self) -> None:
+        """Closes the trace file, if any.
+
+        Call this when shutting down. Timings added afterwards are
+        still stored in the database, but not traced.
+        """
+        if self._trace_file is not None:
+            self._trace_file.close()
+            self._trace_file = None
+
+    def add_log(self, job_id: str, level: int, messages: List[str]) -> None:
+        """Add messages to a job's log.
 
-    def create_job(self, name: str, workflow: str, job_input: str) -> str:
+        The messages are buffered, and written to the database later.
+        If the last flush was more than log_flush_interval seconds
+        ago, the buffer is written out immediately; otherwise it waits
+        for a call to flush_log() or the release of the store.
+        Use SQLiteJob.add_log() rather than calling this directly.
+
+        Args:
+            job_id: The id of the job to add the messages to.
+            level: Level of importance.
+            messages: The log messages.
+        """
+        now = time()
+        with self._log_lock:
+            self._log_buffer.extend(
+                [(job_id, level, now, message) for message in messages])
+            flush_due = (now - self._last_log_flush >=
+                         self._log_flush_interval)
+        if flush_due:
+            self.flush_log()
+
+    def flush_log(self) -> None:
+        """Write any buffered log messages to the database.
+
+        This uses a single transaction for all of them. The lock is
+        held while writing, so that entries get sequence numbers in
+        the order in which they were added.
+        """
+        with self._log_lock:
+            self._last_log_flush = time()
+            if self._log_buffer == []:
+                return
+            conn = self._thread_local_data.conn
+            conn.executemany(
+                'INSERT INTO job_log (job_id, level, time, message)'
+                ' VALUES (?, ?, ?, ?)',
+                [(job_id, level, log_time, compress_text(message))
+                 for job_id, level, log_time, message in self._log_buffer])
+            conn.commit()
+            self._log_buffer = []
+
+    def create_job(self, name: str, workflow: str, job_input: str,
+                   priority: int = 0, share_group: Optional[str] = None,
+                   eager_outputs: Optional[List[str]] = None) -> str:
         """Create a job.
 
         Args:
@@ -142,38 +603,505 @@ class SQLiteJobStore:
                 workflow
             job_input: A string containing a json description of
                 a json string.
+            priority: Jobs with a higher priority are started first.
+            share_group: The group of jobs this job shares the
+                compute resource with, e.g. a client identifier. By
+                default, the job's name without any trailing number.
+            eager_outputs: If given, only these outputs are copied to
+                the file exchange store when the job finishes, the
+                others when they are first requested. By default, all
+                outputs are copied when the job finishes.
 
         Returns:
             A string containing the job id.
         """
         job_id = uuid4().hex
+        now = time()
+        if share_group is None:
+            share_group = _name_prefix(name)
 
         cursor = self._thread_local_data.conn.execute(
             """
-                INSERT INTO jobs (job_id, name, workflow, local_input, state)
-                VALUES (?, ?, ?, ?, ?)""",
-            (job_id, name, workflow, job_input, JobState.SUBMITTED.name))
+                INSERT INTO jobs (
+                    job_id, name, workflow, local_input, state, state_time,
+                    priority, submit_time, share_group, eager_outputs)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (job_id, name, workflow, compress_text(job_input),
+             JobState.SUBMITTED.name, now, priority, now, share_group,
+             None if eager_outputs is None else json.dumps(eager_outputs)))
+        cursor.execute(
+            """
+                INSERT INTO job_events (job_id, from_state, to_state, time)
+                VALUES (?, NULL, ?, ?)""",
+            (job_id, JobState.SUBMITTED.name, now))
         cursor.execute(
             'INSERT INTO job_log (job_id, level, time, message)'
-            'VALUES (?, ?, ?, ?)', (job_id, logging.INFO, time(),
+            'VALUES (?, ?, ?, ?)', (job_id, logging.INFO, now,
                                     'Submitted job'))
         self._thread_local_data.conn.commit()
         cursor.close()
 
         return job_id
 
-    def list_jobs(self) -> List[SQLiteJob]:
+    def list_jobs(self, ready_at: Optional[float] = None
+                  ) -> List[SQLiteJob]:
         """Return a list of all currently known jobs.
 
+        Args:
+            ready_at: If given, leave out jobs that are backing off
+                    until after this time, see SQLiteJob.back_off().
+
+        Returns:
+            A list of SQLiteJob objects.
+        """
+        if ready_at is None:
+            cursor = self._thread_local_data.conn.execute("""
+                    SELECT job_id FROM jobs;""")
+        else:
+            cursor = self._thread_local_data.conn.execute("""
+                    SELECT job_id FROM jobs WHERE next_attempt_at <= ?""",
+                    (ready_at, ))
+        ret = [SQLiteJob(self, row[0]) for row in cursor.fetchall()]
+        cursor.close()
+        return ret
+
+    def list_pending_jobs(self, ready_at: Optional[float] = None
+                          ) -> List[SQLiteJob]:
+        """Return the submitted jobs, in the order to start them in.
+
+        Jobs with a higher priority come first. Jobs of the same
+        priority are ordered by fair share: the next job is taken
+        from the share group with the fewest jobs in progress,
+        counting those already ahead of it in the list, and within a
+        group, jobs are taken in order of submission.
+
+        Args:
+            ready_at: If given, leave out jobs that are backing off
+                    until after this time, see SQLiteJob.back_off().
+
         Returns:
             A list of SQLiteJob objects.
         """
-        cursor = self._thread_local_data.conn.execute("""
-                SELECT job_id FROM jobs;""")
+        conn = self._thread_local_data.conn
+        cursor = conn.execute("""
+                SELECT job_id, priority, share_group, next_attempt_at
+                FROM jobs WHERE state = ?
+                ORDER BY priority DESC, submit_time ASC""",
+                              (JobState.SUBMITTED.name, ))
+        pending = [row[:3] for row in cursor
+                   if ready_at is None or row[3] <= ready_at]
+        cursor.close()
+
+        in_progress = [state.name for state in JobState
+                       if state != JobState.SUBMITTED
+                       and not JobState.is_final(state)]
+        cursor = conn.execute("""
+                SELECT share_group, COUNT(*) FROM jobs
+                WHERE state IN ({}) GROUP BY share_group""".format(
+                    ', '.join('?' * len(in_progress))), in_progress)
+        load = dict(cursor.fetchall())  # type: Dict[str, int]
+        cursor.close()
+
+        ret = []  # type: List[SQLiteJob]
+        begin = 0
+        while begin < len(pending):
+            end = begin
+            while end < len(pending) and pending[end][1] == pending[begin][1]:
+                end += 1
+            ret.extend(SQLiteJob(self, job_id) for job_id in
+                       _fair_share_order(pending[begin:end], load))
+            begin = end
+        return ret
+
+    def list_backed_off_jobs(self) -> List[SQLiteJob]:
+        """Return the jobs that have had connection problems.
+
+        Returns:
+            The jobs for which SQLiteJob.back_off() was called since
+            they were last processed successfully.
+        """
+        cursor = self._thread_local_data.conn.execute(
+            'SELECT job_id FROM jobs WHERE backoff_count > 0')
+        ret = [SQLiteJob(self, row[0]) for row in cursor.fetchall()]
+        cursor.close()
+        return ret
+
+    def count_jobs_by_state(self) -> Dict[JobState, int]:
+        """Return the number of jobs in each state.
+
+        Returns:
+            A dictionary with a count for every state that has jobs.
+        """
+        cursor = self._thread_local_data.conn.execute(
+            'SELECT state, COUNT(*) FROM jobs GROUP BY state')
+        ret = {JobState[state]: count for state, count in cursor}
+        cursor.close()
+        return ret
+
+    def get_staged_bytes(self, states: List[JobState]) -> int:
+        """Return the amount of input data staged for jobs.
+
+        This is the total size of the input files recorded as staged
+        in the staged_files table, for all jobs in the given states.
+        Each file is counted once, however often it was staged.
+
+        Args:
+            states: The states of the jobs to count.
+
+        Returns:
+            The number of bytes staged.
+        """
+        cursor = self._thread_local_data.conn.execute(
+            """
+                SELECT SUM(s.size) FROM staged_files AS s
+                JOIN jobs AS j ON s.job_id = j.job_id
+                WHERE j.state IN ({})""".format(
+                ', '.join('?' * len(states))),
+            [state.name for state in states])
+        ret = cursor.fetchone()[0]
+        cursor.close()
+        return ret or 0
+
+    def list_expired_jobs(self, before: float) -> List[SQLiteJob]:
+        """Return a list of jobs that have been finished for a while.
+
+        Args:
+            before: A time stamp, as returned by time.time().
+
+        Returns:
+            The jobs that have been in a final state since before the
+            given time.
+        """
+        final_states = [state.name for state in JobState
+                        if JobState.is_final(state)]
+        cursor = self._thread_local_data.conn.execute(
+            """
+                SELECT job_id FROM jobs
+                WHERE state IN ({}) AND state_time < ?""".format(
+                ', '.join('?' * len(final_states))),
+            final_states + [before])
         ret = [SQLiteJob(self, row[0]) for row in cursor.fetchall()]
         cursor.close()
         return ret
 
+    def get_events(self, job_id: str) -> List[Tuple[Optional[str], str,
+                                                    float]]:
+        """Return the state transitions a job went through.
+
+        Args:
+            job_id: The id of the job.
+
+        Returns:
+            A list of (from_state, to_state, time) tuples in
+            chronological order, with state names as strings. The
+            first from_state is None.
+        """
+        cursor = self._thread_local_data.conn.execute(
+            """
+                SELECT from_state, to_state, time FROM job_events
+                WHERE job_id = ? ORDER BY time ASC, rowid ASC""",
+            (job_id, ))
+        ret = cursor.fetchall()
+        cursor.close()
+        return ret
+
+    def get_phase_durations(self, since: float, until: float
+                            ) -> Dict[JobState, List[float]]:
+        """Return how long jobs spent in each state.
+
+        Only phases that both started and ended within the given time
+        window are included. Jobs that have since been deleted are
+        included too, as their events are kept until
+        delete_events() is called.
+
+        Args:
+            since: Start of the window, as returned by time.time().
+            until: End of the window, as returned by time.time().
+
+        Returns:
+            For each state, a list of the durations in seconds of the
+            phases in which a job was in that state.
+        """
+        cursor = self._thread_local_data.conn.execute(
+            """
+                SELECT job_id, to_state, time FROM job_events
+                WHERE time >= ? AND time <= ?
+                ORDER BY job_id ASC, time ASC, rowid ASC""",
+            (since, until))
+
+        durations = dict()  # type: Dict[JobState, List[float]]
+        prev_job_id, prev_state, prev_time = None, None, 0.0
+        for job_id, state, event_time in cursor:
+            if job_id == prev_job_id:
+                durations.setdefault(JobState[prev_state], []).append(
+                    event_time - prev_time)
+            prev_job_id, prev_state, prev_time = job_id, state, event_time
+        cursor.close()
+        return durations
+
+    def get_phase_latency_percentiles(
+            self, since: float, until: float,
+            percentiles: Tuple[int, ...] = (50, 90, 99)
+            ) -> Dict[JobState, Dict[str, float]]:
+        """Return statistics on how long jobs spent in each state.
+
+        This gives, for example, the time jobs wait in the queue
+        (SUBMITTED), how long staging takes (STAGING_IN) or how long
+        it takes for a finished job to be destaged (FINISHED and
+        STAGING_OUT). See get_phase_durations() for which phases are
+        included.
+
+        Args:
+            since: Start of the window, as returned by time.time().
+            until: End of the window, as returned by time.time().
+            percentiles: Which percentiles to calculate.
+
+        Returns:
+            For each state that occurred, a dictionary with the number
+            of phases under 'count', and a key 'p<n>' for each
+            percentile n, e.g. 'p50' for the median, containing the
+            duration in seconds.
+        """
+        result = dict()  # type: Dict[JobState, Dict[str, float]]
+        durations = self.get_phase_durations(since, until)
+        for state, state_durations in durations.items():
+            result[state] = nearest_rank(state_durations, percentiles)
+        return result
+
+    def delete_events(self, before: float) -> None:
+        """Delete state transition events that happened before the
+        given time.
+
+        Args:
+            before: A time stamp, as returned by time.time().
+        """
+        cursor = self._thread_local_data.conn.execute(
+            'DELETE FROM job_events WHERE time < ?', (before, ))
+        self._thread_local_data.conn.commit()
+        cursor.close()
+
+    def add_timing(self, job_id: str, phase: str, start: float,
+                   duration: float, nbytes: Optional[int] = None,
+                   detail: Optional[str] = None,
+                   accumulate: bool = False) -> None:
+        """Record how long a job spent in a phase of processing.
+
+        See SQLiteJob.add_timing(), which is the usual way to call this.
+
+        Args:
+            job_id: The id of the job.
+            phase: Name of the phase, e.g. 'stage_job'.
+            start: When the phase started, as returned by time.time().
+            duration: The wall time of the phase in seconds.
+            nbytes: The number of bytes transferred, if applicable.
+            detail: What the phase was working on, if applicable.
+            accumulate: Add to an existing timing for this phase,
+                    rather than recording a separate one.
+        """
+        cursor = self._thread_local_data.conn.cursor()
+        if accumulate:
+            cursor.execute(
+                """
+                    UPDATE job_timings
+                    SET duration = duration + ?, count = count + 1,
+                        bytes = bytes + ?
+                    WHERE job_id = ? AND phase = ?""",
+                (duration, nbytes, job_id, phase))
+        if not accumulate or cursor.rowcount == 0:
+            cursor.execute(
+                """
+                    INSERT INTO job_timings (
+                        job_id, phase, start, duration, bytes, detail)
+                    VALUES (?, ?, ?, ?, ?, ?)""",
+                (job_id, phase, start, duration, nbytes, detail))
+        self._thread_local_data.conn.commit()
+        cursor.close()
+
+        if self._trace_file is not None:
+            self._trace_file.write(job_id, phase, start, duration, nbytes,
+                                   detail)
+
+    def get_timings(self, job_id: str) -> List[Timing]:
+        """Return the recorded timings of a job's phases.
+
+        Args:
+            job_id: The id of the job.
+
+        Returns:
+            A list of Timings, in order of their start time.
+        """
+        cursor = self._thread_local_data.conn.execute(
+            """
+                SELECT phase, start, duration, count, bytes, detail
+                FROM job_timings WHERE job_id = ?
+                ORDER BY start ASC, rowid ASC""", (job_id, ))
+        ret = [Timing(*row) for row in cursor]
+        cursor.close()
+        return ret
+
+    def add_staged_file(self, job_id: str, path: str, size: int,
+                        digest: str, checksum: Optional[str] = None
+                        ) -> None:
+        """Record that an input file was staged completely.
+
+        See SQLiteJob.add_staged_file(), which is the usual way to call
+        this.
+
+        Args:
+            job_id: The id of the job.
+            path: The path of the file, relative to the job's directory.
+            size: The size of the file in bytes.
+            digest: The SHA-256 hash of the file's contents, as hex.
+            checksum: The CWL checksum of the file, if known.
+        """
+        self._thread_local_data.conn.execute(
+            """
+                INSERT OR REPLACE INTO staged_files (
+                    job_id, path, size, hash, time, checksum)
+                VALUES (?, ?, ?, ?, ?, ?)""",
+            (job_id, path, size, digest, time(), checksum))
+        self._thread_local_data.conn.commit()
+
+    def get_staged_files(self, job_id: str) -> Dict[str, StagedFile]:
+        """Return the input files that were staged for a job.
+
+        Args:
+            job_id: The id of the job.
+
+        Returns:
+            A dictionary mapping paths to StagedFiles.
+        """
+        cursor = self._thread_local_data.conn.execute(
+            """
+                SELECT path, size, hash, time, checksum
+                FROM staged_files WHERE job_id = ?""", (job_id, ))
+        ret = {row[0]: StagedFile(*row) for row in cursor}
+        cursor.close()
+        return ret
+
+    def add_published_file(self, job_id: str, location: str, size: int,
+                           digest: str, checksum: Optional[str]) -> None:
+        """Record that an output file was published completely.
+
+        See SQLiteJob.add_published_file(), which is the usual way to
+        call this.
+
+        Args:
+            job_id: The id of the job.
+            location: The location of the file in the output directory.
+            size: The size of the file in bytes.
+            digest: The SHA-256 hash of the file's contents, as hex.
+            checksum: The CWL checksum of the file, if known.
+        """
+        self._thread_local_data.conn.execute(
+            """
+                INSERT OR REPLACE INTO published_files (
+                    job_id, location, size, hash, time, checksum)
+                VALUES (?, ?, ?, ?, ?, ?)""",
+            (job_id, location, size, digest, time(), checksum))
+        self._thread_local_data.conn.commit()
+
+    def get_published_files(self, job_id: str) -> Dict[str, StagedFile]:
+        """Return the output files that were published for a job.
+
+        Args:
+            job_id: The id of the job.
+
+        Returns:
+            A dictionary mapping locations to StagedFiles.
+        """
+        cursor = self._thread_local_data.conn.execute(
+            """
+                SELECT location, size, hash, time, checksum
+                FROM published_files WHERE job_id = ?""", (job_id, ))
+        ret = {row[0]: StagedFile(*row) for row in cursor}
+        cursor.close()
+        return ret
+
+    def add_lazy_output(self, job_id: str, location: str) -> None:
+        """Record that an output file was left on the compute resource.
+
+        See SQLiteJob.add_lazy_output(), which is the usual way to call
+        this.
+
+        Args:
+            job_id: The id of the job.
+            location: The path of the file, relative to the job's
+                    work directory and output directory.
+        """
+        self._thread_local_data.conn.execute(
+            """
+                INSERT OR REPLACE INTO lazy_outputs (job_id, location)
+                VALUES (?, ?)""", (job_id, location))
+        self._thread_local_data.conn.commit()
+
+    def get_lazy_outputs(self, job_id: str) -> Dict[str, bool]:
+        """Return the output files of a job that were not destaged.
+
+        Args:
+            job_id: The id of the job.
+
+        Returns:
+            A dictionary mapping locations to whether the file has
+            been requested.
+        """
+        cursor = self._thread_local_data.conn.execute(
+            """
+                SELECT location, requested
+                FROM lazy_outputs WHERE job_id = ?""", (job_id, ))
+        ret = {row[0]: bool(row[1]) for row in cursor}
+        cursor.close()
+        return ret
+
+    def request_lazy_output(self, job_id: str, location: str) -> bool:
+        """Ask for an output file that was not destaged to be fetched.
+
+        Args:
+            job_id: The id of the job.
+            location: The location of the file, as given to
+                    add_lazy_output().
+
+        Returns:
+            True iff the file is still to be fetched.
+        """
+        cursor = self._thread_local_data.conn.execute(
+            """
+                UPDATE lazy_outputs SET requested = 1
+                WHERE job_id = ? AND location = ?""", (job_id, location))
+        pending = cursor.rowcount == 1
+        self._thread_local_data.conn.commit()
+        cursor.close()
+        return pending
+
+    def list_requested_outputs(self) -> Dict[str, List[str]]:
+        """Return the output files that have been requested.
+
+        Returns:
+            A dictionary mapping job ids to lists of locations.
+        """
+        cursor = self._thread_local_data.conn.execute(
+            """
+                SELECT job_id, location FROM lazy_outputs
+                WHERE requested = 1 ORDER BY job_id, location""")
+        ret = dict()  # type: Dict[str, List[str]]
+        for job_id, location in cursor:
+            ret.setdefault(job_id, []).append(location)
+        cursor.close()
+        return ret
+
+    def remove_lazy_output(self, job_id: str, location: str) -> None:
+        """Record that a lazy output file has been fetched.
+
+        Args:
+            job_id: The id of the job.
+            location: The location of the file.
+        """
+        self._thread_local_data.conn.execute(
+            """
+                DELETE FROM lazy_outputs
+                WHERE job_id = ? AND location = ?""", (job_id, location))
+        self._thread_local_data.conn.commit()
+
     def get_job(self, job_id: str) -> SQLiteJob:
         """Return the job with the given id.
 
@@ -195,16 +1123,113 @@ class SQLiteJobStore:
                 'Job with id {} not found in store'.format(job_id))
         return SQLiteJob(self, job_id)
 
+    def export_job(self, job_id: str) -> Dict[str, Any]:
+        """Return all stored data on the job with the given id.
+
+        This is used to archive jobs before deleting them. Binary
+        data is decoded as UTF-8.
+
+        Args:
+            job_id: A string containing the id of the job to export.
+
+        Returns:
+            A dictionary with the job's columns, plus a 'log' key
+            containing a list of log entries as dictionaries.
+        """
+        cursor = self._thread_local_data.conn.execute(
+            'SELECT * FROM jobs WHERE job_id = ?', (job_id, ))
+        row = cursor.fetchone()
+        if row is None:
+            cursor.close()
+            raise JobNotFound(
+                'Job with id {} not found in store'.format(job_id))
+        columns = [desc[0] for desc in cursor.description]
+        cursor.close()
+
+        result = dict()  # type: Dict[str, Any]
+        for column, value in zip(columns, row):
+            if column in _COMPRESSED_COLUMNS:
+                value = decompress_text(value)
+            if isinstance(value, bytes):
+                value = value.decode('utf-8', 'replace')
+            result[column] = value
+
+        job = self.get_job(job_id)
+        workflow_content = job.workflow_content
+        if workflow_content is not None:
+            workflow_content = workflow_content.decode('utf-8', 'replace')
+        result['workflow_content'] = workflow_content
+        result['log'] = [entry._asdict() for entry in job.get_log()]
+        result['events'] = [
+                {'from_state': from_state, 'to_state': to_state, 'time': t}
+                for from_state, to_state, t in self.get_events(job_id)]
+        result['timings'] = [
+                timing._asdict() for timing in self.get_timings(job_id)]
+        result['staged_files'] = [
+                staged._asdict()
+                for staged in self.get_staged_files(job_id).values()]
+        result['published_files'] = [
+                published._asdict()
+                for published in self.get_published_files(job_id).values()]
+        result['lazy_outputs'] = [
+                {'location': location, 'requested': requested}
+                for location, requested in sorted(
+                    self.get_lazy_outputs(job_id).items())]
+        return result
+
+    def vacuum(self, max_pages: int = 1000) -> None:
+        """Return unused space in the database file to the OS.
+
+        This does an incremental vacuum, freeing at most max_pages
+        pages, so that it does not keep the database locked for long.
+
+        Args:
+            max_pages: The maximum number of pages to free.
+        """
+        conn = self._thread_local_data.conn
+        conn.commit()
+        # Each step of the statement frees a single page, but the
+        # sqlite3 module steps statements without results only once.
+        # executescript() runs them to completion.
+        conn.executescript(
+            'PRAGMA incremental_vacuum({:d});'.format(max_pages))
+
     def delete_job(self, job_id: str) -> None:
         """Delete the job with the given id.
 
         Args:
             job_id: A string containing the id of the job to be deleted.
         """
+        self.flush_log()
         cursor = self._thread_local_data.conn.execute(
+            'SELECT workflow_hash FROM jobs WHERE job_id = ?', (job_id, ))
+        row = cursor.fetchone()
+        cursor.execute(
             """
                 DELETE FROM jobs WHERE job_id = ?""", (job_id, ))
         cursor.execute(
             'DELETE FROM job_log WHERE job_id = ?', (job_id, ))
+        cursor.execute(
+            'DELETE FROM job_timings WHERE job_id = ?', (job_id, ))
+        cursor.execute(
+            'DELETE FROM job_events WHERE job_id = ?', (job_id, ))
+        cursor.execute(
+            'DELETE FROM staged_files WHERE job_id = ?', (job_id, ))
+        cursor.execute(
+            'DELETE FROM published_files WHERE job_id = ?', (job_id, ))
+        cursor.execute(
+            'DELETE FROM lazy_outputs WHERE job_id = ?', (job_id, ))
+        if self._trace_file is not None:
+            self._trace_file.forget(job_id)
+        if row is not None and row[0] is not None:
+            cursor.execute(
+                """
+                    DELETE FROM workflows WHERE hash = ? AND NOT EXISTS (
+                        SELECT 1 FROM jobs WHERE workflow_hash = ?)""",
+                (row[0], row[0]))
+            if cursor.rowcount == 1:
+                cursor.execute(
+                    'DELETE FROM workflow_sources WHERE hash = ?',
+                    (row[0], ))
         self._thread_local_data.conn.commit()
         cursor.close()
@@ -1,6 +1,8 @@
+import json
 import logging
 import os
 import sqlite3
+import time
 
 import pytest
 
@@ -114,6 +116,25 @@ def test_open_existing_store_data(onejob_db):
             '258685677b034756b55bbad161b2b89b').name == 'test_sqlite_job_store'
 
 
+def test_upgrade_log(onejob_db):
+    onejob_db['conn'].execute(
+        """INSERT INTO job_log (job_id, level, time, message)
+        VALUES ('258685677b034756b55bbad161b2b89b', ?, 2, 'second')""",
+        (logging.INFO, ))
+    onejob_db['conn'].execute(
+        """INSERT INTO job_log (job_id, level, time, message)
+        VALUES ('258685677b034756b55bbad161b2b89b', ?, 1, 'first')""",
+        (logging.INFO, ))
+    onejob_db['conn'].commit()
+
+    store = SQLiteJobStore(onejob_db['file'])
+    with store:
+        job = store.get_job('258685677b034756b55bbad161b2b89b')
+        entries = list(job.get_log())
+        assert [entry.message for entry in entries] == ['first', 'second']
+        assert entries[0].seq < entries[1].seq
+
+
 def test_create_job(onejob_store):
     with onejob_store['store']:
         onejob_store['store'].create_job('test_create_job', 'file:///', '{}')
@@ -144,6 +165,95 @@ def test_get_job(onejob_store):
             onejob_store['store'].get_job('not_an_existing_job')
 
 
+def test_job_priority(onejob_store):
+    store = onejob_store['store']
+    with store:
+        old_job = store.get_job('258685677b034756b55bbad161b2b89b')
+        assert old_job.priority == 0
+        assert old_job.share_group == ''
+
+        job_id = store.create_job('sweep-0012', 'file:///', '{}', 5)
+        job = store.get_job(job_id)
+        assert job.priority == 5
+        assert job.share_group == 'sweep'
+        assert job.submit_time <= time.time()
+
+        job_id = store.create_job('job', 'file:///', '{}',
+                                  share_group='client1')
+        assert store.get_job(job_id).share_group == 'client1'
+
+
+def test_list_pending_jobs(empty_store):
+    store = empty_store['store']
+    with store:
+        sweep = [store.create_job('sweep_{}'.format(i), 'file:///', '{}')
+                 for i in range(4)]
+        other = [store.create_job('other{}'.format(i), 'file:///', '{}')
+                 for i in range(2)]
+        urgent = store.create_job('urgent', 'file:///', '{}', 10)
+        store.get_job(sweep[0]).state = JobState.RUNNING
+        store.get_job(sweep[1]).state = JobState.SUCCESS
+
+        pending = [job.id for job in store.list_pending_jobs()]
+        assert pending == [urgent, other[0], sweep[2], other[1], sweep[3]]
+
+
+def test_backoff(onejob_store):
+    store = onejob_store['store']
+    with store:
+        job = store.get_job('258685677b034756b55bbad161b2b89b')
+        assert job.backoff_count == 0
+        assert job.next_attempt_at == 0.0
+        assert store.list_backed_off_jobs() == []
+
+        now = time.time()
+        delays = [job.back_off(10.0, 25.0) for _ in range(4)]
+        assert 5.0 <= delays[0] <= 10.0
+        assert 10.0 <= delays[1] <= 20.0
+        assert 12.5 <= delays[2] <= 25.0
+        assert 12.5 <= delays[3] <= 25.0
+        assert job.backoff_count == 4
+        assert job.next_attempt_at >= now + 12.5
+
+        assert store.list_jobs(now) == []
+        assert store.list_pending_jobs(now) == []
+        assert len(store.list_jobs(now + 30.0)) == 1
+        assert len(store.list_pending_jobs(now + 30.0)) == 1
+        assert [j.id for j in store.list_backed_off_jobs()] == [job.id]
+
+        job.reset_backoff()
+        assert job.backoff_count == 0
+        assert len(store.list_jobs(now)) == 1
+        assert store.list_backed_off_jobs() == []
+
+
+def test_list_expired_jobs(onejob_store):
+    store = onejob_store['store']
+    with store:
+        job = store.get_job('258685677b034756b55bbad161b2b89b')
+        assert store.list_expired_jobs(time.time() + 1.0) == []
+
+        job.state = JobState.SUCCESS
+        assert store.list_expired_jobs(job.state_time) == []
+        expired = store.list_expired_jobs(time.time() + 1.0)
+        assert [expired_job.id for expired_job in expired] == [job.id]
+
+
+def test_export_job(onejob_store, workflow_content):
+    store = onejob_store['store']
+    with store:
+        job = store.get_job('258685677b034756b55bbad161b2b89b')
+        job.info('test_export_job')
+        job_data = store.export_job(job.id)
+        assert job_data['job_id'] == job.id
+        assert job_data['workflow'] == workflow_content
+        assert job_data['log'][0]['message'] == 'test_export_job'
+        assert job_data['events'] == []
+
+        with pytest.raises(JobNotFound):
+            store.export_job('not_an_existing_job')
+
+
 def test_delete_job(onejob_store):
     with onejob_store['store']:
         onejob_store['store'].delete_job('258685677b034756b55bbad161b2b89b')
@@ -153,6 +263,28 @@ def test_delete_job(onejob_store):
         """)
     assert len(res.fetchall()) == 0
 
+    store = onejob_store['store']
+    with store:
+        job_ids = [
+                store.create_job('big', 'file:///', json.dumps(
+                    {'data': os.urandom(16384).hex()}))
+                for _ in range(50)]
+        for job_id in job_ids:
+            store.delete_job(job_id)
+    res = onejob_store['conn'].execute('PRAGMA freelist_count')
+    free_pages = res.fetchone()[0]
+    assert free_pages > 100
+
+    with store:
+        store.vacuum(max_pages=50)
+    res = onejob_store['conn'].execute('PRAGMA freelist_count')
+    assert res.fetchone()[0] == free_pages - 50
+
+    with store:
+        store.vacuum()
+    res = onejob_store['conn'].execute('PRAGMA freelist_count')
+    assert res.fetchone()[0] == 0
+
 
 def test_reading_name(job):
     assert job.name == 'test_sqlite_job_store'
@@ -192,6 +324,213 @@ def test_state_transitions(job):
     assert job.state == JobState.STAGING_IN_CR
 
 
+def test_job_events(onejob_store):
+    store = onejob_store['store']
+    with store:
+        job_id = store.create_job('test_job_events', 'workflow', '{}')
+        job = store.get_job(job_id)
+        assert job.try_transition(JobState.SUBMITTED, JobState.STAGING_IN)
+        assert not job.try_transition(JobState.SUBMITTED, JobState.STAGING_IN)
+        job.state = JobState.WAITING
+        job.state = JobState.WAITING
+        job.state = JobState.SUCCESS
+
+        events = store.get_events(job_id)
+        assert [(from_state, to_state) for from_state, to_state, _ in events
+                ] == [(None, 'SUBMITTED'), ('SUBMITTED', 'STAGING_IN'),
+                      ('STAGING_IN', 'WAITING'), ('WAITING', 'SUCCESS')]
+        times = [t for _, _, t in events]
+        assert times == sorted(times)
+
+        durations = store.get_phase_durations(times[0], times[-1])
+        assert set(durations.keys()) == {
+                JobState.SUBMITTED, JobState.STAGING_IN, JobState.WAITING}
+        assert durations[JobState.SUBMITTED] == [times[1] - times[0]]
+        assert store.get_phase_durations(times[-1] + 1.0, time.time()) == {}
+
+        stats = store.get_phase_latency_percentiles(
+                times[0], times[-1], (50, 100))
+        assert stats[JobState.WAITING]['count'] == 1
+        assert stats[JobState.WAITING]['p50'] == times[3] - times[2]
+        assert stats[JobState.WAITING]['p100'] == times[3] - times[2]
+
+        store.delete_events(times[0])
+        assert len(store.get_events(job_id)) == 4
+        store.delete_events(times[-1] + 1.0)
+        assert store.get_events(job_id) == []
+
+        # events are deleted with their job
+        job_id = store.create_job('test_job_events', 'workflow', '{}')
+        assert len(store.get_events(job_id)) == 1
+        store.delete_job(job_id)
+        assert store.get_events(job_id) == []
+
+
+def test_timings(onejob_store):
+    store = onejob_store['store']
+    with store:
+        job = store.get_job('258685677b034756b55bbad161b2b89b')
+        with job.timing('plan_job'):
+            pass
+        job.add_timing('stage_file', 10.0, 1.5, 1000, 'input.txt')
+        job.add_timing('poll_status', 20.0, 0.5, accumulate=True)
+        job.add_timing('poll_status', 30.0, 0.25, accumulate=True)
+
+        timings = job.get_timings()
+        assert [timing.phase for timing in timings] == [
+                'stage_file', 'poll_status', 'plan_job']
+        assert timings[0].bytes == 1000
+        assert timings[0].detail == 'input.txt'
+        assert timings[1].start == 20.0
+        assert timings[1].duration == 0.75
+        assert timings[1].count == 2
+        assert timings[2].duration >= 0.0
+
+        job_data = store.export_job(job.id)
+        assert job_data['timings'][0]['phase'] == 'stage_file'
+
+        store.delete_job(job.id)
+        assert store.get_timings(job.id) == []
+
+
+def test_staged_files(onejob_store):
+    store = onejob_store['store']
+    with store:
+        job = store.get_job('258685677b034756b55bbad161b2b89b')
+        assert job.get_staged_files() == {}
+
+        job.add_staged_file('work/01_input.txt', 100, 'ab' * 32)
+        job.add_staged_file('work/02_input.txt', 50, 'cd' * 32)
+        job.add_staged_file('work/01_input.txt', 200, 'ef' * 32,
+                            'sha1$' + '01' * 20)
+
+        staged_files = job.get_staged_files()
+        assert len(staged_files) == 2
+        assert staged_files['work/01_input.txt'].size == 200
+        assert staged_files['work/01_input.txt'].hash == 'ef' * 32
+        assert staged_files['work/01_input.txt'].checksum == (
+                'sha1$' + '01' * 20)
+        assert staged_files['work/02_input.txt'].time > 0.0
+        assert staged_files['work/02_input.txt'].checksum is None
+
+        assert job.get_published_files() == {}
+        job.add_published_file('output.txt', 10, '23' * 32,
+                               'sha1$' + '45' * 20)
+        job.add_published_file('linked.txt', 20, '', None)
+        published_files = job.get_published_files()
+        assert published_files['output.txt'].size == 10
+        assert published_files['output.txt'].checksum == 'sha1$' + '45' * 20
+        assert published_files['linked.txt'].checksum is None
+
+        job_data = store.export_job(job.id)
+        assert len(job_data['staged_files']) == 2
+        assert len(job_data['published_files']) == 2
+
+        store.delete_job(job.id)
+        assert store.get_staged_files(job.id) == {}
+        assert store.get_published_files(job.id) == {}
+
+
+def test_lazy_outputs(onejob_store):
+    store = onejob_store['store']
+    with store:
+        old_job = store.get_job('258685677b034756b55bbad161b2b89b')
+        assert old_job.eager_outputs is None
+
+        job_id = store.create_job('lazy', 'file:///', '{}',
+                                  eager_outputs=['summary'])
+        job = store.get_job(job_id)
+        assert job.eager_outputs == ['summary']
+        assert job.get_lazy_outputs() == {}
+
+        job.add_lazy_output('data.csv')
+        job.add_lazy_output('plots/plot.png')
+        assert job.get_lazy_outputs() == {
+                'data.csv': False, 'plots/plot.png': False}
+        assert store.list_requested_outputs() == {}
+
+        assert store.request_lazy_output(job_id, 'data.csv')
+        assert not store.request_lazy_output(job_id, 'missing.csv')
+        assert job.get_lazy_outputs()['data.csv']
+        assert store.list_requested_outputs() == {job_id: ['data.csv']}
+
+        job.remove_lazy_output('data.csv')
+        assert not store.request_lazy_output(job_id, 'data.csv')
+        assert store.list_requested_outputs() == {}
+
+        job_data = store.export_job(job_id)
+        assert job_data['lazy_outputs'] == [
+                {'location': 'plots/plot.png', 'requested': False}]
+
+        store.delete_job(job_id)
+        assert store.get_lazy_outputs(job_id) == {}
+
+
+def test_get_staged_bytes(onejob_store):
+    store = onejob_store['store']
+    with store:
+        job = store.get_job('258685677b034756b55bbad161b2b89b')
+        assert store.get_staged_bytes([JobState.SUBMITTED]) == 0
+        job.add_staged_file('work/input.txt', 1000, 'a' * 64)
+        job.add_staged_file('work/input2.txt', 500, 'b' * 64)
+        job.add_published_file('output.txt', 2000, 'c' * 64, None)
+        assert store.get_staged_bytes([JobState.SUBMITTED]) == 1500
+
+        # staging a file again, e.g. after a restart, does not count
+        job.add_timing('stage_file', 10.0, 1.5, 1000, 'input.txt')
+        job.add_staged_file('work/input.txt', 1000, 'a' * 64)
+        assert store.get_staged_bytes([JobState.SUBMITTED]) == 1500
+        assert store.get_staged_bytes(
+                [JobState.STAGING_IN, JobState.WAITING]) == 0
+
+
+def test_trace_file(db_name, tmpdir):
+    trace_file = os.path.join(str(tmpdir), 'trace.json')
+    store = SQLiteJobStore(db_name, trace_file=trace_file)
+    with store:
+        job_id = store.create_job('test_trace_file', 'workflow', '{}')
+        job = store.get_job(job_id)
+        job.add_timing('stage_file', 10.0, 1.5, 1000, 'input.txt')
+        job.add_timing('start_job', 11.5, 0.5)
+
+    with open(trace_file) as f:
+        events = json.loads(f.read().rstrip(',\n') + ']')
+    assert events[0]['ph'] == 'M'
+    assert events[0]['args']['name'] == job_id
+    assert events[1]['name'] == 'stage_file'
+    assert events[1]['ts'] == 10000000
+    assert events[1]['dur'] == 1500000
+    assert events[1]['args']['bytes'] == 1000
+    assert events[2]['name'] == 'start_job'
+    assert events[2]['tid'] == events[1]['tid']
+
+
+def test_trace_file_close(db_name, tmpdir):
+    trace_file = os.path.join(str(tmpdir), 'trace.json')
+    store = SQLiteJobStore(db_name, trace_file=trace_file)
+    with store:
+        job_id = store.create_job('test_trace_file', 'workflow', '{}')
+        store.get_job(job_id).add_timing('stage_file', 10.0, 1.5)
+        store.delete_job(job_id)
+        assert store._trace_file._tids == {}
+    store.close()
+
+    with open(trace_file) as f:
+        assert len(json.load(f)) == 2
+
+    # after a restart, events are appended to the closed array
+    store = SQLiteJobStore(db_name, trace_file=trace_file)
+    with store:
+        job_id = store.create_job('test_trace_file', 'workflow', '{}')
+        store.get_job(job_id).add_timing('start_job', 11.5, 0.5)
+    store.close()
+
+    with open(trace_file) as f:
+        events = json.load(f)
+    assert [event['name'] for event in events] == [
+            'thread_name', 'stage_file', 'thread_name', 'start_job']
+
+
 def test_set_get_log(job):
     job.debug('debug message')
     job.info('info message')
@@ -216,6 +555,93 @@ def test_set_get_log(job):
     assert 'add_log message' in lines[5]
 
 
+def test_get_log_incremental(job):
+    for i in range(5):
+        job.info('message {}'.format(i))
+    job.debug('debug message')
+
+    until = job.last_log_seq(limit=2)
+    entries = list(job.get_log(until=until))
+    assert [entry.message for entry in entries] == ['message 0', 'message 1']
+
+    next_until = job.last_log_seq(until, min_level=logging.INFO)
+    entries = list(job.get_log(until, next_until, logging.INFO))
+    assert [entry.message for entry in entries] == [
+        'message 2', 'message 3', 'message 4']
+
+    assert job.last_log_seq(next_until, min_level=logging.INFO) == next_until
+    entries = list(job.get_log(next_until))
+    assert [entry.message for entry in entries] == ['debug message']
+
+
+def test_log_buffering(onejob_store):
+    store = SQLiteJobStore(onejob_store['store']._db_file, 1000.0)
+
+    def count_log_rows():
+        return onejob_store['conn'].execute(
+            'SELECT COUNT(*) FROM job_log').fetchone()[0]
+
+    with store:
+        job = store.get_job('258685677b034756b55bbad161b2b89b')
+        job.info('first message')
+        job.info(['second message', 'third message'])
+        assert count_log_rows() == 0
+
+        store.flush_log()
+        assert count_log_rows() == 3
+
+        job.info('fourth message')
+        assert count_log_rows() == 3
+    assert count_log_rows() == 4
+
+    with store:
+        job = store.get_job('258685677b034756b55bbad161b2b89b')
+        job.info('fifth message')
+        assert 'fifth message' in job.log
+
+
+def test_log_flush_error_on_exception(onejob_store, monkeypatch):
+    store = onejob_store['store']
+
+    def failing_flush():
+        raise sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(store, 'flush_log', failing_flush)
+
+    with pytest.raises(ValueError):
+        with store:
+            raise ValueError('original error')
+
+    with pytest.raises(sqlite3.OperationalError):
+        with store:
+            pass
+
+    monkeypatch.undo()
+    with store:
+        assert store.get_job(
+            '258685677b034756b55bbad161b2b89b').name == 'test_sqlite_job_store'
+
+
+def test_compressed_values(onejob_store):
+    large_text = '{"output": "A large output object"}\n' * 1000
+    with onejob_store['store']:
+        job = onejob_store['store'].get_job(
+            '258685677b034756b55bbad161b2b89b')
+        job.local_output = large_text
+        job.info(large_text)
+        assert job.local_output == large_text
+        assert list(job.get_log())[0].message == large_text
+
+    stored_output, = onejob_store['conn'].execute(
+        'SELECT local_output FROM jobs').fetchone()
+    assert isinstance(stored_output, bytes)
+    assert len(stored_output) < len(large_text) / 10
+
+    stored_message, = onejob_store['conn'].execute(
+        'SELECT message FROM job_log').fetchone()
+    assert isinstance(stored_message, bytes)
+
+
 def test_set_get_output(job):
     test_output = '{Testing remote output\nnot real JSON}'
     job.output = test_output
@@ -227,6 +653,46 @@ def test_set_get_workflow_content(job, workflow_content):
     assert job.workflow_content == workflow_content
 
 
+def test_workflow_deduplication(onejob_store, workflow_content):
+    store = onejob_store['store']
+    with store:
+        job_id_1 = store.create_job('job1', 'file:///wf.cwl', '{}')
+        job_id_2 = store.create_job('job2', 'file:///wf.cwl', '{}')
+        store.get_job(job_id_1).workflow_content = b'workflow'
+        store.get_job(job_id_2).workflow_content = b'workflow'
+        assert store.get_job(job_id_2).workflow_content == b'workflow'
+
+        def count_workflows():
+            return onejob_store['conn'].execute(
+                'SELECT COUNT(*) FROM workflows').fetchone()[0]
+
+        assert count_workflows() == 1
+        store.delete_job(job_id_1)
+        assert count_workflows() == 1
+        store.delete_job(job_id_2)
+        assert count_workflows() == 0
+
+
+def test_workflow_sources(onejob_store):
+    store = onejob_store['store']
+    with store:
+        assert store.get_workflow_source('file:///wf.cwl', 'v1') is None
+
+        job_id = store.create_job('job', 'file:///wf.cwl', '{}')
+        job = store.get_job(job_id)
+        job.workflow_content = b'workflow'
+        store.set_workflow_source('file:///wf.cwl', 'v1', job.workflow_hash)
+
+        assert store.get_workflow_source(
+            'file:///wf.cwl', 'v1') == job.workflow_hash
+        assert store.get_workflow_source('file:///wf.cwl', 'v2') is None
+
+        job_id_2 = store.create_job('job2', 'file:///wf.cwl', '{}')
+        job_2 = store.get_job(job_id_2)
+        job_2.workflow_hash = store.get_workflow_source('file:///wf.cwl', 'v1')
+        assert job_2.workflow_content == b'workflow'
+
+
 def test_set_get_remote_workdir_path(job):
     job.remote_workdir_path = '/test_set_get'
     assert job.remote_workdir_path == '/test_set_get'
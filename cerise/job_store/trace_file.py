@@ -0,0 +1,125 @@
+import json
+import os
+import threading
+from itertools import count
+from typing import Any, Dict, Optional
+
+
+class TraceFile:
+    """Writes job timings to a file in Chrome trace-event format.
+
+    The file can be loaded into chrome://tracing or Perfetto to see
+    what each job was doing when. Each job is shown as a separate
+    thread, named after the job's id.
+
+    Events are appended as they come in, using the JSON Array Format,
+    which allows the closing bracket to be omitted. So the file is
+    always valid, even if the process is killed. close() adds the
+    closing bracket, making the file plain JSON, and it is removed
+    again when the file is reopened after a restart, so that new
+    events can be appended.
+
+    Args:
+        path: The path of the file to write to.
+    """
+    def __init__(self, path: str) -> None:
+        self._lock = threading.Lock()
+        """Protects the file and the thread ids."""
+        self._pid = os.getpid()
+        """The process id to put in the events."""
+        self._tids = dict()  # type: Dict[str, int]
+        """Maps job ids to the thread ids used for them."""
+        self._next_tid = count(1)
+        """Generates thread ids for new jobs."""
+
+        self._is_empty = _open_array(path)
+        """Whether no events have been written to the file yet."""
+        self._file = open(path, 'a', encoding='utf-8')
+        """The file to write to."""
+
+    def write(self, job_id: str, phase: str, start: float, duration: float,
+              nbytes: Optional[int], detail: Optional[str]) -> None:
+        """Add a complete event to the trace.
+
+        Args:
+            job_id: The id of the job.
+            phase: The name of the phase.
+            start: When the phase started, as returned by time.time().
+            duration: The duration of the phase, in seconds.
+            nbytes: The number of bytes transferred, if any.
+            detail: What the phase was working on, if anything.
+        """
+        args = {'job_id': job_id}  # type: Dict[str, Any]
+        if nbytes is not None:
+            args['bytes'] = nbytes
+        if detail is not None:
+            args['detail'] = detail
+
+        with self._lock:
+            if job_id not in self._tids:
+                self._tids[job_id] = next(self._next_tid)
+                self._write_event({
+                    'name': 'thread_name', 'ph': 'M', 'pid': self._pid,
+                    'tid': self._tids[job_id], 'args': {'name': job_id}})
+
+            self._write_event({
+                'name': phase, 'cat': 'job', 'ph': 'X',
+                'ts': int(start * 1e6), 'dur': int(duration * 1e6),
+                'pid': self._pid, 'tid': self._tids[job_id], 'args': args})
+            self._file.flush()
+
+    def forget(self, job_id: str) -> None:
+        """Stop keeping track of a job, e.g. because it was deleted.
+
+        If more events are written for the job afterwards, it is
+        shown as a new thread.
+
+        Args:
+            job_id: The id of the job.
+        """
+        with self._lock:
+            self._tids.pop(job_id, None)
+
+    def close(self) -> None:
+        """Add the closing bracket and close the file."""
+        with self._lock:
+            if not self._file.closed:
+                self._file.write('\n]\n')
+                self._file.close()
+
+    def _write_event(self, event: Dict[str, Any]) -> None:
+        if not self._is_empty:
+            self._file.write(',\n')
+        self._file.write(json.dumps(event))
+        self._is_empty = False
+
+
+def _open_array(path: str) -> bool:
+    """Prepare a trace file for appending events.
+
+    Creates the file with an opening bracket if it does not exist
+    yet, and removes the closing bracket if it was closed before.
+
+    Args:
+        path: The path of the file.
+
+    Returns:
+        True iff the file does not contain any events.
+    """
+    with open(path, 'a+b') as f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            f.write(b'[\n')
+            return True
+
+        f.seek(max(0, size - 64))
+        tail = f.read()
+        stripped = tail.rstrip()
+        if stripped.endswith(b']'):
+            stripped = stripped[:-1].rstrip()
+        if stripped.endswith(b','):
+            # written by an older version, which ended each event so
+            stripped = stripped[:-1]
+        if len(stripped) < len(tail):
+            f.truncate(size - len(tail) + len(stripped))
+        return stripped.endswith(b'[')
@@ -0,0 +1,448 @@
+"""Performance metrics in the Prometheus text exposition format.
+
+This module contains a small metrics registry, and the metrics that
+the front end and the back end keep. The metrics are module-level
+objects, so that any part of Cerise can update them without having
+to pass a registry around. Each process (front end, back end) has its
+own copy, and exposes it separately.
+"""
+import bisect
+import logging
+import socketserver
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from time import perf_counter
+from typing import (TYPE_CHECKING, Callable, Dict, Generator, List,
+                    Optional, Sequence, Tuple)
+
+from cerise.job_store.job_state import JobState
+
+if TYPE_CHECKING:
+    from cerise.job_store.sqlite_job_store import SQLiteJobStore
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+"""The MIME type of the exposition format."""
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+"""Default histogram buckets, in seconds."""
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if len(names) == 0:
+        return ''
+    escaped = [
+            value.replace('\\', '\\\\').replace('"', '\\"').replace(
+                '\n', '\\n') for value in values]
+    return '{' + ','.join([
+            '{}="{}"'.format(name, value)
+            for name, value in zip(names, escaped)]) + '}'
+
+
+class _Metric(ABC):
+    """Base class for metrics.
+
+    A metric has a name, a help text and zero or more labels. For each
+    combination of label values, a separate value is kept.
+
+    Args:
+        name: The name of the metric.
+        help_text: A description of the metric.
+        label_names: Names of the labels of this metric.
+    """
+    _type = ''
+
+    def __init__(self, name: str, help_text: str,
+                 label_names: Sequence[str] = ()) -> None:
+        self.name = name
+        """The name of the metric."""
+        self._help = help_text
+        """A description of the metric."""
+        self._label_names = tuple(label_names)
+        """Names of the labels of this metric."""
+        self._lock = threading.Lock()
+        """Protects the values."""
+
+    def _check_labels(self, label_values: Sequence[str]) -> Tuple[str, ...]:
+        if len(label_values) != len(self._label_names):
+            raise ValueError('Metric {} needs labels {}'.format(
+                self.name, self._label_names))
+        return tuple(label_values)
+
+    def expose(self) -> List[str]:
+        """Return the metric in the text exposition format.
+
+        Returns:
+            A list of lines.
+        """
+        lines = [
+                '# HELP {} {}'.format(self.name, self._help),
+                '# TYPE {} {}'.format(self.name, self._type)]
+        with self._lock:
+            lines.extend(self._expose_samples())
+        return lines
+
+    @abstractmethod
+    def _expose_samples(self) -> List[str]:
+        """Return the lines for the samples of this metric.
+
+        Called with the lock held.
+        """
+
+
+class Counter(_Metric):
+    """A value that only goes up, e.g. a number of bytes transferred.
+    """
+    _type = 'counter'
+
+    def __init__(self, name: str, help_text: str,
+                 label_names: Sequence[str] = ()) -> None:
+        super().__init__(name, help_text, label_names)
+        self._values = dict()  # type: Dict[Tuple[str, ...], float]
+
+    def inc(self, amount: float = 1.0, *label_values: str) -> None:
+        """Increment the counter.
+
+        Args:
+            amount: The amount to add, must not be negative.
+            label_values: A value for each of the labels.
+        """
+        key = self._check_labels(label_values)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def get(self, *label_values: str) -> float:
+        """Return the current value.
+
+        Args:
+            label_values: A value for each of the labels.
+        """
+        with self._lock:
+            return self._values.get(self._check_labels(label_values), 0.0)
+
+    def _expose_samples(self) -> List[str]:
+        return [
+                '{}{} {}'.format(
+                    self.name, _format_labels(self._label_names, key),
+                    _format_value(value))
+                for key, value in sorted(self._values.items())]
+
+
+class Gauge(Counter):
+    """A value that can go up and down, e.g. a number of jobs.
+    """
+    _type = 'gauge'
+
+    def set(self, value: float, *label_values: str) -> None:
+        """Set the gauge to the given value.
+
+        Args:
+            value: The new value.
+            label_values: A value for each of the labels.
+        """
+        key = self._check_labels(label_values)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """A distribution of observed values, e.g. durations.
+
+    Args:
+        name: The name of the metric.
+        help_text: A description of the metric.
+        label_names: Names of the labels of this metric.
+        buckets: Upper bounds of the buckets, in increasing order.
+    """
+    _type = 'histogram'
+
+    def __init__(self, name: str, help_text: str,
+                 label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, help_text, label_names)
+        self._buckets = list(buckets) + [float('inf')]
+        """Upper bounds of the buckets."""
+        self._counts = dict()  # type: Dict[Tuple[str, ...], List[int]]
+        """Per label values, the number of observations per bucket."""
+        self._sums = dict()  # type: Dict[Tuple[str, ...], float]
+        """Per label values, the sum of the observations."""
+
+    def observe(self, value: float, *label_values: str) -> None:
+        """Add an observation.
+
+        Args:
+            value: The observed value.
+            label_values: A value for each of the labels.
+        """
+        key = self._check_labels(label_values)
+        bucket = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            if key not in self._counts:
+                self._counts[key] = [0] * len(self._buckets)
+                self._sums[key] = 0.0
+            self._counts[key][bucket] += 1
+            self._sums[key] += value
+
+    @contextmanager
+    def timer(self, *label_values: str) -> Generator[None, None, None]:
+        """Observe the duration of a with statement, in seconds.
+
+        Args:
+            label_values: A value for each of the labels.
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start, *label_values)
+
+    def get_count(self, *label_values: str) -> int:
+        """Return the number of observations.
+
+        Args:
+            label_values: A value for each of the labels.
+        """
+        with self._lock:
+            return sum(self._counts.get(self._check_labels(label_values), []))
+
+    def get_sum(self, *label_values: str) -> float:
+        """Return the sum of the observations.
+
+        Args:
+            label_values: A value for each of the labels.
+        """
+        with self._lock:
+            return self._sums.get(self._check_labels(label_values), 0.0)
+
+    def _expose_samples(self) -> List[str]:
+        lines = []
+        names = self._label_names + ('le', )
+        for key, counts in sorted(self._counts.items()):
+            total = 0
+            for bound, count in zip(self._buckets, counts):
+                total += count
+                lines.append('{}_bucket{} {}'.format(
+                    self.name,
+                    _format_labels(names, key + (_format_value(bound), )),
+                    total))
+            labels = _format_labels(self._label_names, key)
+            lines.append('{}_sum{} {}'.format(
+                self.name, labels, _format_value(self._sums[key])))
+            lines.append('{}_count{} {}'.format(self.name, labels, total))
+        return lines
+
+
+class Registry:
+    """A collection of metrics.
+
+    Besides metrics that are updated as things happen, metrics can be
+    updated just before they are exposed by registering a collector,
+    which is useful for things that are easier to count than to track.
+    """
+    def __init__(self) -> None:
+        self._metrics = []  # type: List[_Metric]
+        """The registered metrics."""
+        self._collectors = []  # type: List[Tuple[str, Callable[[], None]]]
+        """Functions to call before exposing the metrics, and names."""
+
+    def counter(self, name: str, help_text: str,
+                label_names: Sequence[str] = ()) -> Counter:
+        """Create and register a Counter."""
+        metric = Counter(name, help_text, label_names)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help_text: str,
+              label_names: Sequence[str] = ()) -> Gauge:
+        """Create and register a Gauge."""
+        metric = Gauge(name, help_text, label_names)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str,
+                  label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        """Create and register a Histogram."""
+        metric = Histogram(name, help_text, label_names, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], None],
+                      name: Optional[str] = None) -> None:
+        """Register a function that updates metrics.
+
+        A named collector replaces any earlier collector with the same
+        name, so that registering it again does not add another one.
+
+        Args:
+            collector: A function to call just before exposing.
+            name: A name for the collector, if it is to be replaced.
+        """
+        if name is not None:
+            self.remove_collector(name)
+        self._collectors.append((name or '', collector))
+
+    def remove_collector(self, name: str) -> None:
+        """Unregister the collectors with the given name.
+
+        Args:
+            name: The name given to add_collector().
+        """
+        self._collectors = [
+                (cname, collector) for cname, collector in self._collectors
+                if cname != name]
+
+    def expose(self) -> str:
+        """Return all metrics in the text exposition format.
+
+        Errors in collectors are logged, and do not stop the other
+        metrics from being exposed.
+        """
+        for _, collector in self._collectors:
+            try:
+                collector()
+            except Exception:
+                logging.getLogger(__name__).exception(
+                        'Error collecting metrics')
+
+        lines = []  # type: List[str]
+        for metric in self._metrics:
+            lines.extend(metric.expose())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+"""The registry of this process."""
+
+JOBS = REGISTRY.gauge('cerise_jobs', 'Number of jobs per state.', ['state'])
+
+BACKEND_LOOP_DURATION = REGISTRY.histogram(
+        'cerise_backend_loop_duration_seconds',
+        'Duration of an iteration of the back-end main loop.',
+        ['check_remote'])
+
+BACKEND_REMOTE_LAG = REGISTRY.gauge(
+        'cerise_backend_remote_check_lag_seconds',
+        'How much later than the configured refresh interval the'
+        ' compute resource was last checked.')
+
+SCHEDULER_CALL_DURATION = REGISTRY.histogram(
+        'cerise_scheduler_call_duration_seconds',
+        'Duration of calls to the remote scheduler.', ['operation'])
+
+STAGED_BYTES = REGISTRY.counter(
+        'cerise_staged_bytes_total', 'Number of bytes staged.',
+        ['direction'])
+
+STAGED_FILES = REGISTRY.counter(
+        'cerise_staged_files_total', 'Number of files staged.',
+        ['direction'])
+
+STAGING_DURATION = REGISTRY.counter(
+        'cerise_staging_seconds_total',
+        'Time spent staging files. Divide the increase in'
+        ' cerise_staged_bytes_total by the increase in this to get'
+        ' throughput.', ['direction'])
+
+LINKED_FILES = REGISTRY.counter(
+        'cerise_linked_files_total',
+        'Number of files staged by linking them instead of copying.'
+        ' These are also counted in cerise_staged_files_total, but'
+        ' not in cerise_staged_bytes_total.', ['direction', 'method'])
+
+WEB_CACHE_REQUESTS = REGISTRY.counter(
+        'cerise_web_cache_requests_total',
+        'Number of input files from web servers looked up in the local'
+        ' cache.', ['result'])
+
+SQLITE_QUERY_DURATION = REGISTRY.histogram(
+        'cerise_sqlite_query_duration_seconds',
+        'Duration of SQLite statements.', ['kind'])
+
+REMOTE_ERRORS = REGISTRY.counter(
+        'cerise_remote_errors_total',
+        'Number of connection problems with the compute resource.')
+
+CIRCUIT_OPEN = REGISTRY.gauge(
+        'cerise_backend_circuit_open',
+        'Whether remote work is paused because the compute resource is'
+        ' unreachable.')
+
+API_INSTALL_DURATION = REGISTRY.histogram(
+        'cerise_api_install_duration_seconds',
+        'Duration of installing the API on the compute resource.',
+        buckets=(1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0))
+
+
+JOB_STATE_COLLECTOR = 'cerise_jobs'
+"""Name of the collector added by add_job_state_collector()."""
+
+
+def add_job_state_collector(job_store: 'SQLiteJobStore') -> None:
+    """Count jobs per state in the given store whenever metrics are
+    exposed.
+
+    This replaces the collector added by an earlier call, if any.
+
+    Args:
+        job_store: The job store to count jobs in.
+    """
+    def collect() -> None:
+        with job_store:
+            counts = job_store.count_jobs_by_state()
+        for state in JobState:
+            JOBS.set(counts.get(state, 0), state.name)
+
+    REGISTRY.add_collector(collect, JOB_STATE_COLLECTOR)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Serves the metrics of a registry on /metrics."""
+    registry = REGISTRY
+
+    def do_GET(self) -> None:
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.registry.expose().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: object) -> None:
+        logging.getLogger(__name__).debug(format % args)
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_http_server(host: str, port: int,
+                      registry: Optional[Registry] = None) -> HTTPServer:
+    """Serve metrics over HTTP in a background thread.
+
+    Args:
+        host: The address to listen on.
+        port: The port to listen on, 0 to pick a free one.
+        registry: The registry to serve, REGISTRY by default.
+
+    Returns:
+        The server, call shutdown() on it to stop it.
+    """
+    handler = type('Handler', (_Handler, ),
+                   {'registry': registry or REGISTRY})
+    server = _ThreadingHTTPServer((host, port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True,
+                              name='metrics-server')
+    thread.start()
+    return server
@@ -24,6 +24,12 @@ if __name__ == "__main__":
     signal.signal(signal.SIGTERM, term_handler)
     signal.signal(signal.SIGINT, term_handler)
 
+    # Set up profiling handler
+    def profile_handler(signum: int, frame: FrameType) -> None:
+        manager.toggle_profiling()
+
+    signal.signal(signal.SIGUSR1, profile_handler)
+
     pid_file = config.get_pid_file()
     if pid_file:
         with open(pid_file, 'w') as f:
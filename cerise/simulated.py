@@ -0,0 +1,338 @@
+"""A simulated compute resource, for testing and benchmarking.
+
+This module contains Cerulean Schedulers and a FileSystem that run
+entirely on the local machine, but behave like a remote cluster
+accessed over a slow network: every call takes time, file transfers
+are limited in bandwidth, connections drop now and then, and jobs wait
+in a queue before they run.
+
+They are selected by setting the protocol of the files or jobs to
+``simulated`` in the API configuration, see Config.get_file_system()
+and Config.get_scheduler().
+"""
+import random
+import time
+import uuid
+from typing import Any, Dict, Generator, Iterable, Mapping, Optional
+
+import cerulean
+from cerulean.path import AbstractPath
+from paramiko.ssh_exception import SSHException  # type: ignore
+
+
+class Delay:
+    """A random delay, drawn from a distribution.
+
+    Args:
+        mean: The mean delay in seconds.
+        distribution: One of 'fixed' (always the mean), 'uniform'
+                (between zero and twice the mean), or 'exponential'.
+    """
+    def __init__(self, mean: float, distribution: str = 'fixed') -> None:
+        if distribution not in ['fixed', 'uniform', 'exponential']:
+            raise RuntimeError('Invalid delay distribution "{}", must be'
+                               ' one of "fixed", "uniform" or'
+                               ' "exponential".'.format(distribution))
+        self._mean = mean
+        """The mean delay in seconds."""
+        self._distribution = distribution
+        """The name of the distribution."""
+
+    def sample(self, rng: random.Random) -> float:
+        """Draw a delay.
+
+        Args:
+            rng: The random number generator to use.
+
+        Returns:
+            A delay in seconds.
+        """
+        if self._mean <= 0.0 or self._distribution == 'fixed':
+            return max(self._mean, 0.0)
+        if self._distribution == 'uniform':
+            return rng.uniform(0.0, 2.0 * self._mean)
+        return rng.expovariate(1.0 / self._mean)
+
+
+class _Simulator:
+    """Shared behaviour of the simulated scheduler and file system.
+
+    Args:
+        settings: The simulation settings from the configuration.
+    """
+    def __init__(self, settings: Mapping[str, Any]) -> None:
+        self._latency = Delay(
+            float(settings.get('latency', 0.0)),
+            settings.get('latency-distribution', 'fixed'))
+        """The delay of each call."""
+        self._failure_rate = float(settings.get('failure-rate', 0.0))
+        """The probability that a call fails."""
+        self._rng = random.Random(settings.get('seed'))
+        """Random number generator for delays and failures."""
+
+    def _simulate_call(self) -> None:
+        """Wait for the latency, and maybe fail.
+
+        Raises:
+            SSHException: If a failure was injected.
+        """
+        time.sleep(self._latency.sample(self._rng))
+        if self._rng.random() < self._failure_rate:
+            raise SSHException('Simulated connection failure')
+
+
+class _SimulatedJob:
+    """A job running on the simulated scheduler."""
+    def __init__(self, job_description: cerulean.JobDescription,
+                 start_time: float, end_time: float) -> None:
+        self.job_description = job_description
+        """The description the job was submitted with."""
+        self.start_time = start_time
+        """When the job will start running."""
+        self.end_time = end_time
+        """When the job will be done."""
+        self.exit_code = None  # type: Optional[int]
+        """The exit code, once the job is done."""
+
+
+class SimulatedScheduler(cerulean.Scheduler, _Simulator):
+    """A scheduler that pretends to run jobs.
+
+    Submitted jobs wait in the queue for a while, then run for a
+    while, and then they are done. No commands are actually executed.
+    When a job is seen to be done, whatever its standard output and
+    error files say is written to them, which for the CWL runner is
+    an empty output object and a successful final status. Cancelled
+    jobs are done immediately, with exit code 143.
+
+    Settings (all optional) are:
+
+    - latency: Mean delay of each call in seconds (0).
+    - latency-distribution: Distribution of the latency ('fixed').
+    - failure-rate: Probability of a call raising SSHException (0).
+    - queue-wait: Mean time jobs spend waiting in the queue (0).
+    - queue-wait-distribution: Its distribution ('exponential').
+    - run-time: Mean time jobs spend running (0).
+    - run-time-distribution: Its distribution ('fixed').
+    - stdout: What to write to the job's stdout file ('{}').
+    - stderr: What to write to the job's stderr file, by default a
+      successful final status line.
+    - seed: Seed for the random number generator.
+
+    Jobs are kept in memory, so they are forgotten when the
+    scheduler is deleted. Like real schedulers do eventually, it
+    reports jobs it does not know about as done.
+
+    Args:
+        settings: The simulation settings.
+    """
+    def __init__(self, settings: Mapping[str, Any]) -> None:
+        _Simulator.__init__(self, settings)
+        self._queue_wait = Delay(
+            float(settings.get('queue-wait', 0.0)),
+            settings.get('queue-wait-distribution', 'exponential'))
+        """Time a job spends in the queue."""
+        self._run_time = Delay(
+            float(settings.get('run-time', 0.0)),
+            settings.get('run-time-distribution', 'fixed'))
+        """Time a job spends running."""
+        self._stdout = settings.get('stdout', '{}\n')
+        """What to write to a finished job's stdout file."""
+        self._stderr = settings.get(
+            'stderr', 'Final process status is success\n')
+        """What to write to a finished job's stderr file."""
+        self._jobs = dict()  # type: Dict[str, _SimulatedJob]
+        """The jobs we know about, by id."""
+
+    def submit(self, job_description: cerulean.JobDescription) -> str:
+        self._simulate_call()
+        now = time.perf_counter()
+        start_time = now + self._queue_wait.sample(self._rng)
+        end_time = start_time + self._run_time.sample(self._rng)
+        job_id = uuid.uuid4().hex
+        self._jobs[job_id] = _SimulatedJob(job_description, start_time,
+                                           end_time)
+        return job_id
+
+    def get_status(self, job_id: str) -> cerulean.JobStatus:
+        self._simulate_call()
+        job = self._jobs.get(job_id)
+        if job is None:
+            return cerulean.JobStatus.DONE
+
+        now = time.perf_counter()
+        if now < job.start_time:
+            return cerulean.JobStatus.WAITING
+        if now < job.end_time:
+            return cerulean.JobStatus.RUNNING
+        if job.exit_code is None:
+            self._finish(job, 0)
+        return cerulean.JobStatus.DONE
+
+    def get_exit_code(self, job_id: str) -> Optional[int]:
+        self._simulate_call()
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        return job.exit_code
+
+    def cancel(self, job_id: str) -> None:
+        self._simulate_call()
+        job = self._jobs.get(job_id)
+        if job is not None and job.exit_code is None:
+            job.end_time = min(job.end_time, time.perf_counter())
+            job.start_time = min(job.start_time, job.end_time)
+            job.exit_code = 143
+
+    def _finish(self, job: _SimulatedJob, exit_code: int) -> None:
+        """Write the job's outputs and mark it done.
+
+        Args:
+            job: The job to finish.
+            exit_code: The exit code to give it.
+        """
+        job.exit_code = exit_code
+        lfs = cerulean.LocalFileSystem()
+        for path, content in [(job.job_description.stdout_file, self._stdout),
+                              (job.job_description.stderr_file, self._stderr)
+                              ]:
+            if path is not None:
+                (lfs / path).write_text(content)
+
+
+class SimulatedHeadNode(cerulean.Scheduler, _Simulator):
+    """A scheduler that runs commands on the local machine, slowly.
+
+    Cerise runs some commands on the head node of the compute resource
+    rather than through its scheduler, e.g. to unpack bundled input
+    files or to join file chunks. The simulated files are local, so
+    these commands are run locally, with the latency and failures of
+    the simulated connection.
+
+    Settings (all optional) are latency, latency-distribution,
+    failure-rate and seed, as for SimulatedScheduler.
+
+    Args:
+        settings: The simulation settings.
+    """
+    def __init__(self, settings: Mapping[str, Any]) -> None:
+        _Simulator.__init__(self, settings)
+        self._scheduler = cerulean.DirectGnuScheduler(
+                cerulean.LocalTerminal())
+        """Runs the commands."""
+
+    def submit(self, job_description: cerulean.JobDescription) -> str:
+        self._simulate_call()
+        return self._scheduler.submit(job_description)
+
+    def get_status(self, job_id: str) -> cerulean.JobStatus:
+        self._simulate_call()
+        return self._scheduler.get_status(job_id)
+
+    def get_exit_code(self, job_id: str) -> Optional[int]:
+        self._simulate_call()
+        return self._scheduler.get_exit_code(job_id)
+
+    def cancel(self, job_id: str) -> None:
+        self._simulate_call()
+        self._scheduler.cancel(job_id)
+
+
+class SimulatedFileSystem(cerulean.LocalFileSystem, _Simulator):
+    """A file system that behaves like a slow remote one.
+
+    Files are stored on the local file system, at the same paths, but
+    every operation is delayed, and reading and writing are limited to
+    the given bandwidth.
+
+    Settings (all optional) are:
+
+    - latency: Mean delay of each operation in seconds (0).
+    - latency-distribution: Distribution of the latency ('fixed').
+    - bandwidth: Maximum transfer rate in bytes per second, 0 for no
+      limit (0).
+    - failure-rate: Probability of an operation raising
+      SSHException (0).
+    - seed: Seed for the random number generator.
+
+    Args:
+        settings: The simulation settings.
+    """
+    def __init__(self, settings: Mapping[str, Any]) -> None:
+        cerulean.LocalFileSystem.__init__(self)
+        _Simulator.__init__(self, settings)
+        self._bandwidth = float(settings.get('bandwidth', 0.0))
+        """Maximum transfer rate in bytes per second, or 0."""
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, cerulean.FileSystem):
+            return NotImplemented
+        return other is self
+
+    def __hash__(self) -> int:
+        return id(self)
+
+    def _transfer(self, chunk: bytes) -> None:
+        """Wait for a chunk of data to be transferred."""
+        if self._bandwidth > 0.0:
+            time.sleep(len(chunk) / self._bandwidth)
+
+    def _exists(self, path: AbstractPath) -> bool:
+        self._simulate_call()
+        return super()._exists(path)
+
+    def _mkdir(self, path: AbstractPath, mode: Optional[int] = None,
+               parents: bool = False, exists_ok: bool = False) -> None:
+        self._simulate_call()
+        super()._mkdir(path, mode, parents, exists_ok)
+
+    def _iterdir(self, path: AbstractPath
+                 ) -> Generator[AbstractPath, None, None]:
+        self._simulate_call()
+        return super()._iterdir(path)
+
+    def _rmdir(self, path: AbstractPath, recursive: bool = False) -> None:
+        self._simulate_call()
+        super()._rmdir(path, recursive)
+
+    def _touch(self, path: AbstractPath) -> None:
+        self._simulate_call()
+        super()._touch(path)
+
+    def _streaming_read(self, path: AbstractPath
+                        ) -> Generator[bytes, None, None]:
+        self._simulate_call()
+        for chunk in super()._streaming_read(path):
+            self._transfer(chunk)
+            yield chunk
+
+    def _streaming_write(self, path: AbstractPath,
+                         data: Iterable[bytes]) -> None:
+        self._simulate_call()
+
+        def throttled_data() -> Iterable[bytes]:
+            for chunk in data:
+                self._transfer(chunk)
+                yield chunk
+
+        super()._streaming_write(path, throttled_data())
+
+    def _rename(self, path: AbstractPath, target: AbstractPath) -> None:
+        self._simulate_call()
+        super()._rename(path, target)
+
+    def _unlink(self, path: AbstractPath) -> None:
+        self._simulate_call()
+        super()._unlink(path)
+
+    def _entry_type(self, path: AbstractPath) -> cerulean.EntryType:
+        self._simulate_call()
+        return super()._entry_type(path)
+
+    def _size(self, path: AbstractPath) -> int:
+        self._simulate_call()
+        return super()._size(path)
+
+    def _chmod(self, path: AbstractPath, mode: int) -> None:
+        self._simulate_call()
+        super()._chmod(path, mode)
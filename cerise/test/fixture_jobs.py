@@ -146,7 +146,10 @@ class WcJob:
                 'file': {
                     'class': 'File',
                     'location': '{}/01_hello_world.txt'.format(
-                        job_remote_workdir)
+                        job_remote_workdir),
+                    'size': 58,
+                    'checksum':
+                        'sha1$5faf1adb5601fff99c0831d7e7cfc7de1dedd6b6',
                 }
             }
 
@@ -274,10 +277,16 @@ class SecondaryFilesJob:
                     'class': 'File',
                     'location': '{}/01_hello_world.txt'.format(
                         job_remote_workdir),
+                    'size': 58,
+                    'checksum':
+                        'sha1$5faf1adb5601fff99c0831d7e7cfc7de1dedd6b6',
                     'secondaryFiles': [{
                         'class': 'File',
                         'location': '{}/02_hello_world.2nd'.format(
                             job_remote_workdir),
+                        'size': 22,
+                        'checksum':
+                            'sha1$e8e2060a470614cf148ede85c3dfd2e5d789cb0b',
                     }]
                 }
             }
@@ -366,12 +375,18 @@ class FileArrayJob:
                 'files': [{
                         'class': 'File',
                         'location': '{}/01_hello_world.txt'.format(
-                            job_remote_workdir)
+                            job_remote_workdir),
+                        'size': 58,
+                        'checksum':
+                            'sha1$5faf1adb5601fff99c0831d7e7cfc7de1dedd6b6',
                     },
                     {
                         'class': 'File',
                         'location': '{}/02_hello_world.2nd'.format(
-                            job_remote_workdir)
+                            job_remote_workdir),
+                        'size': 19,
+                        'checksum':
+                            'sha1$d03def3ad95ca17651dfd281823659e710b408ff',
                     }]
             }
 
@@ -24,6 +24,19 @@ def config_1():
             'level': 'DEBUG'
         },
         'pidfile': 'test/cerise.pid',
+        'retention': {
+            'days': 7,
+            'action': 'archive',
+            'archive-dir': 'test/archive'
+        },
+        'profiling': {
+            'dir': 'test/profiles',
+            'duration': 10
+        },
+        'metrics': {
+            'port': 29595,
+            'trace-file': 'test/trace.json'
+        },
         'client-file-exchange': {
             'store-location-service': 'file:///tmp/cerise_files',
             'store-location-client': 'file:///tmp/cerise_files2'
@@ -130,6 +143,30 @@ def test_get_pid_file(config_0, config_1):
     assert config_1.get_pid_file() == 'test/cerise.pid'
 
 
+def test_get_retention(config_0, config_1):
+    assert config_0.get_retention_days() is None
+    assert config_0.get_retention_action() == 'delete'
+    assert config_0.get_archive_dir() == 'run/archive'
+    assert config_1.get_retention_days() == 7.0
+    assert config_1.get_retention_action() == 'archive'
+    assert config_1.get_archive_dir() == 'test/archive'
+
+
+def test_get_metrics(config_0, config_1):
+    assert config_0.get_metrics_port() is None
+    assert config_1.get_metrics_host() == '127.0.0.1'
+    assert config_1.get_metrics_port() == 29595
+    assert config_0.get_trace_file() is None
+    assert config_1.get_trace_file() == 'test/trace.json'
+
+
+def test_get_profiling(config_0, config_1):
+    assert config_0.get_profile_dir() == 'run/profiles'
+    assert config_0.get_profile_duration() == 60.0
+    assert config_1.get_profile_dir() == 'test/profiles'
+    assert config_1.get_profile_duration() == 10.0
+
+
 def test_has_logging(config_0, config_1):
     assert not config_0.has_logging()
     assert config_1.has_logging()
@@ -159,3 +196,131 @@ def test_get_store_location_client(config_0, config_1):
     with pytest.raises(KeyError):
         config_0.get_store_location_client()
     assert config_1.get_store_location_client() == 'file:///tmp/cerise_files2'
+
+
+def test_get_simulated_resource():
+    api_config = {
+        'compute-resource': {
+            'files': {
+                'protocol': 'simulated',
+                'path': '/tmp/cerise_simulated',
+                'simulation': {'latency': 0.01, 'bandwidth': 1000000}
+            },
+            'jobs': {
+                'protocol': 'simulated',
+                'simulation': {'queue-wait': 10.0, 'run-time': 10.0}
+            }
+        }
+    }
+    simulated_config = config.Config({}, api_config)
+    try:
+        from cerise.simulated import (SimulatedFileSystem, SimulatedHeadNode,
+                                      SimulatedScheduler)
+        assert isinstance(simulated_config.get_file_system(),
+                          SimulatedFileSystem)
+        assert str(simulated_config.get_basedir()) == '/tmp/cerise_simulated'
+
+        scheduler = simulated_config.get_scheduler()
+        assert isinstance(scheduler, SimulatedScheduler)
+        head_node = simulated_config.get_scheduler(run_on_head_node=True)
+        assert isinstance(head_node, SimulatedHeadNode)
+
+        api_config['compute-resource']['files']['link'] = True
+        assert not config.Config({}, api_config).get_link_files()
+    finally:
+        simulated_config.close_file_systems()
+
+
+def test_get_admission_limits(config_0, config_1):
+    assert config_0.get_max_staging_jobs() is None
+    assert config_0.get_max_remote_jobs() is None
+    assert config_0.get_max_staged_bytes() is None
+    assert config_0.get_max_backlog() is None
+    assert config_0.get_retry_after() == 60
+
+    limited_config = config.Config(
+            {'rest-service': {'max-backlog': 1000, 'retry-after': 30}},
+            {'compute-resource': {'jobs': {
+                'max-staging-jobs': 4,
+                'max-remote-jobs': 100,
+                'max-staged-bytes': 10000000}}})
+    assert limited_config.get_max_staging_jobs() == 4
+    assert limited_config.get_max_remote_jobs() == 100
+    assert limited_config.get_max_staged_bytes() == 10000000
+    assert limited_config.get_max_backlog() == 1000
+    assert limited_config.get_retry_after() == 30
+
+
+def test_get_backoff(config_0):
+    assert config_0.get_backoff_initial() == 10.0
+    assert config_0.get_backoff_max() == 600.0
+    assert config_0.get_circuit_breaker_threshold() == 5
+
+    backoff_config = config.Config({}, {'compute-resource': {
+        'backoff': {'initial': 1, 'max': 60, 'failures': 3}}})
+    assert backoff_config.get_backoff_initial() == 1.0
+    assert backoff_config.get_backoff_max() == 60.0
+    assert backoff_config.get_circuit_breaker_threshold() == 3
+
+
+def test_get_chunk_settings(config_0):
+    assert config_0.get_chunk_threshold() is None
+    assert config_0.get_chunk_size() == 64 * 1024 * 1024
+
+    chunk_config = config.Config({}, {'compute-resource': {
+        'files': {'chunk-threshold': 1000000, 'chunk-size': 4096}}})
+    assert chunk_config.get_chunk_threshold() == 1000000
+    assert chunk_config.get_chunk_size() == 4096
+
+
+def test_get_bundle_settings(config_0):
+    assert config_0.get_bundle_threshold() is None
+    assert config_0.get_bundle_compression() == 0
+    assert config_0.get_bundle_max_size() == 16 * 2**20
+
+    bundle_config = config.Config({}, {'compute-resource': {
+        'files': {'bundle-threshold': 100, 'bundle-compression': 6,
+                  'bundle-max-size': 1000}}})
+    assert bundle_config.get_bundle_threshold() == 100
+    assert bundle_config.get_bundle_compression() == 6
+    assert bundle_config.get_bundle_max_size() == 1000
+
+
+def test_get_link_files(config_0):
+    assert not config_0.get_link_files()
+
+    link_config = config.Config({}, {'compute-resource': {
+        'files': {'protocol': 'local', 'link': True}}})
+    assert link_config.get_link_files()
+
+
+def test_get_transfer_streams(config_0):
+    assert config_0.get_transfer_streams() == 1
+    assert config_0.get_transfer_bandwidth() is None
+
+    stream_config = config.Config({}, {'compute-resource': {
+        'files': {'protocol': 'local', 'streams': 4, 'bandwidth': 1e6}}})
+    assert stream_config.get_transfer_streams() == 4
+    assert stream_config.get_transfer_bandwidth() == 1e6
+    file_system = stream_config.get_file_system()
+    assert stream_config.get_file_system(0) is file_system
+    stream_file_system = stream_config.get_file_system(2)
+    assert stream_file_system is not file_system
+    assert stream_config.get_file_system(2) is stream_file_system
+    stream_config.close_file_systems()
+
+
+def test_get_web_settings(config_0):
+    assert config_0.get_web_connections() == 4
+    assert config_0.get_web_timeout() == 30.0
+    assert config_0.get_web_cache_dir() is None
+    assert config_0.get_web_cache_size() == 10 * 2**30
+
+    web_config = config.Config({'client-file-exchange': {
+        'web-connections': 8,
+        'web-timeout': 5,
+        'web-cache': {'dir': 'test/web_cache', 'size': 1000000}}}, {})
+    assert web_config.get_web_connections() == 8
+    assert web_config.get_web_timeout() == 5.0
+    assert web_config.get_web_cache_dir() == 'test/web_cache'
+    assert web_config.get_web_cache_size() == 1000000
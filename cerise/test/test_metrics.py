@@ -0,0 +1,108 @@
+import os
+import urllib.request
+
+import pytest
+
+import cerise.metrics as metrics
+from cerise.job_store.job_state import JobState
+from cerise.job_store.sqlite_job_store import SQLiteJobStore
+
+
+@pytest.fixture
+def registry():
+    return metrics.Registry()
+
+
+def test_counter(registry):
+    counter = registry.counter('test_total', 'A test counter.', ['kind'])
+    counter.inc(2, 'a')
+    counter.inc(1.5, 'a')
+    counter.inc(1, 'b"c')
+    assert counter.get('a') == 3.5
+
+    with pytest.raises(ValueError):
+        counter.inc(1)
+
+    lines = registry.expose().splitlines()
+    assert lines[0] == '# HELP test_total A test counter.'
+    assert lines[1] == '# TYPE test_total counter'
+    assert 'test_total{kind="a"} 3.5' in lines
+    assert 'test_total{kind="b\\"c"} 1.0' in lines
+
+
+def test_gauge(registry):
+    gauge = registry.gauge('test_gauge', 'A test gauge.')
+    gauge.set(10)
+    gauge.inc(-3)
+    assert gauge.get() == 7
+    assert 'test_gauge 7.0' in registry.expose().splitlines()
+
+
+def test_histogram(registry):
+    histogram = registry.histogram(
+            'test_seconds', 'A test histogram.', ['op'], [0.1, 1.0])
+    histogram.observe(0.05, 'x')
+    histogram.observe(0.5, 'x')
+    histogram.observe(5.0, 'x')
+    with histogram.timer('y'):
+        pass
+
+    assert histogram.get_count('x') == 3
+    assert histogram.get_sum('x') == pytest.approx(5.55)
+    assert histogram.get_count('y') == 1
+
+    lines = registry.expose().splitlines()
+    assert '# TYPE test_seconds histogram' in lines
+    assert 'test_seconds_bucket{op="x",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{op="x",le="1.0"} 2' in lines
+    assert 'test_seconds_bucket{op="x",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{op="x"} 3' in lines
+
+
+def test_collector(registry):
+    gauge = registry.gauge('test_gauge', 'A test gauge.')
+    registry.add_collector(lambda: gauge.set(42))
+    registry.add_collector(lambda: 1 / 0)
+    assert 'test_gauge 42.0' in registry.expose().splitlines()
+
+    registry.add_collector(lambda: gauge.set(1), 'test')
+    registry.add_collector(lambda: gauge.set(2), 'test')
+    assert len(registry._collectors) == 3
+    assert 'test_gauge 2.0' in registry.expose().splitlines()
+    registry.remove_collector('test')
+    assert len(registry._collectors) == 2
+
+
+def test_job_state_collector(tmpdir):
+    store = SQLiteJobStore(os.path.join(str(tmpdir), 'test_metrics.db'))
+    with store:
+        store.create_job('test_job_1', 'workflow', '{}')
+        job_id = store.create_job('test_job_2', 'workflow', '{}')
+        store.get_job(job_id).state = JobState.RUNNING
+
+    num_collectors = len(metrics.REGISTRY._collectors)
+    metrics.add_job_state_collector(store)
+    metrics.add_job_state_collector(store)
+    try:
+        assert len(metrics.REGISTRY._collectors) == num_collectors + 1
+        lines = metrics.REGISTRY.expose().splitlines()
+    finally:
+        metrics.REGISTRY.remove_collector(metrics.JOB_STATE_COLLECTOR)
+    assert len(metrics.REGISTRY._collectors) == num_collectors
+    assert 'cerise_jobs{state="SUBMITTED"} 1.0' in lines
+    assert 'cerise_jobs{state="RUNNING"} 1.0' in lines
+    assert 'cerise_jobs{state="SUCCESS"} 0.0' in lines
+    assert metrics.SQLITE_QUERY_DURATION.get_count('execute') > 0
+
+
+def test_http_server(registry):
+    registry.counter('test_total', 'A test counter.').inc()
+    server = metrics.start_http_server('127.0.0.1', 0, registry)
+    try:
+        url = 'http://127.0.0.1:{}/metrics'.format(server.server_address[1])
+        with urllib.request.urlopen(url) as response:
+            assert response.headers['Content-Type'] == metrics.CONTENT_TYPE
+            assert b'test_total 1.0' in response.read()
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,119 @@
+import random
+import time
+
+import cerulean
+import pytest
+from paramiko.ssh_exception import SSHException  # type: ignore
+
+from cerise.simulated import (Delay, SimulatedFileSystem, SimulatedHeadNode,
+                              SimulatedScheduler)
+
+
+def test_delay():
+    rng = random.Random(1)
+    assert Delay(0.5).sample(rng) == 0.5
+    assert Delay(0.0, 'exponential').sample(rng) == 0.0
+
+    uniform = [Delay(1.0, 'uniform').sample(rng) for _ in range(1000)]
+    assert min(uniform) >= 0.0
+    assert max(uniform) <= 2.0
+
+    exponential = [Delay(1.0, 'exponential').sample(rng) for _ in range(1000)]
+    assert 0.8 < sum(exponential) / 1000 < 1.2
+
+    with pytest.raises(RuntimeError):
+        Delay(1.0, 'normal')
+
+
+def test_scheduler(tmpdir):
+    scheduler = SimulatedScheduler({
+            'queue-wait': 0.1, 'queue-wait-distribution': 'fixed',
+            'run-time': 0.1})
+
+    job_desc = cerulean.JobDescription()
+    job_desc.command = 'cwltiny.py'
+    job_desc.stdout_file = str(tmpdir / 'stdout.txt')
+    job_desc.stderr_file = str(tmpdir / 'stderr.txt')
+    job_id = scheduler.submit(job_desc)
+
+    assert scheduler.get_status(job_id) == cerulean.JobStatus.WAITING
+    assert scheduler.get_exit_code(job_id) is None
+    time.sleep(0.1)
+    assert scheduler.get_status(job_id) == cerulean.JobStatus.RUNNING
+    time.sleep(0.1)
+    assert scheduler.get_status(job_id) == cerulean.JobStatus.DONE
+    assert scheduler.get_exit_code(job_id) == 0
+    assert (tmpdir / 'stdout.txt').read() == '{}\n'
+    assert 'Final process status is success' in (
+            tmpdir / 'stderr.txt').read()
+
+    assert scheduler.get_status('unknown') == cerulean.JobStatus.DONE
+
+
+def test_scheduler_cancel():
+    scheduler = SimulatedScheduler({'queue-wait': 100.0})
+    job_id = scheduler.submit(cerulean.JobDescription())
+    assert scheduler.get_status(job_id) == cerulean.JobStatus.WAITING
+    scheduler.cancel(job_id)
+    assert scheduler.get_status(job_id) == cerulean.JobStatus.DONE
+    assert scheduler.get_exit_code(job_id) == 143
+
+
+def test_scheduler_latency():
+    scheduler = SimulatedScheduler({'latency': 0.05})
+    start = time.perf_counter()
+    scheduler.get_status('unknown')
+    assert time.perf_counter() - start >= 0.05
+
+
+def test_scheduler_failures():
+    scheduler = SimulatedScheduler({'failure-rate': 1.0})
+    with pytest.raises(SSHException):
+        scheduler.submit(cerulean.JobDescription())
+
+    scheduler = SimulatedScheduler({'failure-rate': 0.5, 'seed': 42})
+    failures = 0
+    for _ in range(100):
+        try:
+            scheduler.get_status('unknown')
+        except SSHException:
+            failures += 1
+    assert 0 < failures < 100
+
+
+def test_head_node(tmpdir):
+    head_node = SimulatedHeadNode({'latency': 0.01})
+
+    job_desc = cerulean.JobDescription()
+    job_desc.command = 'bash'
+    job_desc.arguments = ['-c', '"echo test; exit 3"']
+    job_desc.stdout_file = str(tmpdir / 'stdout.txt')
+    start = time.perf_counter()
+    assert head_node.wait(head_node.submit(job_desc)) == 3
+    assert time.perf_counter() - start >= 0.02
+    assert (tmpdir / 'stdout.txt').read() == 'test\n'
+
+
+def test_file_system(tmpdir):
+    fs = SimulatedFileSystem({'bandwidth': 100000})
+    assert fs != cerulean.LocalFileSystem()
+    assert cerulean.LocalFileSystem() != fs
+    assert fs == fs
+
+    path = fs / str(tmpdir) / 'test.bin'
+    start = time.perf_counter()
+    path.write_bytes(bytes(10000))
+    assert time.perf_counter() - start >= 0.1
+    assert path.exists()
+    assert path.size() == 10000
+    assert path.read_bytes() == bytes(10000)
+
+    target = cerulean.LocalFileSystem() / str(tmpdir) / 'copy.bin'
+    cerulean.copy(path, target)
+    assert target.size() == 10000
+
+
+def test_file_system_failures(tmpdir):
+    fs = SimulatedFileSystem({'failure-rate': 1.0})
+    with pytest.raises(SSHException):
+        (fs / str(tmpdir)).exists()
@@ -0,0 +1,12 @@
+from cerise.util import percentiles
+
+
+def test_percentiles():
+    assert percentiles([]) == {'count': 0.0}
+
+    stats = percentiles(range(100, 0, -1), (1, 50, 90, 100))
+    assert stats['count'] == 100.0
+    assert stats['p1'] == 1
+    assert stats['p50'] == 50
+    assert stats['p90'] == 90
+    assert stats['p100'] == 100
@@ -1,4 +1,5 @@
-from typing import TYPE_CHECKING, Type
+import math
+from typing import TYPE_CHECKING, Dict, Iterable, Sequence, Type
 
 # See https://stackoverflow.com/questions/49959656/
 # typing-exit-in-3-5-fails-on-runtime-but-typechecks
@@ -6,3 +7,25 @@ if TYPE_CHECKING:
     BaseExceptionType = Type[BaseException]
 else:
     BaseExceptionType = None
+
+
+def percentiles(values: Iterable[float],
+                which: Sequence[int] = (50, 90, 99)) -> Dict[str, float]:
+    """Calculate percentiles using the nearest-rank method.
+
+    Args:
+        values: The values to calculate percentiles of.
+        which: The percentiles to calculate.
+
+    Returns:
+        A dictionary with the number of values under 'count', and
+        a key 'p<n>' for each percentile n. If there are no values,
+        only 'count' is present.
+    """
+    ordered = sorted(values)
+    result = {'count': float(len(ordered))}
+    if ordered != []:
+        for percentile in which:
+            rank = max(math.ceil(percentile / 100.0 * len(ordered)), 1)
+            result['p{}'.format(percentile)] = ordered[rank - 1]
+    return result